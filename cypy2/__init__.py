@@ -15,4 +15,5 @@ from cypy2 import (
 )
 
 from cypy2.managers import ActivityManager
-from cypy2.activity import (Activity, LocalActivity)
\ No newline at end of file
+from cypy2.processed_data_cache import ProcessedDataCache
+from cypy2.activity import (Activity, LazyActivity, LocalActivity)
\ No newline at end of file
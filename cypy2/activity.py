@@ -7,6 +7,7 @@ import time
 import json
 import shutil
 import pickle
+import hashlib
 import datetime
 import psycopg2
 import subprocess
@@ -16,7 +17,6 @@ import seaborn as sns
 import matplotlib as mpl
 
 from psycopg2 import sql
-from scipy import interpolate
 from matplotlib import pyplot as plt
 
 from cypy2 import (
@@ -27,6 +27,27 @@ from cypy2 import (
     constants, 
     dbutils)
 
+from cypy2.summary_stats import (SUMMARY_INPUT_COLUMNS, summarize_records)
+
+
+# the version of the processing code (Activity.process_records and the methods it calls);
+# this should be incremented whenever a change to the processing changes its output
+# (it is part of the key used to cache processed data; see Activity.processing_key)
+PROCESSING_VERSION = 2
+
+# the stages of processing that follow the interpolation of the raw records, as a small DAG:
+# each stage is a method that calculates its output columns from its input columns,
+# and a stage is run only when one of its outputs is needed and all of its inputs are available
+# (the stages must be listed after the stages on which they depend; see Activity._compute_columns)
+# 
+# the columns are all in raw units (e.g., meters) until they are converted by Activity._unit_conversions
+PROCESSING_STAGES = [
+    # (method, input columns, output columns)
+    ('_pause_mask_stage', ['elapsed_time'], ['pause_mask']),
+    ('_slopes_stage', ['elapsed_time', 'pause_mask', 'distance', 'altitude'], ['vam', 'grade']),
+    ('_power_ma_stage', ['elapsed_time', 'pause_mask', 'power'], ['power_ma']),
+]
+
 
 class Activity(object):
     '''
@@ -57,7 +78,8 @@ class Activity(object):
     events(kind='raw|processed')
 
     # time-series data from FIT file record messages
-    records(kind='raw|processed')
+    # (processed columns are calculated only as they are needed; see PROCESSING_STAGES)
+    records(kind='raw|processed', columns=None)
 
 
     TODO
@@ -79,19 +101,81 @@ class Activity(object):
         # or generated by the user calling self.process 
         self._processed_by_user = False
 
+        # the threshold power from the activity's row in raw_summary, if it was loaded 
+        # along with the metadata (see self.from_db and ActivityManager.from_db), 
+        # so that it is available without loading the raw data
+        self._raw_threshold_power = None
+
+        # the summary calculated by self.summary('processed') (or by ActivityManager.process_all)
+        # when there is no processed data, as a (raw records, summary) pair
+        self._lazy_summary = None
+
         if self.source not in ['local', 'db']:
             raise ValueError('source must be either \'local\' or \'db\'')
 
 
-    def process(self):
+    def process(self, cache=None):
         '''
         Generate the processed data (records and summary statistics) from the raw data
 
-        TODO: generate summary statistics
+        Parameters
+        ----------
+        cache : optional ProcessedDataCache; if the processed data for the activity's 
+                current processing key is in the cache, it is loaded instead of being regenerated,
+                and otherwise the newly processed data is cached
+
         '''
+        processing_key = self.processing_key()
+
+        processed_data = None
+        if cache is not None:
+            processed_data = cache.get(processing_key)
+
+        if processed_data is None:
+            processed_data = {'summary': None, 'records': None}
+            processed_data['records'] = self.process_records()
+            processed_data['summary'] = self._summarize_records(processed_data['records'])
+            processed_data['processing_key'] = processing_key
+            if cache is not None:
+                cache.save(processing_key, processed_data)
+
         self._processed_by_user = True
-        self._processed_data = {'summary': None, 'records': None}
-        self._processed_data['records'] = self.process_records()
+        self._processed_data = processed_data
+        self._lazy_summary = None
+
+
+    def processing_key(self):
+        '''
+        The key that identifies the processed data generated by self.process
+
+        This is the SHA1 hash of the contents of the raw records and events, 
+        the timestamp of the first record, the threshold power (which determines the TSS in the summary),
+        PROCESSING_VERSION, and the values in cypy2.constants, 
+        so it changes whenever any of these change (and only then). 
+        It is used to cache processed data (see ProcessedDataCache)
+        and to avoid re-inserting unchanged processed data into the database (see self.to_db).
+
+        '''
+        sha1 = hashlib.sha1()
+
+        for name in ['records', 'events']:
+            df = self._raw_data[name]
+            df = df[sorted(df.columns)]
+            sha1.update(json.dumps([list(df.columns), [str(dtype) for dtype in df.dtypes]]).encode())
+            sha1.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+
+        constants_values = {
+            name: value for name, value in vars(constants).items() 
+            if not name.startswith('_') and isinstance(value, (int, float, str))}
+
+        sha1.update(json.dumps({
+            'records_timestamp': str(self.metadata.records_timestamp),
+            'threshold_power': self.threshold_power(),
+            'processing_version': PROCESSING_VERSION,
+            'constants': constants_values,
+        }, sort_keys=True).encode())
+
+        return sha1.hexdigest()
 
 
     @classmethod
@@ -115,6 +199,11 @@ class Activity(object):
 
         # instantiate the activity
         activity = cls(metadata, source='db')
+
+        raw_summary = dbutils.get_rows(conn, 'raw_summary', selector)
+        if len(raw_summary) and 'threshold_power' in raw_summary.columns:
+            activity._raw_threshold_power = raw_summary.threshold_power.iloc[0]
+
         if kind is not None:
             activity.load(conn, kind)
 
@@ -159,12 +248,27 @@ class Activity(object):
 
         events = dbutils.get_rows(conn, 'raw_events', selector)
         records = dbutils.get_rows(conn, 'raw_records', selector)
+        return self._raw_data_from_rows(events, records)
+
+
+    @staticmethod
+    def _raw_data_from_rows(events, records):
+        '''
+        Construct an activity's raw data from its rows in the raw_events and raw_records tables
+        (this is also used by ActivityManager.from_db to split the results of bulk queries)
+
+        Parameters
+        ----------
+        events : dataframe of the activity's rows in raw_events
+        records : one-row dataframe of the activity's row in raw_records
+
+        '''
 
         # records from a one-row dataframe of lists to a dataframe of timepoints
         records = pd.DataFrame(records.to_dict(orient='records').pop())
 
         # drop activity_id columns
-        events.drop('activity_id', axis=1, inplace=True)
+        events = events.drop('activity_id', axis=1).reset_index(drop=True)
         records.drop('activity_id', axis=1, inplace=True)
 
         # drop record fields with no data
@@ -189,14 +293,33 @@ class Activity(object):
 
         query = query.format(sql.Literal(self.metadata.activity_id))
         data = pd.read_sql(query.as_string(conn), conn)
+        return self._processed_data_from_rows(data)
+
+
+    @staticmethod
+    def _processed_data_from_rows(data):
+        '''
+        Construct an activity's processed data from a one-row dataframe of its row in proc_records
+        (this is also used by ActivityManager.from_db to split the results of bulk queries)
+
+        Returns None if the dataframe is empty (i.e., if the activity has no processed data in the database)
+
+        '''
+        if not data.shape[0]:
+            return None
+
+        # the processing key is None for rows created before processing keys were recorded
+        processing_key = None
+        if 'processing_key' in data.columns:
+            processing_key = data.processing_key.iloc[0]
 
         # drop all of the non-array-type columns
         columns = [
-            'activity_id', 'commit_hash', 
+            'activity_id', 'commit_hash', 'processing_key',
             'date_created', 'date_modified', 
             'geom', 'geomz', 'geom4d']
     
-        data.drop(columns, axis=1, inplace=True, errors='ignore')
+        data = data.drop(columns, axis=1, errors='ignore')
         records = pd.DataFrame(data.to_dict(orient='records').pop())
         records.dropna(axis=1, how='all', inplace=True)
 
@@ -205,7 +328,8 @@ class Activity(object):
             if column in ['lat', 'lon']:
                 records[column] = [float(v) if v is not None else None for v in records[column]]
 
-        processed_data = {'events': None, 'summary': None, 'records': records}
+        processed_data = {
+            'events': None, 'summary': None, 'records': records, 'processing_key': processing_key}
         return processed_data
 
 
@@ -249,9 +373,12 @@ class Activity(object):
         '''
         Insert an activity's *processed* (that is, derived) data
 
-        Currently, this method always creates a new row in proc_records
-        with the latest processed records data, even if the data is unchanged
-        (since the table is keyed by (activity_id, date_created)). 
+        This method creates a new row in proc_records with the latest processed records data
+        (since the table is keyed by (activity_id, date_created)), 
+        unless the processing key of the activity's most recent row is the same 
+        as the processing key of the processed data (see self.processing_key), 
+        in which case the processed data is unchanged and nothing is inserted.
+        The processed summary is inserted into proc_summary along with the new row.
 
         conn : psycopg2 connection to the database
 
@@ -263,6 +390,22 @@ class Activity(object):
         elif not self._processed_by_user and verbose:
             print('Warning: existing processed data was loaded from the database; no need to update')
 
+        # skip the insertion if the most recent row has the same processing key
+        # (databases created before the processing_key column was added always get a new row)
+        processing_key = self._processed_data.get('processing_key')
+        table = 'proc_records'
+        activity_id = self.metadata.activity_id
+        has_processing_key = 'processing_key' in dbutils.get_column_names(conn, table)
+        if processing_key is not None and has_processing_key:
+            query = sql.SQL('''
+                select processing_key from proc_records where activity_id = {} 
+                order by date_created desc limit 1''').format(sql.Literal(activity_id))
+            rows = pd.read_sql(query.as_string(conn), conn)
+            if len(rows) and rows.processing_key.iloc[0]==processing_key:
+                if verbose:
+                    print('\nProcessed data for activity %s is unchanged; not inserting a new row' % activity_id)
+                return
+
         # get the current commit in the cypy2 repo
         repo = git.Repo('../')
         current_commit = repo.commit().hexsha
@@ -276,9 +419,9 @@ class Activity(object):
         # Create a new row in the proc_records table and get its primary key
         #
         # ----------------------------------------------------------------------------------------
-        table = 'proc_records'
-        activity_id = self.metadata.activity_id
         values = {'activity_id': activity_id, 'commit_hash': current_commit}
+        if processing_key is not None and has_processing_key:
+            values['processing_key'] = processing_key
 
         try:
             dbutils.insert_row(conn, table, values)
@@ -316,6 +459,21 @@ class Activity(object):
                     selector=selector)
         conn.commit()
 
+        # ----------------------------------------------------------------------------------------
+        #
+        # Insert the processed summary into the proc_summary table
+        # (if the database has one; it was added after proc_records)
+        #
+        # ----------------------------------------------------------------------------------------
+        summary_columns = dbutils.get_column_names(conn, 'proc_summary')
+        if summary_columns:
+            summary = self.summary(kind='processed')
+            if processing_key is not None:
+                summary['processing_key'] = processing_key
+            summary = summary[[column for column in summary.columns if column in summary_columns]]
+            dbutils.dataframe_to_table(conn, 'proc_summary', summary, raise_errors=True)
+            conn.commit()
+
         # ----------------------------------------------------------------------------------------
         #
         # Populate the geometry columns of the new row
@@ -377,10 +535,62 @@ class Activity(object):
          - calculates 30-second moving average of power
          - various unit conversions
 
+        All of the processed columns are calculated here; 
+        to calculate only some of them, use self.records('processed', columns=[...]).
+
+        '''
+        if hack:
+            return self._processed_records(self._processing_state(hack=True))
+        return self._lazily_processed_records()
+
+
+    def _lazily_processed_records(self, columns=None):
+        '''
+        Processed records calculated from the raw data (see self.records), 
+        starting from the processing state returned by self._get_processing_state
+        '''
+        state = self._get_processing_state()
+        records = self._processed_records(state, columns)
+        self._keep_processing_state(state)
+        return records
+
+
+    def _get_processing_state(self):
+        '''
+        The processing state from which to calculate processed columns
 
+        An Activity does not keep its processing state, so this is always a new state 
+        (otherwise, the processed columns would be held by the activity outside of any memory budget);
+        LazyActivity keeps it, along with the loaded data, in its manager's LRU cache
         '''
+        return self._processing_state()
+
 
-        records = self.records('raw').reset_index()
+    def _keep_processing_state(self, state):
+        '''
+        Called with the processing state after processed columns have been calculated from it
+        '''
+        pass
+
+
+    def _processing_state(self, hack=False):
+        '''
+        Prepare the raw records for processing
+
+        Returns
+        -------
+        state : dict of 
+            'raw_records': the raw records from which the state was prepared
+            'records': the renamed raw records, with elapsed time in seconds 
+                       (but not yet interpolated)
+            'columns': dict of the processed columns (in raw units) calculated so far, 
+                       keyed by column name (see self._compute_columns)
+            'pauses': the activity's pauses (see self.pauses), or None if not yet needed
+
+        '''
+
+        raw_records = self._raw_data['records']
+        records = raw_records.reset_index()
 
         # ----------------------------------------------------------------------------------------
         #
@@ -416,68 +626,163 @@ class Activity(object):
         # calculate elapsed time in seconds and drop the timepoint column
         #
         # ----------------------------------------------------------------------------------------
-        timestamps = records.timepoint.apply(pd.to_datetime)
-        records['elapsed_time'] = [dt.seconds for dt in (timestamps - timestamps[0])]
+        # (the arithmetic is on int64 nanoseconds, and elapsed times are rounded down to whole seconds)
+        timestamps = pd.to_datetime(records.timepoint).values.astype('datetime64[ns]').astype(np.int64)
         records.drop(['timepoint'], axis=1, inplace=True)
+        records.insert(0, 'elapsed_time', (timestamps - timestamps[0]) // 10**9)
 
+        return {'raw_records': raw_records, 'records': records, 'columns': {}, 'pauses': None}
 
-        # ----------------------------------------------------------------------------------------
-        #
-        # interpolate the raw records and calculate the pause mask
-        #
-        # ----------------------------------------------------------------------------------------
-        records = self._interpolate_records(records, constants.interpolation_timestep)
-        records['pause_mask'] = self._calculate_pause_mask(records)
 
+    def _processed_records(self, state, columns=None):
+        '''
+        Construct a dataframe of processed records from a processing state,
+        calculating whichever of the columns have not already been calculated
 
-        # ----------------------------------------------------------------------------------------
-        #
-        # calculate VAM and grade
-        # 
-        # note that activities from Wahoo have a raw 'grade' column, 
-        # which will be overwritten here
-        #
-        # ----------------------------------------------------------------------------------------
-        if 'altitude' in records.columns:
-            vam, grade = self._calculate_slopes(records)
-            records['vam'] = vam
-            records['grade'] = grade
+        Parameters
+        ----------
+        state : the processing state (see self._processing_state)
+        columns : optional list of the processed columns to include; if None, all are included
+                  (columns that cannot be calculated for this activity are omitted)
 
+        '''
 
-        # ----------------------------------------------------------------------------------------
-        #
-        # 30-second moving average of power
-        # (for calculating normalized power)
-        #
-        # ----------------------------------------------------------------------------------------
-        if 'power' in records.columns:
-            records['power_ma'] = self._calculate_moving_average(records, 'power', window_size=30)
+        available_columns = self._available_columns(state)
+        if columns is None:
+            columns = available_columns
+        else:
+            columns = [column for column in available_columns if column in columns]
 
+        self._compute_columns(state, columns)
 
-        # ----------------------------------------------------------------------------------------
-        #
-        # unit conversions
-        #
-        # ----------------------------------------------------------------------------------------
-        # lat/lon coordinates from semicircles to degrees 
-        # (note that indoor rides don't have these columns)
-        if 'lat' in records.columns:
-            records['lat'] *= constants.semicircles_to_degrees
-            records['lon'] *= constants.semicircles_to_degrees
+        conversions = self._unit_conversions()
+        records = pd.DataFrame({
+            column: state['columns'][column]*conversions[column] 
+            if column in conversions else state['columns'][column]
+            for column in columns
+        })
+        return records
 
-        # m/s to mph
-        if 'speed' in records.columns:
-            records['speed'] *= (constants.miles_per_meter * constants.seconds_per_hour)
 
-        # meters to feet
-        if 'altitude' in records.columns:
-            records['altitude'] *= constants.feet_per_meter
+    @staticmethod
+    def _available_columns(state):
+        '''
+        All of the processed columns that can be calculated from the raw records, in order
+        (the raw columns, followed by the outputs of the processing stages whose inputs are available)
+        '''
+        columns = list(state['records'].columns)
+        for _, inputs, outputs in PROCESSING_STAGES:
+            if set(inputs).issubset(columns):
+                columns.extend([column for column in outputs if column not in columns])
+        return columns
 
-        # meters to miles
-        if 'distance' in records.columns:
-            records['distance'] *= constants.miles_per_meter
 
-        return records
+    def _compute_columns(self, state, columns):
+        '''
+        Calculate the processed columns (in raw units) that are needed for the given columns
+        and that have not already been calculated, and add them to state['columns']
+
+        The needed raw columns are first interpolated together (see self._interpolate_records),
+        and then the needed processing stages are run in the order in which they appear in PROCESSING_STAGES.
+        A column that is both a raw column and the output of a stage (e.g., the 'grade' column 
+        of activities from Wahoo) is calculated by the stage if the stage's inputs are available.
+
+        '''
+        computed = state['columns']
+        raw_columns = list(state['records'].columns)
+
+        # the stage that calculates each column (if its inputs are available)
+        stages_by_column = {}
+        for stage in PROCESSING_STAGES:
+            for column in stage[2]:
+                stages_by_column[column] = stage
+
+        available_columns = set(self._available_columns(state))
+
+        # the dependencies of the requested columns
+        needed_raw_columns, needed_stages = [], []
+        def require(column):
+            if column in computed or column in needed_raw_columns:
+                return
+            stage = stages_by_column.get(column)
+            if stage is not None and set(stage[1]).issubset(available_columns):
+                if stage not in needed_stages:
+                    for input_column in stage[1]:
+                        require(input_column)
+                    needed_stages.append(stage)
+            elif column in raw_columns:
+                needed_raw_columns.append(column)
+
+        for column in columns:
+            require(column)
+
+        # the elapsed time is always needed, since it is the new timepoints of the interpolation
+        if 'elapsed_time' not in computed:
+            needed_raw_columns.append('elapsed_time')
+
+        if needed_raw_columns:
+            records = state['records']
+            interpolated_records = self._interpolate_records(
+                records[['elapsed_time'] + [c for c in raw_columns if c in needed_raw_columns and c!='elapsed_time']], 
+                constants.interpolation_timestep)
+            for column in interpolated_records.columns:
+                computed[column] = interpolated_records[column].values
+
+        for stage in PROCESSING_STAGES:
+            if stage not in needed_stages:
+                continue
+            method, inputs, outputs = stage
+            records = pd.DataFrame({column: computed[column] for column in inputs})
+            computed.update(getattr(self, method)(records, state))
+
+
+    def _pauses_for_state(self, state):
+        '''
+        The activity's pauses, which are shared by the processing stages
+        '''
+        if state['pauses'] is None:
+            state['pauses'] = self.pauses()
+        return state['pauses']
+
+
+    def _pause_mask_stage(self, records, state):
+        return {'pause_mask': self._pauses_for_state(state).mask(records.elapsed_time.values)}
+
+
+    def _slopes_stage(self, records, state):
+        '''
+        VAM and grade from the altitude
+
+        Note that activities from Wahoo have a raw 'grade' column, which is overwritten here
+        '''
+        vam, grade = self._calculate_slopes(records, pauses=self._pauses_for_state(state))
+        return {'vam': vam, 'grade': grade}
+
+
+    def _power_ma_stage(self, records, state):
+        '''
+        30-second moving average of power (for calculating normalized power)
+        '''
+        power_ma = self._calculate_moving_average(
+            records, 'power', window_size=30, pauses=self._pauses_for_state(state))
+        return {'power_ma': power_ma}
+
+
+    @staticmethod
+    def _unit_conversions():
+        '''
+        The multiplicative unit conversions of the processed columns, keyed by column
+
+        lat/lon coordinates from semicircles to degrees (note that indoor rides don't have these columns),
+        speed from m/s to mph, altitude from meters to feet, and distance from meters to miles
+        '''
+        return {
+            'lat': constants.semicircles_to_degrees,
+            'lon': constants.semicircles_to_degrees,
+            'speed': constants.miles_per_meter * constants.seconds_per_hour,
+            'altitude': constants.feet_per_meter,
+            'distance': constants.miles_per_meter,
+        }
 
 
     @staticmethod
@@ -486,55 +791,67 @@ class Activity(object):
         Interpolate records to constant one-second sampling
 
         Note that this is not always necessary, since for many activities,
-        the sampling rate is already constant (i.e., not variable/dynamic) 
+        the sampling rate is already constant (i.e., not variable/dynamic);
+        in this case, the records are not interpolated at all (except to fill internal NaNs)
+
+        The columns without internal NaNs are interpolated together, as one 2D array;
+        the columns with internal NaNs are interpolated separately, with the NaNs omitted
 
         '''
 
         timepoints = records.elapsed_time.values
         new_timepoints = np.arange(0, timepoints[-1], timestep)
 
-        new_records = pd.DataFrame()
-        new_records['elapsed_time'] = new_timepoints
+        columns = [column for column in records.columns if column!='elapsed_time']
+        values = records[columns].values.astype(float)
+        new_values = np.empty((len(new_timepoints), len(columns)))
+
+        # internal NaNs (that is, NaNs that are not part of a run of leading or trailing NaNs)
+        internal_nans = utils.mask_internal_nans(values)
+        has_internal_nans = internal_nans.any(axis=0)
 
-        # interpolate each column with the new timepoints
-        for column in set(records.columns).difference(['elapsed_time']):
-            values = records[column].values
-            mask = utils.mask_internal_nans(values)
-            interpolator = interpolate.interp1d(timepoints[~mask], values[~mask], kind='linear')
-            new_records[column] = interpolator(new_timepoints)
+        # fast path for records that are already sampled at the new timepoints
+        if len(timepoints) > len(new_timepoints) and \
+            np.array_equal(timepoints[:len(new_timepoints)], new_timepoints):
+            new_values[:] = values[:len(new_timepoints)]
+        else:
+            new_values[:, ~has_internal_nans] = utils.interpolate_columns(
+                timepoints, values[:, ~has_internal_nans], new_timepoints)
 
+        # the columns with internal NaNs are interpolated with the NaNs omitted
+        for ind in np.flatnonzero(has_internal_nans):
+            mask = internal_nans[:, ind]
+            new_values[:, ind] = utils.interpolate_columns(
+                timepoints[~mask], values[~mask, ind][:, None], new_timepoints)[:, 0]
+
+        new_records = pd.DataFrame(data=new_values, columns=columns)
+        new_records.insert(0, 'elapsed_time', new_timepoints)
         return new_records
 
 
-    def _calculate_pause_mask(self, records):
+    def pauses(self):
         '''
-        Generate a pause mask from the pauses implied by in-activity start and stop events 
-
-        Parameters
-        ----------
-        records : interpolated records
+        The pauses implied by the in-activity stop and start events, as a utils.PauseIntervals object
+        (with elapsed times relative to the timestamp of the first record)
 
         '''
 
         # timestamp of the first record 
         # (i.e., the timestamp corresponding to records.elapsed_time==0)
         t0 = pd.to_datetime(self.metadata.records_timestamp)
+        return utils.PauseIntervals.from_events(self.events('raw'), t0)
 
-        # remove initial start time and final stop time
-        events = self.events('raw').iloc[1:-1]
-
-        starts = events.loc[events.event_type=='start'].event_time
-        stops = events.loc[events.event_type=='stop'].event_time
 
-        elapsed_time = records.elapsed_time.values
-        mask =  np.zeros(*elapsed_time.shape)
+    def _calculate_pause_mask(self, records):
+        '''
+        Generate a pause mask from the pauses implied by in-activity start and stop events 
 
-        for start, stop in zip(starts, stops):
-            pause_start, pause_stop = (stop - t0).seconds, (start - t0).seconds
-            mask += (elapsed_time > pause_start) & (elapsed_time < pause_stop)
+        Parameters
+        ----------
+        records : interpolated records
 
-        mask = mask.astype(bool)
-        return mask
+        '''
+        return self.pauses().mask(records.elapsed_time.values)
 
 
     def _infer_pauses(self):
@@ -557,30 +874,30 @@ class Activity(object):
 
 
     @staticmethod
-    def _calculate_moving_average(records, column, window_size):
+    def _calculate_moving_average(records, column, window_size, pauses=None):
         '''
         Calculate a moving average of one column of the records dataframe
         The moving average is nan whenever the window overlaps a pause,
-        according to the values in records.pause_mask
+        according to the pauses (a utils.PauseIntervals object) if they are given, 
+        or otherwise according to the values in records.pause_mask
 
         '''
         # check for constant timestep
         assert set(np.diff(records.index.values))==set([1])
 
-        windows = utils.sliding_window(records[column].values, window_size, 1)
-        pause_windows = utils.sliding_window(records.pause_mask.values, window_size, 1)
+        if pauses is None:
+            pause_mask = records.pause_mask.values
+        else:
+            pause_mask = pauses.mask(records.elapsed_time.values)
 
-        # use the fact that np.mean returns nan when any value is nan
-        # to set the average to nan whenever the window overlaps a pause
-        windows[pause_windows] = np.nan
-        ma = np.mean(windows, axis=1)
-        ma = np.concatenate(([np.nan] * (window_size - 1), ma))
+        # the moving average is nan whenever the window contains a nan or overlaps a pause
+        ma = utils.rolling_mean(records[column].values, window_size, pause_mask=pause_mask)
 
         return ma
 
 
     @staticmethod
-    def _calculate_slopes(records):
+    def _calculate_slopes(records, pauses=None):
         '''
         Calculate time and distance derivatives of the altitude 
         using an exponentially weighted linear regression in a moving window
@@ -600,6 +917,8 @@ class Activity(object):
         ----------
         records : DataFrame of raw distance and altitude values in meters, 
                   indexed by elapsed time and interpolated to a constant one-second timestep
+        pauses : optional utils.PauseIntervals object; if None, the pauses are inferred 
+                 from records.pause_mask
 
         '''
 
@@ -617,38 +936,67 @@ class Activity(object):
         weights /= weights.sum()
         weights = weights[::-1]
 
-        time_window = np.arange(window_sz)
-        pause_windows = utils.sliding_window(records.pause_mask.values, window_sz, 1)
-        distance_windows = utils.sliding_window(records.distance.values, window_sz, 1)
-        altitude_windows = utils.sliding_window(records.altitude.values, window_sz, 1)
-
-        vam, grade = [], []
-        for dist_window, alt_window, pause_window in zip(distance_windows, altitude_windows, pause_windows):
-
-            if np.any(pause_window):
-                vam.append(np.nan)
-                grade.append(np.nan)
-                continue
-            
-            # calculate the VAM   
-            # (no need to worry about LinAlgError here because time_window is always the same)
-            slope, offset, residual = utils.weighted_linregress(time_window, alt_window, weights)
-            vam.append(slope)
+        # ----------------------------------------------------------------------------------------
+        #
+        # the weighted linear regression in every window, all at once
+        #
+        # the slope of a weighted linear regression of y on x is
+        # (Sw*Swxy - Swx*Swy)/(Sw*Swxx - Swx**2), where Sw is the sum of the weights,
+        # Swx is the weighted sum of x, etc, so it is calculated from five weighted sums, 
+        # each of which is the correlation of an array with the weights
+        # (because the weights are fixed, this is exactly the regression 
+        # that utils.weighted_linregress calculates for each window)
+        #
+        # ----------------------------------------------------------------------------------------
+        def weighted_sums(values):
+            return np.correlate(values, weights, mode='valid')
 
-            # calculate the grade
-            try:
-                slope, offset, residual = utils.weighted_linregress(dist_window, alt_window, weights)
-            except np.linalg.LinAlgError:
-                slope = np.nan
+        def slopes(Sw, Swx, Swy, Swxx, Swxy):
+            with np.errstate(divide='ignore', invalid='ignore'):
+                return (Sw*Swxy - Swx*Swy)/(Sw*Swxx - Swx**2)
 
-            # hard-coded cutoff on realistic slopes
-            # (noise can lead to very high slopes)            
-            if np.abs(slope) > .3:
-                slope = np.nan
-            grade.append(slope)
+        # subtract the mean distance and altitude to limit the loss of precision in the sums
+        distance = records.distance.values.astype(float)
+        altitude = records.altitude.values.astype(float)
+        distance = distance - np.nanmean(distance)
+        altitude = altitude - np.nanmean(altitude)
 
+        Sw = weights.sum()
+        Swy = weighted_sums(altitude)
 
-        vam, grade  = np.array(vam), np.array(grade)
+        # VAM (the time derivative; x is the time within the window, so Swx and Swxx are constants)
+        time_window = np.arange(window_sz)
+        vam = slopes(
+            Sw, 
+            (weights*time_window).sum(), 
+            Swy, 
+            (weights*time_window**2).sum(), 
+            np.correlate(altitude, weights*time_window, mode='valid'))
+
+        # grade (the distance derivative)
+        grade = slopes(
+            Sw, 
+            weighted_sums(distance), 
+            Swy, 
+            weighted_sums(distance**2), 
+            weighted_sums(distance*altitude))
+
+        # the regression is singular, and the grade undefined, when the distance is constant 
+        # (this is where utils.weighted_linregress raises a LinAlgError)
+        distance_windows = utils.sliding_window(distance, window_sz, 1, copy=False)
+        grade[distance_windows.max(axis=1)==distance_windows.min(axis=1)] = np.nan
+
+        # hard-coded cutoff on realistic slopes
+        # (noise can lead to very high slopes)
+        with np.errstate(invalid='ignore'):
+            grade[np.abs(grade) > .3] = np.nan
+
+        # the slopes are undefined when the window overlaps a pause
+        if pauses is None:
+            pauses = utils.PauseIntervals.from_mask(records.elapsed_time.values, records.pause_mask.values)
+        paused_windows = pauses.window_mask(records.elapsed_time.values, window_sz)[(window_sz - 1):]
+        vam[paused_windows] = np.nan
+        grade[paused_windows] = np.nan
 
         # add back the missing initial values
         vam = np.concatenate(([np.nan] * (window_sz - 1), vam))
@@ -663,11 +1011,74 @@ class Activity(object):
     def summary(self, kind='raw'):
         '''
         Summary statistics
+
+        The raw summary is from the FIT file's 'session' message; the processed summary 
+        is generated from the processed records (see self.summarize), by self.process
+        or, if the processed data does not include a summary, when it is first needed
+
         '''
         if kind=='raw':
             return self._raw_data['summary'].copy()
+
+        elif kind.startswith('proc'):
+            processed_data = self._processed_data
+            if processed_data is None:
+                raw_records = self._raw_data['records']
+                if self._lazy_summary is None or self._lazy_summary[0] is not raw_records:
+                    self._lazy_summary = (raw_records, self.summarize())
+                return self._lazy_summary[1].copy()
+
+            if processed_data.get('summary') is None:
+                processed_data['summary'] = self.summarize()
+            return processed_data['summary'].copy()
+
         else:
-            raise NotImplementedError
+            raise ValueError('kind must be \'raw\' or \'proc\'')
+
+
+    def summarize(self, threshold_power=None):
+        '''
+        Generate summary statistics from the processed records (see summary_stats.summarize_records)
+        
+        Parameters
+        ----------
+        threshold_power : optional threshold power in watts, for the intensity factor and TSS; 
+                          if None, the threshold power from the raw summary is used (if there is one)
+
+        Returns
+        -------
+        summary : one-row dataframe of summary statistics, with an activity_id column
+
+        '''
+        records = self.records('processed', columns=SUMMARY_INPUT_COLUMNS)
+        return self._summarize_records(records, threshold_power)
+
+
+    def _summarize_records(self, records, threshold_power=None):
+        if threshold_power is None:
+            threshold_power = self.threshold_power()
+
+        summary = summarize_records(records, threshold_powers=threshold_power)
+        summary.insert(0, 'activity_id', self.metadata.activity_id)
+        return summary
+
+
+    def threshold_power(self):
+        '''
+        The threshold power from the raw summary (i.e., from the FIT file), 
+        or None if there is no raw summary or it does not include a threshold power
+
+        If the raw summary's threshold power was loaded along with the metadata 
+        (by self.from_db or ActivityManager.from_db), it is used without loading the raw data
+        '''
+        threshold_power = self._raw_threshold_power
+        if threshold_power is None:
+            raw_data = self._raw_data
+            summary = raw_data.get('summary') if raw_data is not None else None
+            if summary is not None and 'threshold_power' in summary.columns and len(summary):
+                threshold_power = summary.threshold_power.iloc[0]
+
+        return None if threshold_power is None or pd.isna(threshold_power) else float(threshold_power)
 
 
     def events(self, kind='raw'):
@@ -680,12 +1091,41 @@ class Activity(object):
             raise ValueError('events data is only raw')
 
 
-    def records(self, kind='raw'):
+    def records(self, kind='raw', columns=None):
+        '''
+        Raw or processed records
+
+        If the activity's processed data has not been generated (by self.process) or loaded,
+        only the requested processed columns (and the columns they depend on) are calculated 
+        from the raw data (see self._compute_columns); this means that, e.g., 
+        self.records('processed', columns=['power']) does not calculate the slopes 
+        or the unit conversions of the other columns. For a LazyActivity, the calculated columns 
+        are kept for subsequent calls in the manager's LRU cache (see LazyActivity._get_processing_state).
+
+        Parameters
+        ----------
+        kind : 'raw' or 'processed'
+        columns : optional list of the columns to return; if None, all of the columns are returned
+                  (columns that do not exist are omitted)
+
+        '''
 
         if kind=='raw':
-            records = self._raw_data['records'].copy()
+            records = self._raw_data['records']
+            if columns is not None:
+                records = records[[column for column in records.columns if column in columns]]
+            records = records.copy()
+
         elif kind.startswith('proc'):
-            records = self._processed_data['records'].copy()
+            processed_data = self._processed_data
+            if processed_data is None:
+                return self._lazily_processed_records(columns)
+
+            records = processed_data['records']
+            if columns is not None:
+                records = records[[column for column in records.columns if column in columns]]
+            records = records.copy()
+
         else:
             raise ValueError('kind must be \'raw\' or \'proc\'')
 
@@ -722,8 +1162,12 @@ class Activity(object):
             return rects
 
 
+        if isinstance(columns, str):
+            columns = [columns]
+
         draw_pauses = True
-        records = self.records('processed')
+        records = self.records(
+            'processed', columns=['elapsed_time', 'distance', 'pause_mask'] + list(columns))
 
         if xmode in ['seconds', 'minutes', 'hours']:
             x = records.elapsed_time.values
@@ -758,9 +1202,6 @@ class Activity(object):
                 stops = list(stops) + [max(xrange)]
 
 
-        if isinstance(columns, str):
-            columns = [columns]
-        
         if overlay:
             fig, left_ax = plt.subplots(1, 1, figsize=(12, 2))
             right_ax = left_ax.twinx()
@@ -795,6 +1236,127 @@ class Activity(object):
 
 
 
+class LazyActivity(Activity):
+    '''
+    An activity from a cypy2 database whose raw and processed data 
+    are loaded from the database when they are first accessed (e.g., by records() or events())
+
+    The loaded data is held in a cache that is shared by all of the activities in an ActivityManager 
+    (usually a utils.LRUCache with a memory budget), so that the data of activities 
+    that have not been accessed recently is evicted from memory (and reloaded if it is accessed again).
+
+    Processed data that is generated by calling self.process is held by the activity itself,
+    since it cannot be reloaded from the database.
+
+    Parameters
+    ----------
+    metadata : activity metadata as a pd.Series
+    conn : psycopg2 connection to the database
+    cache : the cache of loaded data, keyed by (activity_id, kind)
+
+    '''
+
+    def __init__(self, metadata, conn, cache):
+        self._conn = conn
+        self._cache = cache
+        self._data = {'raw': None, 'processed': None}
+        super().__init__(metadata, source='db')
+
+
+    @property
+    def _raw_data(self):
+        return self._get_data('raw')
+
+    @_raw_data.setter
+    def _raw_data(self, data):
+        self._data['raw'] = data
+
+
+    @property
+    def _processed_data(self):
+        return self._get_data('processed')
+
+    @_processed_data.setter
+    def _processed_data(self, data):
+        self._data['processed'] = data
+
+
+    def _get_data(self, kind):
+        '''
+        Get the raw or processed data, from the activity itself, from the cache, 
+        or, if it is in neither, from the database (in which case it is then cached)
+        '''
+        if self._data[kind] is not None:
+            return self._data[kind]
+
+        key = (self.metadata.activity_id, kind)
+        data = self._cache.get(key)
+        if data is None:
+            if kind=='raw':
+                data = self._raw_data_from_db(self._conn)
+            else:
+                data = self._processed_data_from_db(self._conn)
+
+            # an empty dict records that the activity has no data of this kind in the database
+            # (e.g., no row in proc_records), so that the database is not queried again
+            if data is None:
+                data = {}
+            self._cache.put(key, data)
+
+        # (in which case the processed records and summary are calculated from the raw data; 
+        # see Activity.records)
+        return data or None
+
+
+    def _get_processing_state(self):
+        '''
+        The processing state, from the cache if it is there 
+        (it is rebuilt if it has been evicted, or if the raw data has changed)
+
+        The state is cached under (activity_id, 'processing'), so that the processed columns 
+        calculated by self.records('processed', columns=[...]) are reused by later calls
+        but count against the same memory budget as the loaded data
+        '''
+        state = self._cache.get((self.metadata.activity_id, 'processing'))
+        if state is None or state['raw_records'] is not self._raw_data['records']:
+            state = self._processing_state()
+        return state
+
+
+    def _keep_processing_state(self, state):
+        # (the state is put in the cache again each time, so that its size includes the new columns)
+        self._cache.put((self.metadata.activity_id, 'processing'), state)
+
+
+    def process(self, cache=None):
+        '''
+        Generate the processed data (see Activity.process), 
+        and drop the cached processing state, which is no longer needed
+        '''
+        super().process(cache)
+        key = (self.metadata.activity_id, 'processing')
+        if key in self._cache:
+            self._cache.pop(key)
+
+
+    def load(self, conn, kind='raw'):
+        '''
+        Load (and cache) the activity's data from the database,
+        if it is not already cached (see Activity.load)
+        '''
+        if kind is None:
+            return
+
+        if kind not in ['raw', 'processed', 'all']:
+            raise ValueError('%s is not a valid kind of data' % kind)
+
+        self._conn = conn
+        for kind_ in ['raw', 'processed']:
+            if kind in [kind_, 'all']:
+                self._get_data(kind_)
+
+
+
 class LocalActivity(Activity):
     '''
     A LocalActivity is an activity whose raw data is derived from a local FIT file
@@ -804,6 +1366,7 @@ class LocalActivity(Activity):
     --------------
     from_fit_file
     from_strava_export
+    metadata_from_fit_file
 
     Examples
     --------
@@ -860,6 +1423,10 @@ class LocalActivity(Activity):
         '''
         Initialize an activity directly from a FIT file
         **intended for testing only**
+
+        Note that an activity holds all of its records in memory (and process_records 
+        needs the whole ride), so the file is parsed in one chunk; 
+        to consume the records of a long file incrementally, use file_utils.iter_fit_records
         '''
         data = file_utils.parse_fit(filepath)
         activity = cls(data)
@@ -962,9 +1529,12 @@ class LocalActivity(Activity):
         
         '''
         if filepath is not None:
-            fitfile = file_utils.open_fit(filepath)
-            fields = {f.name: f.value for f in next(fitfile.get_messages('file_id')).fields}
-            file_id = pd.DataFrame([fields])
+            file_id = file_utils.parse_fit(
+                filepath, 
+                message_names='file_id', 
+                max_messages={'file_id': 1}, 
+                exclude_unknowns=False, 
+                check_crc=False)['file_id']
 
         if isinstance(file_id, pd.DataFrame):
             assert(file_id.shape[0]==1)
@@ -979,6 +1549,35 @@ class LocalActivity(Activity):
         return activity_id
 
 
+    @classmethod
+    def metadata_from_fit_file(cls, filepath, strava_metadata=None):
+        '''
+        Generate an activity's metadata (as in _generate_metadata) from a FIT file
+        without decoding its records
+
+        Only the messages needed by _generate_metadata are decoded 
+        (and only the first record message, for the records_timestamp);
+        the data messages of all other types are skipped using the sizes in their definitions.
+
+        Parameters
+        ----------
+        filepath : path to a FIT file
+        strava_metadata : optional one-row dataframe of metadata from a Strava export's activity.csv
+
+        '''
+        fit_data = file_utils.parse_fit(
+            filepath, 
+            message_names=['file_id', 'device_info', 'session', 'sport', 'record'],
+            max_messages={'file_id': 1, 'record': 1},
+            check_crc=False)
+
+        # message types that do not appear in the file (usually, 'sport') should be missing
+        fit_data = {name: data for name, data in fit_data.items() if data.shape[0]}
+
+        metadata = cls._generate_metadata(fit_data, strava_metadata)
+        return metadata
+
+
     @classmethod
     def _generate_metadata(cls, fit_data, strava_metadata=None):
         '''
@@ -33,11 +33,12 @@ user = 'keith'
 host = 'localhost'
 dbname = 'cypy2v2'
 conn = psycopg2.connect(user=user, host=host, dbname=dbname)
-manager = cypy2.ActivityManager.from_db(conn)
+# the activities load their records on first access, and the loaded records are cached
+manager = cypy2.ActivityManager.from_db(conn, lazy=True)
 
 
 def _is_activity_id(activity_id):
-    return activity_id in manager.metadata().activity_id.values
+    return manager.has_activity_id(activity_id)
 
 
 def metadata_to_json(metadata):
@@ -69,10 +70,6 @@ def records(activity_id):
     if not _is_activity_id(activity_id):
         return flask.jsonify(dict())
 
-    activity = cypy2.Activity.from_db(conn, activity_id)
-    activity.load(conn, kind='processed')
-    records = activity.records('processed')
-
     # sampling rate in seconds
     sampling = int(request.args.get('sampling'))
     if not sampling:
@@ -81,7 +78,11 @@ def records(activity_id):
     columns = request.args.get('columns')
     if columns:
         columns = columns.split(',')
-    else:
+
+    # only the requested columns are loaded (or calculated; see Activity.records)
+    activity = manager.activities(activity_id)[0]
+    records = activity.records('processed', columns=columns)
+    if not columns:
         columns = list(records.columns)
 
     data = {}
@@ -19,6 +19,9 @@ where (activity_id, date_created) not in (
 -- add a geometry column
 alter table proc_records add column geomz geometry(LINESTRINGZ, 4326);
 
+-- add the processing key column (see Activity.processing_key)
+alter table proc_records add column processing_key char(40);
+
 -- the nth-most-recent activity of each type
 select activity_id, activity_type from (
 	select *, 
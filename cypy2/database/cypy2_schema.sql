@@ -174,6 +174,9 @@ CREATE TABLE proc_records (
      -- git commit when the row was created 
     commit_hash     char(40) NOT NULL,
 
+    -- hash of the raw data, processing code version, and constants (see Activity.processing_key)
+    processing_key  char(40),
+
     -- postGIS geomtries to represent the GPS trajectories 
     -- (SRID 4326 is WGS84 and corresponds to decimal lat/lon coordinates)
     geom            geometry(LINESTRING, 4326),
@@ -200,6 +203,36 @@ CREATE TABLE proc_records (
 );
 
 
+-- summary statistics generated from the processed records (see cypy2.summary_stats);
+-- the column names match raw_summary, but the units are those of the processed records
+CREATE TABLE proc_summary (
+    activity_id             char(14), 
+    date_created            timestamptz DEFAULT now(),
+
+    -- hash of the raw data, processing code version, and constants (see Activity.processing_key)
+    processing_key          char(40),
+
+    total_elapsed_time      real,  -- seconds
+    moving_time             real,  -- seconds
+    total_distance          real,  -- miles
+    total_ascent            real,  -- feet
+    total_descent           real,  -- feet
+
+    avg_power               real,  -- rides with power only
+    max_power               real,  -- ""
+    normalized_power        real,  -- ""
+    threshold_power         real,  -- ""
+    intensity_factor        real,  -- ""
+    training_stress_score   real,  -- ""
+
+    avg_heart_rate          real,
+    max_heart_rate          real,
+
+    PRIMARY KEY (activity_id, date_created),
+    FOREIGN KEY (activity_id) REFERENCES metadata (activity_id)
+);
+
+
 CREATE FUNCTION update_date_modified() 
 RETURNS trigger AS $$
 BEGIN
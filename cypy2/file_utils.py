@@ -3,27 +3,490 @@ import re
 import sys
 import glob
 import gzip
+import mmap
+import zipfile
+import shutil
+import struct
+import io
 import numpy as np
 import pandas as pd
 
 from fitparse import FitFile
+from fitparse.processors import FitFileDataProcessor
+from fitparse.profile import FIELD_TYPE_TIMESTAMP
+from fitparse.records import DefinitionMessage
 from datetime import datetime
 
+from cypy2 import utils
 
-def open_fit(filepath):
+
+# the version of the parsed data returned by parse_fit; 
+# this should be incremented whenever a change to the parser changes its output
+# (it is part of the key used to cache parsed data; see strava.ParsedDataCache)
+PARSER_VERSION = 2
+
+# FIT date_time values are seconds since UTC 00:00 Dec 31 1989
+FIT_EPOCH = 631065600
+
+# the dtype of the datetime columns that pandas constructs from datetime objects 
+# (e.g., datetime64[us] in pandas 3 and datetime64[ns] before), 
+# which _MessageColumns also uses so that its dataframes are identical to those of _MessageRows
+DATETIME_DTYPE = pd.Series([datetime(2000, 1, 1)]).dtype
+
+# message types that must always be decoded, because they define developer fields
+FIT_DEVELOPER_MESSAGE_NAMES = ['developer_data_id', 'field_description']
+
+# integer FIT base types (these are stored as int64 in columnar mode)
+FIT_INTEGER_TYPES = [
+    'sint8', 'uint8', 'uint8z', 'sint16', 'uint16', 'uint16z', 
+    'sint32', 'uint32', 'uint32z', 'sint64', 'uint64', 'uint64z',
+]
+
+
+def open_fit(filepath, retain_messages=True, message_names=None, field_names=None, 
+             max_messages=None, exclude_unknowns=False, check_crc=True, stream=False, cache_dirpath=None):
+    '''
+    Open a FIT file (or a gzipped FIT file) with fitparse
+
+    Parameters
+    ----------
+    filepath : path to a .fit or .fit.gz file 
+               (or to a .fit or .fit.gz member of a zip archive; see split_zip_path)
+    retain_messages : whether the FitFile should keep every parsed message in memory
+                      (this is fitparse's default behavior; if False, the messages
+                      can only be iterated over once, but memory use does not grow with file length)
+    message_names : optional list of the message types to decode; 
+                    the data messages of all other types are skipped without being decoded
+    field_names : optional dict of lists, keyed by message name, of the field names to decode;
+                  all other fields are skipped without being unpacked
+    max_messages : optional dict, keyed by message name, of the maximum number of messages
+                   of each type to decode (e.g., {'record': 1})
+    exclude_unknowns : whether to skip messages and fields that are not defined in the FIT SDK
+    check_crc : whether to validate the file's CRC
+    stream : whether to decompress .fit.gz files incrementally as they are parsed
+             (instead of reading the whole decompressed file into memory first), 
+             and to memory-map uncompressed .fit files
+    cache_dirpath : optional directory in which to cache decompressed copies of .fit.gz files;
+                    the cached copy is memory-mapped, so re-parsing the same file skips gzip entirely
+
+    Note that if any of message_names, field_names, max_messages, or exclude_unknowns is given, 
+    the messages are never retained
+
+    '''
+
+    kwargs = {
+        'message_names': message_names, 
+        'field_names': field_names, 
+        'max_messages': max_messages, 
+        'exclude_unknowns': exclude_unknowns,
+    }
+
+    if retain_messages and not any(kwargs.values()):
+        fitfile_class = FitFile
+        kwargs = {}
+    else:
+        fitfile_class = _FitDecoder
 
     ext = filepath.split('.')[-1]
+
+    # members of zip archives are read into memory, rather than extracted to disk
+    # (the member is already compressed, so this is no more than the size of the .fit.gz file)
+    zip_filepath, member_name = split_zip_path(filepath)
+    if zip_filepath is not None:
+        with zipfile.ZipFile(zip_filepath) as archive:
+            contents = archive.read(member_name)
+
+        if ext=='gz' and stream:
+            if fitfile_class is _FitDecoder:
+                kwargs['filesize'] = struct.unpack('<I', contents[-4:])[0]
+            fileish = gzip.GzipFile(fileobj=io.BytesIO(contents))
+        elif ext=='gz':
+            fileish = gzip.decompress(contents)
+        else:
+            fileish = contents
+        return fitfile_class(fileish, check_crc=check_crc, **kwargs)
+
+    if ext=='gz' and cache_dirpath is not None:
+        filepath, ext, stream = _decompress_to_cache(filepath, cache_dirpath), 'fit', True
+
     if ext=='gz':
-        with gzip.open(filepath) as file:
-            fitfile = FitFile(file.read())
+        if stream:
+            if fitfile_class is _FitDecoder:
+                kwargs['filesize'] = _gzip_uncompressed_size(filepath)
+            fitfile = fitfile_class(gzip.open(filepath), check_crc=check_crc, **kwargs)
+        else:
+            with gzip.open(filepath) as file:
+                fitfile = fitfile_class(file.read(), check_crc=check_crc, **kwargs)
+
+    elif stream:
+        with open(filepath, 'rb') as file:
+            fileish = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        fitfile = fitfile_class(fileish, check_crc=check_crc, **kwargs)
+
     else:
-        fitfile = FitFile(filepath)
+        fitfile = fitfile_class(filepath, check_crc=check_crc, **kwargs)
 
     return fitfile
 
 
 
-def parse_fit(filepath, message_names=None, field_names=None, exclude_unknowns=True):
+def split_zip_path(filepath):
+    '''
+    Split a path to a member of a zip archive into the path to the archive 
+    and the name of the member (e.g., 'export.zip/activities/1234.fit.gz' 
+    is split into 'export.zip' and 'activities/1234.fit.gz')
+
+    Returns
+    -------
+    (zip_filepath, member_name) : or (None, filepath) if filepath is not in a zip archive
+
+    '''
+    match = re.match(r'^(.*?\.zip)%s(.+)$' % re.escape(os.sep), filepath)
+    if match is not None and os.path.isfile(match.group(1)):
+        return match.group(1), match.group(2).replace(os.sep, '/')
+    return None, filepath
+
+
+
+def open_file(filepath):
+    '''
+    Open a file, or a member of a zip archive (see split_zip_path), for reading in binary mode
+    '''
+    zip_filepath, member_name = split_zip_path(filepath)
+    if zip_filepath is None:
+        return open(filepath, 'rb')
+
+    # the member remains readable after the archive is closed
+    with zipfile.ZipFile(zip_filepath) as archive:
+        return archive.open(member_name)
+
+
+
+def get_file_size(filepath):
+    '''
+    The size in bytes of a file, or of a member of a zip archive (see split_zip_path)
+    (for zip members, this is the compressed size, which is the number of bytes read from disk)
+    '''
+    zip_filepath, member_name = split_zip_path(filepath)
+    if zip_filepath is None:
+        return os.path.getsize(filepath)
+
+    with zipfile.ZipFile(zip_filepath) as archive:
+        return archive.getinfo(member_name).compress_size
+
+
+
+def _gzip_uncompressed_size(filepath):
+    '''
+    The size of the decompressed contents of a gzip file, 
+    from the ISIZE field in the gzip trailer (the last four bytes of the file)
+
+    Note that ISIZE is the size modulo 2**32 of the last member of the gzip file,
+    so this is only correct for single-member files smaller than 4GB (which includes all FIT files)
+    '''
+    with open(filepath, 'rb') as file:
+        file.seek(-4, os.SEEK_END)
+        return struct.unpack('<I', file.read(4))[0]
+
+
+
+def _decompress_to_cache(filepath, cache_dirpath):
+    '''
+    Decompress a .fit.gz file into cache_dirpath (if it has not already been decompressed)
+    and return the path to the decompressed file
+
+    The cached copy is keyed by the name, size, and modification time of the compressed file,
+    so that a compressed file that is replaced by a different file with the same name 
+    (e.g., in a new Strava export, whose extracted files keep the archive's modification times) 
+    is decompressed again unless its size and modification time are both unchanged.
+    '''
+    os.makedirs(cache_dirpath, exist_ok=True)
+
+    stat = os.stat(filepath)
+    filename = re.sub(r'\.fit\.gz$|\.gz$', '', os.path.basename(filepath))
+    cached_filepath = os.path.join(
+        cache_dirpath, '%s-%d-%d.fit' % (filename, stat.st_size, stat.st_mtime_ns))
+
+    if os.path.isfile(cached_filepath):
+        return cached_filepath
+
+    def decompress(dst):
+        with gzip.open(filepath) as src:
+            shutil.copyfileobj(src, dst)
+
+    utils.write_atomically(cached_filepath, decompress)
+
+    return cached_filepath
+
+
+
+class _FitDecoder(FitFile):
+    '''
+    A fitparse FitFile that does not retain the messages it has parsed,
+    and that only decodes the requested message types and fields
+
+    FitFile appends every parsed message to self._messages 
+    (so that get_messages can be called more than once), 
+    which means that the memory used by a FitFile grows with the length of the file
+    even when the messages are consumed one at a time.
+
+    The data messages of all other types are skipped using the size given by their definition message,
+    so that no field values are unpacked and no python objects are created for them. 
+    Once max_messages messages of a type have been decoded, any further messages of that type are skipped,
+    and once every requested type has reached its maximum, the rest of the file is not read at all.
+
+    Field projection is pushed into the decoding of each data message: 
+    when a definition message is parsed, it is replaced (in self._local_mesgs) by a 'projected' definition
+    that contains only the fields that are needed, and a struct that unpacks exactly those fields 
+    (with pad bytes in place of all other fields) is compiled for it. Each data message is then 
+    read with a single read and a single unpack call (fitparse unpacks each field separately).
+
+    The fields that are needed are the requested fields, the fields from which they are derived 
+    (components; e.g., 'speed' for 'enhanced_speed'), the reference fields of their subfields 
+    (e.g., 'manufacturer' for 'garmin_product'), and the timestamp field (for compressed timestamps).
+
+    Parameters
+    ----------
+    message_names : optional list of the message types to decode (if None, all types are decoded)
+    field_names : optional dict of lists of the field names to decode, keyed by message name
+                  (messages whose names are not keys are decoded in full)
+    max_messages : optional dict of the maximum number of messages to decode, keyed by message name
+    exclude_unknowns : whether to skip the message types and fields that are not defined in the FIT SDK
+    filesize : optional size of the (decompressed) file, if it is already known
+
+    '''
+
+    def __init__(self, fileish, check_crc=True, data_processor=None, message_names=None, 
+                 field_names=None, max_messages=None, exclude_unknowns=False, filesize=None):
+
+        self._message_names = set(message_names) if message_names else None
+        self._field_names = {name: set(names) for name, names in (field_names or {}).items() if names}
+        self._max_messages = dict(max_messages) if max_messages else {}
+        self._exclude_unknowns = exclude_unknowns
+        self._num_messages = {}
+
+        # the full and projected definitions (and their structs), keyed by local message number
+        self._full_defs = {}
+        self._unpackers = {}
+
+        if filesize is None:
+            super().__init__(fileish, check_crc=check_crc, data_processor=data_processor)
+            return
+
+        # when the size of the file is known, we can avoid the seek to the end of the file
+        # in FitFile.__init__ (which, for a gzip stream, would decompress the whole file)
+        self._file = fileish
+        self._filesize = filesize
+        self._messages = []
+        self._crc = None
+        self._processor = data_processor or FitFileDataProcessor()
+        self.check_crc = check_crc
+        self._parse_file_header()
+
+
+    def _parse_message(self):
+        message = super()._parse_message()
+        del self._messages[:]
+        return message
+
+
+    def _should_decode(self, message_name):
+
+        if message_name in FIT_DEVELOPER_MESSAGE_NAMES:
+            return True
+
+        if self._message_names is not None and message_name not in self._message_names:
+            return False
+
+        if self._message_names is None and self._exclude_unknowns and message_name.startswith('unknown_'):
+            return False
+
+        max_messages = self._max_messages.get(message_name)
+        return max_messages is None or self._num_messages.get(message_name, 0) < max_messages
+
+
+    def _parse_definition_message(self, header):
+
+        def_mesg = super()._parse_definition_message(header)
+        local_mesg_num = header.local_mesg_num
+
+        projected_def_mesg, unpacker = self._project_definition(def_mesg)
+        self._full_defs[local_mesg_num] = def_mesg
+        self._local_mesgs[local_mesg_num] = projected_def_mesg
+        self._unpackers[local_mesg_num] = unpacker
+        return def_mesg
+
+
+    def _project_definition(self, def_mesg):
+        '''
+        Construct the projected definition message, and the struct that unpacks its fields
+        from the bytes of a data message of the full definition
+
+        Returns
+        -------
+        projected_def_mesg : DefinitionMessage with only the fields to decode
+        unpacker : (struct.Struct, list of (base_type, count) for each field to decode)
+
+        '''
+
+        field_names = self._field_names.get(def_mesg.name)
+        mesg_type = def_mesg.mesg_type
+
+        # def_nums of the fields that are needed to resolve subfields and components
+        required_def_nums = set([FIELD_TYPE_TIMESTAMP.def_num])
+
+        def _is_requested(field):
+            if field_names is None:
+                return True
+            names = [field.name] + [subfield.name for subfield in (field.subfields or [])]
+            return bool(field_names.intersection(names))
+
+        for field_def in def_mesg.field_defs:
+            field = field_def.field
+            if field is None or not _is_requested(field):
+                continue
+
+            for subfield in (field.subfields or []):
+                required_def_nums.update([ref_field.def_num for ref_field in subfield.ref_fields])
+
+        field_defs = []
+        for field_def in def_mesg.field_defs:
+            field = field_def.field
+            if field is None:
+                keep = field_names is None and not self._exclude_unknowns
+            else:
+                components = list(field.components or [])
+                for subfield in (field.subfields or []):
+                    components.extend(subfield.components or [])
+
+                keep = field_def.def_num in required_def_nums or _is_requested(field) or \
+                    any(_is_requested(mesg_type.fields[c.def_num]) for c in components)
+
+            field_defs.append((field_def, keep))
+
+        dev_field_defs = [
+            (field_def, field_names is None or field_def.name in field_names) 
+            for field_def in def_mesg.dev_field_defs]
+
+        fmt, kept_types = def_mesg.endian, []
+        for field_def, keep in field_defs + dev_field_defs:
+            base_type = field_def.base_type
+            count = field_def.size // base_type.size
+            if not keep:
+                fmt += '%dx' % field_def.size
+            else:
+                fmt += '%d%s' % (count, base_type.fmt)
+                kept_types.append((base_type, count if base_type.fmt!='s' else 1))
+
+        projected_def_mesg = DefinitionMessage(
+            header=def_mesg.header,
+            endian=def_mesg.endian,
+            mesg_type=mesg_type,
+            mesg_num=def_mesg.mesg_num,
+            field_defs=[field_def for field_def, keep in field_defs if keep],
+            dev_field_defs=[field_def for field_def, keep in dev_field_defs if keep])
+
+        return projected_def_mesg, (struct.Struct(fmt), kept_types)
+
+
+    def _parse_raw_values_from_data_message(self, def_mesg):
+        '''
+        Read a data message in one read and unpack only the fields in the projected definition
+        (the parsing of the unpacked values is the same as in FitFile)
+        '''
+
+        unpacker, kept_types = self._unpackers[def_mesg.header.local_mesg_num]
+        if not unpacker.size:
+            return []
+
+        values = unpacker.unpack(self._read(unpacker.size))
+
+        raw_values, ind = [], 0
+        for base_type, count in kept_types:
+            if base_type.name=='byte':
+                raw_value = base_type.parse(values[ind:ind + count])
+            elif count > 1:
+                raw_value = tuple(base_type.parse(value) for value in values[ind:ind + count])
+            else:
+                raw_value = base_type.parse(values[ind])
+
+            raw_values.append(raw_value)
+            ind += count
+
+        return raw_values
+
+
+    def _parse_data_message(self, header):
+
+        def_mesg = self._full_defs.get(header.local_mesg_num)
+        if def_mesg is not None and not self._should_decode(def_mesg.name):
+            return self._skip_data_message(header, def_mesg)
+
+        message = super()._parse_data_message(header)
+
+        message_name = message.name
+        self._num_messages[message_name] = self._num_messages.get(message_name, 0) + 1
+
+        # stop reading the file once the maximum number of every requested message type has been decoded
+        if self._message_names is not None and self._max_messages:
+            if not any(self._should_decode(name) for name in self._message_names):
+                self._complete = True
+                self.close()
+
+        return message
+
+
+    def _skip_data_message(self, header, def_mesg):
+        '''
+        Read past a data message without decoding it
+
+        The only value that is unpacked is the timestamp (if there is one), 
+        because it is needed to resolve any subsequent compressed timestamps.
+        '''
+
+        offset = 0
+        timestamp_offset = None
+        for field_def in def_mesg.field_defs:
+            if field_def.def_num==FIELD_TYPE_TIMESTAMP.def_num and field_def.size==4:
+                timestamp_offset = offset
+            offset += field_def.size
+
+        size = offset + sum(field_def.size for field_def in def_mesg.dev_field_defs)
+        data = self._read(size)
+
+        if header.time_offset is not None:
+            self._compressed_ts_accumulator = self._apply_compressed_accumulation(
+                header.time_offset, self._compressed_ts_accumulator, 5)
+
+        elif timestamp_offset is not None:
+            timestamp = struct.unpack_from(def_mesg.endian + 'I', data, timestamp_offset)[0]
+            if timestamp!=0xFFFFFFFF:
+                self._compressed_ts_accumulator = timestamp
+
+        return _SkippedMessage(header=header, def_mesg=def_mesg)
+
+
+
+class _SkippedMessage(object):
+    '''
+    Placeholder for a data message that _FitDecoder did not decode
+    (get_messages never yields these, because their type is not 'data')
+    '''
+    type = 'skipped'
+    mesg_type = None
+
+    def __init__(self, header, def_mesg):
+        self.header = header
+        self.def_mesg = def_mesg
+
+    @property
+    def name(self):
+        return self.def_mesg.name
+
+
+
+def parse_fit(filepath, message_names=None, field_names=None, exclude_unknowns=True, columnar=True, 
+              max_messages=None, check_crc=True, stream=True, cache_dirpath=None):
     '''
     Parse a FIT file using fitparse
     
@@ -34,6 +497,13 @@ def parse_fit(filepath, message_names=None, field_names=None, exclude_unknowns=T
                   if None, parse all fields
     exclude_unknowns : whether to exclude message and field names that begin with 'unknown_'
                        (These are presumably messages/fields that are not defined in the FIT SDK)
+    columnar : whether to write field values directly into typed arrays (see _MessageColumns)
+               instead of constructing one dict per message (see _MessageRows)
+    max_messages : optional dict, keyed by message name, of the maximum number of messages to parse
+    check_crc : whether to validate the file's CRC
+    stream, cache_dirpath : how to open the file (see open_fit)
+
+    Note that when message_names is given, messages of all other types are skipped without being decoded
 
     Returns
     -------
@@ -41,56 +511,422 @@ def parse_fit(filepath, message_names=None, field_names=None, exclude_unknowns=T
 
     '''
 
-    fitfile = open_fit(filepath)
+    if isinstance(message_names, str):
+        message_names = [message_names]
 
-    if message_names:
-        if isinstance(message_names, str):
-            message_names = [message_names]
+    chunks = {}
+    for message_name, chunk in iter_fit_messages(
+            filepath, None, message_names, field_names, exclude_unknowns, columnar, 
+            max_messages, check_crc, stream, cache_dirpath):
+        chunks[message_name] = chunk
 
-    # parse all message types if no message names are given
+    # requested message types that do not appear in the file correspond to empty dataframes
+    if message_names:
+        data = {name: pd.DataFrame() for name in message_names}
     else:
-        message_names = set([m.name for m in fitfile.messages])
-        if exclude_unknowns:
-            message_names = [name for name in message_names if not name.startswith('unknown_')]
-
-    data = {}
-    for message_name in message_names:
-        message_field_names = field_names.get(message_name) if field_names else None
-        data[message_name] = _concat_messages(fitfile, message_name, message_field_names, exclude_unknowns)
+        data = {}
 
-    # fitfile.close()
+    data.update(chunks)
     return data
 
 
 
-def _concat_messages(fitfile, message_name, field_names=None, exclude_unknowns=True):
+def iter_fit_messages(filepath, chunk_size=None, message_names=None, field_names=None, 
+                      exclude_unknowns=True, columnar=True, max_messages=None, check_crc=True, 
+                      stream=True, cache_dirpath=None):
+    '''
+    Parse a FIT file incrementally, yielding the messages of each type in chunks
+
+    The file is decoded in a single pass without retaining the parsed messages, 
+    so peak memory scales with chunk_size (times the number of message types), 
+    rather than with the length of the file.
+
+    Parameters
+    ----------
+    chunk_size : the maximum number of messages (rows) in each chunk;
+                 if None, all of the messages of each type are yielded as one chunk
+    message_names, field_names, exclude_unknowns, columnar, max_messages, check_crc, 
+    stream, cache_dirpath : as in parse_fit
+
+    Yields
+    ------
+    (message_name, dataframe) pairs; the chunks of each message type are yielded in order,
+    and the dataframe index is the position of each message among the messages of its type
+
+    Note that, when chunk_size is not None, the dtypes of a column may differ between chunks
+    (for example, an integer-valued column with missing values in only some chunks). 
+
+    '''
+
+    if isinstance(message_names, str):
+        message_names = [message_names]
+
+    fitfile = open_fit(
+        filepath, 
+        retain_messages=False, 
+        message_names=message_names, 
+        field_names=field_names,
+        max_messages=max_messages, 
+        exclude_unknowns=exclude_unknowns,
+        check_crc=check_crc,
+        stream=stream,
+        cache_dirpath=cache_dirpath)
+
+    for message_name, accumulator in _demux_messages(
+            fitfile, message_names, field_names, exclude_unknowns, columnar, chunk_size):
+        yield message_name, accumulator.to_dataframe()
+
+
+
+def iter_fit_records(filepath, chunk_size=3600, field_names=None, as_arrays=False, cache_dirpath=None):
     '''
-    Internal method called by parse_fit
-    dumps all messages of the given name into a pandas dataframe (one row per message)
+    Parse the 'record' messages of a FIT file in fixed-size batches
+    
+    Parameters
+    ----------
+    filepath : path to a .fit or .fit.gz file
+    chunk_size : the number of records in each batch (except, usually, the last one)
+    field_names : optional list of record field names to parse (e.g., file_settings.field_names['record'])
+    as_arrays : whether to yield dicts of numpy arrays (keyed by field name) instead of dataframes
+    cache_dirpath : optional directory in which to cache decompressed .fit.gz files (see open_fit)
+
+    '''
+
+    field_names = {'record': field_names} if field_names else None
+    fitfile = open_fit(
+        filepath, 
+        retain_messages=False, 
+        message_names=['record'], 
+        field_names=field_names, 
+        stream=True, 
+        cache_dirpath=cache_dirpath)
+
+    for _, accumulator in _demux_messages(fitfile, ['record'], field_names, chunk_size=chunk_size):
+        if as_arrays:
+            yield accumulator.to_arrays()
+        else:
+            yield accumulator.to_dataframe()
+
+
+
+def _demux_messages(fitfile, message_names=None, field_names=None, 
+                    exclude_unknowns=True, columnar=True, chunk_size=None):
+    '''
+    Internal method called by iter_fit_messages
+    dumps the data messages of each message type into an accumulator 
+    (one row per message) in one traversal of the file
 
     Note that when no field names are given, the set of all field_names 
-    must be determined within the for loop (that is, for each message independently)
+    must be determined for each message independently
     because not all messages have the same fields.
 
     For example, if an activity was started before a GPS signal was acquired,
     the first few messages will have no lat/long fields. 
 
+    Yields
+    ------
+    (message_name, accumulator) pairs, where each accumulator is a _MessageColumns or _MessageRows;
+    an accumulator is yielded as soon as it contains chunk_size messages,
+    and the remaining accumulators are yielded once the whole file has been parsed
+
     '''
 
-    data = []
-    messages = fitfile.get_messages(message_name)
+    accumulator_class = _MessageColumns if columnar else _MessageRows
 
-    if field_names:
-        for message in messages:
-            data.append({name: message.get_value(name) for name in field_names})
+    # the number of messages of each type that have been yielded in previous chunks
+    num_yielded = {}
 
-    # parse all fields if no field_names are given
-    elif exclude_unknowns:
-        for message in messages:
-            data.append({f.name: f.value for f in message if not f.name.startswith('unknown_')})
-    else:
-        for message in messages:
-            data.append({f.name: f.value for f in message})
+    accumulators = {}
+    for message in fitfile.get_messages(message_names):
 
-    data = pd.DataFrame(data=data)
-    return data
+        message_name = message.name
+        accumulator = accumulators.get(message_name)
+
+        if accumulator is None:
+            if exclude_unknowns and message_name.startswith('unknown_') and not message_names:
+                continue
+
+            message_field_names = field_names.get(message_name) if field_names else None
+            accumulator = accumulator_class(
+                message_field_names, exclude_unknowns, first_row=num_yielded.get(message_name, 0))
+            accumulators[message_name] = accumulator
+
+        accumulator.append(message)
+
+        if chunk_size and accumulator.num_rows==chunk_size:
+            num_yielded[message_name] = accumulator.first_row + chunk_size
+            yield message_name, accumulators.pop(message_name)
+
+    for message_name, accumulator in accumulators.items():
+        yield message_name, accumulator
+
+
+
+class _MessageRows(object):
+    '''
+    Row-wise accumulator for the data messages of one message type
+    (one dict per message; slower than _MessageColumns, but makes no assumptions about field types)
+
+    Parameters
+    ----------
+    field_names : optional list of field names to keep; if None, all fields are kept
+    exclude_unknowns : whether to exclude fields whose names begin with 'unknown_'
+    first_row : the index of the first row (when the messages are accumulated in chunks)
+
+    '''
+
+    def __init__(self, field_names=None, exclude_unknowns=True, first_row=0):
+        self.field_names = field_names
+        self.exclude_unknowns = exclude_unknowns
+        self.first_row = first_row
+        self._rows = []
+
+
+    @property
+    def num_rows(self):
+        return len(self._rows)
+
+
+    def append(self, message):
+
+        if self.field_names:
+            row = {name: message.get_value(name) for name in self.field_names}
+
+        # parse all fields if no field_names are given
+        elif self.exclude_unknowns:
+            row = {f.name: f.value for f in message if not f.name.startswith('unknown_')}
+        else:
+            row = {f.name: f.value for f in message}
+
+        self._rows.append(row)
+
+
+    def to_dataframe(self):
+        index = pd.RangeIndex(self.first_row, self.first_row + self.num_rows)
+        return pd.DataFrame(data=self._rows, index=index)
+
+
+
+class _MessageColumns(object):
+    '''
+    Columnar accumulator for the data messages of one message type
+
+    Field values are written directly into one typed numpy array per field;
+    the arrays are allocated when a field first appears (with a dtype inferred 
+    from the field's FIT definition) and are grown geometrically as messages are appended.
+    This avoids constructing a dict for every message and the (slow) conversion 
+    of a list of dicts to a dataframe.
+
+    Column kinds:
+     - 'time' : date_time fields, stored as raw FIT timestamps and converted to datetimes at the end
+     - 'int' : unscaled integer fields; cast to float (with nans) at the end if any values are missing
+     - 'float' : scaled integer fields and float fields
+     - 'object' : everything else (enums, strings, bools, and array-valued fields)
+
+    When a value does not match its column's kind (for example, a tuple in a numeric field),
+    the column is converted to the more general kind. 
+
+    Parameters
+    ----------
+    field_names : optional list of field names to keep; if None, all fields are kept
+    exclude_unknowns : whether to exclude fields whose names begin with 'unknown_'
+    first_row : the index of the first row (when the messages are accumulated in chunks)
+    capacity : the initial number of rows to allocate
+
+    '''
+
+    def __init__(self, field_names=None, exclude_unknowns=True, first_row=0, capacity=256):
+
+        self.field_names = list(field_names) if field_names else None
+        self.exclude_unknowns = exclude_unknowns
+        self.first_row = first_row
+        self.num_rows = 0
+
+        self._capacity = capacity
+        self._column_names = {}
+        self._kinds = {}
+        self._values = {}
+        self._valid = {}
+
+
+    def append(self, message):
+        '''
+        Append one fitparse DataMessage
+        '''
+        if self.num_rows==self._capacity:
+            self._grow()
+
+        row = self.num_rows
+        for field_data in message.fields:
+            name = field_data.name
+            if name not in self._column_names:
+                self._column_names[name] = self._column_name(field_data)
+
+            name = self._column_names[name]
+            if name is None:
+                continue
+            if name not in self._kinds:
+                self._add_column(name, field_data)
+            self._set_value(name, row, field_data)
+
+        self.num_rows += 1
+
+
+    def to_arrays(self):
+        '''
+        Trim the columns to the number of appended messages
+        and return them as a dict of numpy arrays keyed by field name
+        '''
+        columns = self.field_names if self.field_names is not None else self._kinds.keys()
+
+        # as in the dict-based path, requested fields that never appeared are all-None columns
+        data = {}
+        for name in columns:
+            if name in self._kinds:
+                data[name] = self._column(name, self.num_rows)
+            else:
+                data[name] = np.full(self.num_rows, None)
+        return data
+
+
+    def to_dataframe(self):
+
+        index = pd.RangeIndex(self.first_row, self.first_row + self.num_rows)
+        data = pd.DataFrame(data=self.to_arrays(), index=index)
+
+        # object columns (e.g., enums) are type-inferred just as pd.DataFrame would for a list of dicts
+        return data.infer_objects()
+
+
+    def _column_name(self, field_data):
+        '''
+        The name of the column in which to store a field's values, or None to skip the field
+        '''
+        name = field_data.name
+
+        # when field names are given, also match subfields by the name of their parent field
+        # (for consistency with fitparse's DataMessage.get_value)
+        if self.field_names is not None:
+            parent_field = field_data.parent_field
+            if name in self.field_names:
+                return name
+            if parent_field is not None and parent_field.name in self.field_names:
+                return parent_field.name
+            return None
+
+        if self.exclude_unknowns and name.startswith('unknown_'):
+            return None
+        return name
+
+
+    def _add_column(self, name, field_data):
+
+        field_type = field_data.type
+        base_type_name = field_data.base_type.name
+        scale = getattr(field_data.field, 'scale', None)
+
+        if field_type.name=='date_time':
+            kind = 'time'
+        elif field_type.values is not None or field_type.name=='bool':
+            kind = 'object'
+        elif base_type_name in ['float32', 'float64']:
+            kind = 'float'
+        elif base_type_name in FIT_INTEGER_TYPES:
+            kind = 'float' if scale else 'int'
+        else:
+            kind = 'object'
+
+        self._kinds[name] = kind
+        self._values[name], self._valid[name] = self._allocate(kind, self._capacity)
+
+
+    @staticmethod
+    def _allocate(kind, size):
+        dtypes = {'time': np.int64, 'int': np.int64, 'float': np.float64, 'object': object}
+        values = np.zeros(size, dtype=dtypes[kind]) if kind!='object' else np.full(size, None)
+        valid = np.zeros(size, dtype=bool)
+        return values, valid
+
+
+    def _grow(self):
+
+        capacity = 2*self._capacity
+        for name, kind in self._kinds.items():
+            values, valid = self._allocate(kind, capacity)
+            values[:self._capacity] = self._values[name]
+            valid[:self._capacity] = self._valid[name]
+            self._values[name], self._valid[name] = values, valid
+
+        self._capacity = capacity
+
+
+    def _set_value(self, name, row, field_data):
+
+        value = field_data.value
+        if value is None:
+            return
+
+        kind = self._kinds[name]
+        value_type = type(value)
+
+        if kind=='time':
+            if value_type is datetime:
+                value = field_data.raw_value
+            else:
+                kind = self._convert_column(name, 'object')
+
+        elif kind=='int':
+            if value_type is float:
+                kind = self._convert_column(name, 'float')
+            elif value_type is not int or not (-2**63 <= value < 2**63):
+                kind = self._convert_column(name, 'object')
+
+        elif kind=='float':
+            if value_type is not float and value_type is not int:
+                kind = self._convert_column(name, 'object')
+
+        self._values[name][row] = value
+        self._valid[name][row] = True
+
+
+    def _convert_column(self, name, kind):
+        '''
+        Convert an existing column to a more general kind
+        ('int' to 'float' or 'object', and anything to 'object')
+        '''
+        if kind=='float':
+            self._values[name] = self._values[name].astype(np.float64)
+        else:
+            values = self._column(name, self._capacity)
+            self._values[name] = np.array([
+                val if valid else None for val, valid in zip(values, self._valid[name])], dtype=object)
+
+        self._kinds[name] = kind
+        return kind
+
+
+    def _column(self, name, size):
+        '''
+        The finished values of one column (as a numpy array or pandas index of length size)
+        '''
+        kind = self._kinds[name]
+        values, valid = self._values[name][:size], self._valid[name][:size]
+
+        if kind=='time':
+            # (as in the dict-based path, a column with no values at all is a column of Nones)
+            if not valid.any():
+                return np.full(size, None)
+            times = (values + FIT_EPOCH).astype('datetime64[s]').astype(DATETIME_DTYPE)
+            times[~valid] = np.datetime64('NaT')
+            return times
+
+        if kind=='int':
+            if valid.all():
+                return values.copy()
+            values = values.astype(np.float64)
+
+        if kind in ['int', 'float']:
+            values = values.copy()
+            values[~valid] = np.nan
+
+        return values
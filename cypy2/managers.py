@@ -10,18 +10,32 @@ import numpy as np
 import pandas as pd
 from io import StringIO
 
-from cypy2 import (file_utils, file_settings, dbutils)
-from cypy2.activity import (Activity, LocalActivity)
+from cypy2 import (utils, file_utils, file_settings, dbutils)
+from cypy2.activity import (Activity, LazyActivity, LocalActivity)
+from cypy2.metadata_index import MetadataIndex
+from cypy2.predicates import (parse_predicates, predicates_to_sql)
+from cypy2.summary_stats import (SUMMARY_INPUT_COLUMNS, summarize_records)
+from psycopg2 import sql
+
+
+# the kinds of processed data that can be generated by ActivityManager.process_all
+PROCESSED_KINDS = ['records', 'summary']
 
 
 class ActivityManager(object):
 
     def __init__(self, metadata):
-        self._metadata = metadata
+
+        # the index sorts the metadata by activity_id
+        self._index = MetadataIndex(metadata)
+        self._metadata = self._index.metadata
+
+        # the cache of the data loaded by lazy activities (see from_db)
+        self._data_cache = None
 
 
     @classmethod
-    def from_strava_export(cls, strava_activity_data, raise_errors=False):
+    def from_strava_export(cls, strava_activity_data, raise_errors=False, workers=1, chunksize=4):
         '''
         Instantiate from parsed FIT files exported from Strava
 
@@ -29,26 +43,44 @@ class ActivityManager(object):
         The resulting activities have non-null raw_data (equivalent to Activity.from_db(kind='raw')),
         but Activity.process() must be called to generate the processed data. 
 
+        Parameters
+        ----------
+        strava_activity_data : list (or LazyActivityData sequence) of dicts of parsed FIT-file data
+        raise_errors : whether to raise the first error, rather than skip the activity
+        workers : the number of processes in which to construct the activities;
+                  if greater than one, the activities are distributed across a multiprocessing pool
+                  (but are returned in the same order as strava_activity_data)
+        chunksize : the number of activities sent to a worker process at a time
+
+        Errors are collected, as [index, error] pairs, in the manager's construction_errors attribute
+
         '''
         activities = []
-        for ind, data in enumerate(strava_activity_data):
-            try:
-                activity = LocalActivity(data, strava_metadata=data['strava_metadata'])
+        errors = []
+        with utils.imap_in_pool(
+            _construct_local_activity, _enumerate_data(strava_activity_data), workers, chunksize) as results:
+            for ind, (activity, error) in enumerate(results):
+                if error is not None:
+                    if raise_errors:
+                        raise error
+                    print('Warning: error parsing data at index %s:\n%s' % (ind, error))
+                    errors.append([ind, error])
+                    continue
+
                 activities.append(activity)
                 sys.stdout.write('\r%s' % activity.metadata.activity_id)
-            except Exception as err:
-                if raise_errors:
-                    raise
-                else:
-                    print('Warning: error parsing data at index %s:\n%s' % (ind, err))
 
         metadata = pd.DataFrame([a.metadata for a in activities])
         metadata['activity'] = activities
-        return cls(metadata)
+
+        manager = cls(metadata)
+        manager.construction_errors = errors
+        return manager
 
 
     @classmethod
-    def from_db(cls, conn, kind=None):
+    def from_db(cls, conn, kind=None, activity_id=None, batch_size=500, 
+                lazy=False, memory_budget=2**30, **kwargs):
         '''
         Load activity metadata from a cypy2 database, 
         and instantiate activities (if kind='raw' or kind='processed')
@@ -57,36 +89,80 @@ class ActivityManager(object):
         ----------
         kind : None, 'raw', 'processed', or 'all';
             if None, only activity metadata is loaded
+        activity_id : optional activity_id prefix (e.g., '2018' for all activities from 2018)
+        kwargs : optional predicates on the metadata and raw_summary columns
+                 (see predicates.parse_predicates); these are evaluated by the database,
+                 so that only the matching activities are loaded
+        batch_size : the number of activities whose data is loaded by each set of bulk queries
+        lazy : whether to instantiate LazyActivity objects, which load their data from the database
+               when it is first accessed (in this case, kind is ignored); the loaded data is held 
+               in an LRU cache, shared by all of the activities, whose statistics are returned by 
+               self.cache_stats
+        memory_budget : the maximum size, in bytes, of the LRU cache used by lazy activities
+
+        Example
+        -------
+        All road rides from 2018 longer than three hours:
+        ActivityManager.from_db(
+            conn, activity_id='2018', cycling_type='road', total_timer_time__gt=3*3600)
 
         '''
+        predicates = parse_predicates(kwargs)
+        if activity_id:
+            predicates.append(('activity_id', 'startswith', activity_id))
 
-        metadata = dbutils.get_rows(conn, 'metadata')
-        summary = dbutils.get_rows(conn, 'raw_summary')
-        metadata = pd.merge(metadata, summary, how='inner', on='activity_id')
+        query = sql.SQL(
+            'select * from metadata inner join raw_summary using (activity_id) {where}'
+        ).format(where=predicates_to_sql(predicates))
+        metadata = pd.read_sql(query.as_string(conn), conn)
 
-        metadata['activity'] = None
-        for ind, row in metadata.iterrows():
+        if lazy:
+            metadata_columns = dbutils.get_column_names(conn, 'metadata')
+            cache = utils.LRUCache(memory_budget, utils.sizeof_dataframes)
+            metadata['activity'] = [
+                LazyActivity(row[metadata_columns], conn, cache) for ind, row in metadata.iterrows()]
+            _set_raw_threshold_powers(metadata)
 
-            # attempt to load the activity's data
-            if kind is not None:
-                sys.stdout.write('\r%s' % row.activity_id)
-                try:
-                    activity = Activity.from_db(conn, row.activity_id, kind=kind)
-                except Exception as error:
-                    print('Error loading activity_id %s:\n%s' % (row.activity_id, error))
+            manager = cls(metadata)
+            manager._data_cache = cache
+            return manager
 
-            # instantiate from the metadata alone
-            else:
-                activity = Activity(row)
+        # instantiate from the metadata alone
+        if kind is None:
+            metadata['activity'] = [Activity(row) for ind, row in metadata.iterrows()]
+            _set_raw_threshold_powers(metadata)
+            return cls(metadata)
+
+        if kind not in ['raw', 'processed', 'all']:
+            raise ValueError('%s is not a valid kind of data' % kind)
+
+        # as in Activity.from_db, the activity's metadata includes only the columns of the metadata table
+        metadata_columns = dbutils.get_column_names(conn, 'metadata')
+        activities = [
+            Activity(row[metadata_columns], source='db') for ind, row in metadata.iterrows()]
 
-            metadata.at[ind, 'activity'] = activity
+        # load the activities' data in batches, with a few queries per batch 
+        # (rather than a few queries per activity)
+        for start in range(0, len(activities), batch_size):
+            batch = activities[start:(start + batch_size)]
+            sys.stdout.write('\r%s' % batch[-1].metadata.activity_id)
+            _load_batch(conn, batch, kind)
 
+        metadata['activity'] = activities
+        _set_raw_threshold_powers(metadata)
         return cls(metadata)
 
 
     def activities(self, activity_id=None, func=None, **kwargs):
         '''
         Filter activities
+
+        Parameters
+        ----------
+        activity_id : optional activity_id prefix
+        func : optional function of an activity that returns whether to include it
+        kwargs : predicates on the metadata (see self.metadata)
+
         '''
 
         metadata = self.metadata(activity_id, **kwargs)
@@ -98,19 +174,375 @@ class ActivityManager(object):
         return list(activities)
 
 
-    def metadata(self, activity_id=None, **kwargs):
+    def metadata(self, activity_id=None, start=None, stop=None, **kwargs):
         '''
-        Filter metadata
+        Filter metadata (see MetadataIndex.select)
+
+        Parameters
+        ----------
+        activity_id : optional activity_id prefix (e.g., '201904' for all activities from April 2019)
+        start, stop : optional range of activity_ids (or prefixes; stop is inclusive)
+        kwargs : predicates to match, as column=value or column__lookup=value 
+                 (e.g., activity_type='ride', strava_timestamp__gte='2018-01-01', 
+                 total_distance__gt=50000, or bike_name__in=['lynskey-cx'];
+                 see predicates.parse_predicates and MetadataIndex.select,
+                 which raises a ValueError for non-equality predicates on unknown columns)
+
+        Note that the returned dataframe is not a copy of the manager's metadata
+
         '''
+        return self._index.select(activity_id, start=start, stop=stop, **kwargs)
+
+
+    def process_all(
+        self, workers=1, kinds=None, conn=None, cache=None, chunksize=1, activity_id=None, **kwargs):
+        '''
+        Process the raw data of many activities (see Activity.process), in parallel
+
+        The raw data of each activity is sent to a worker process, 
+        and the processed data is returned to this process and assigned to the activity 
+        (as if activity.process() had been called).
+        An error in one activity does not affect the others; errors are collected, 
+        as [activity_id, error] pairs, in self.processing_errors.
+
+        Parameters
+        ----------
+        workers : the number of processes in which to process the activities;
+                  if greater than one, the activities are distributed across a multiprocessing pool
+        kinds : the kinds of processed data to generate ('records' and/or 'summary'); 
+                if None, all kinds are generated
+        conn : optional psycopg2 connection; if given, the processed data of each activity
+               is inserted into the database (by Activity.to_db) as soon as it is returned
+               (unless it is unchanged from the activity's most recent processed data in the database)
+        cache : optional ProcessedDataCache; activities whose processed data is in the cache
+                are not re-processed, and the processed data of the others is cached 
+
+        If only some kinds of processed data are generated, the processed data is neither cached 
+        nor inserted into the database, and if the records are not generated, 
+        the summary is only attached to the activity's existing processed data 
+        (or, if it has none, kept as the summary of its lazily-processed records; see Activity.summary)
+        chunksize : the number of activities sent to a worker process at a time
+        activity_id, kwargs : optional predicates that select the activities to process 
+                              (see self.metadata)
+
+        '''
+        kinds = kinds or PROCESSED_KINDS
+        for kind in kinds:
+            if kind not in PROCESSED_KINDS:
+                raise ValueError('%s is not a valid kind of processed data' % kind)
+
+        activities = self.activities(activity_id, **kwargs)
+        errors = []
+
+        # the processing keys calculated here are sent to the workers, so that the processed data 
+        # is cached (and compared to the database) under the same key that it is looked up by
+        processing_keys = {}
+
+        # the activities whose processed data is cached are not sent to the workers
+        # (if computing the processing key fails, the error is recorded as the activity's processing error)
+        if cache is not None:
+            uncached_activities = []
+            for activity in activities:
+                try:
+                    processing_key = activity.processing_key()
+                    processing_keys[activity.metadata.activity_id] = processing_key
+                    processed_data = cache.get(processing_key)
+                except Exception:
+                    processed_data = None
+                if processed_data is None:
+                    uncached_activities.append(activity)
+                else:
+                    activity._processed_data = processed_data
+                    activity._processed_by_user = True
+                    try:
+                        if conn is not None:
+                            activity.to_db(conn, kind='processed', verbose=False)
+                    except Exception as error:
+                        errors.append([activity.metadata.activity_id, error])
+
+            print('Loaded processed data for %d of %d activities from the cache' % \
+                (len(activities) - len(uncached_activities), len(activities)))
+            activities = uncached_activities
+
+        jobs = _enumerate_raw_data(activities, kinds, processing_keys)
+
+        start_time = time.time()
+        with utils.imap_in_pool(_process_activity, jobs, workers, chunksize) as results:
+            for ind, (activity, (processed_data, error)) in enumerate(zip(activities, results)):
+                activity_id = activity.metadata.activity_id
+                if error is None and set(kinds)==set(PROCESSED_KINDS):
+                    activity._processed_data = processed_data
+                    activity._processed_by_user = True
+                    try:
+                        if cache is not None:
+                            cache.save(processed_data['processing_key'], processed_data)
+                        if conn is not None:
+                            activity.to_db(conn, kind='processed', verbose=False)
+                    except Exception as err:
+                        error = err
+
+                elif error is None:
+                    _attach_processed_data(activity, processed_data, kinds)
+
+                if error is not None:
+                    errors.append([activity_id, error])
+
+                # progress and estimated time remaining
+                elapsed_time = time.time() - start_time
+                remaining_time = elapsed_time/(ind + 1)*(len(activities) - ind - 1)
+                sys.stdout.write('\rProcessed %s (%d of %d; %d errors; %s remaining)' % (
+                    activity_id, ind + 1, len(activities), len(errors), 
+                    datetime.timedelta(seconds=int(remaining_time))))
+
+        if len(errors):
+            print('\nWarning: some errors occured; inspect processing_errors for details')
+        self.processing_errors = errors
+
+
+    def summarize_all(self, threshold_power=None, activity_id=None, **kwargs):
+        '''
+        Summary statistics of the processed records of many activities, calculated all at once
+        (see summary_stats.summarize_records)
+
+        The processed records of activities that have not been processed are calculated 
+        (only the columns needed for the summary; see Activity.records), 
+        and the summary of each activity that has processed data is also assigned to it
+        (so that it is inserted into the database with the rest of its processed data). 
+        Errors are collected, as [activity_id, error] pairs, in self.summary_errors.
+
+        Parameters
+        ----------
+        threshold_power : optional threshold power in watts for all of the activities;
+                          if None, each activity's own threshold power is used (see Activity.threshold_power)
+        activity_id, kwargs : optional predicates that select the activities to summarize 
+                              (see self.metadata)
+
+        Returns
+        -------
+        summary : dataframe of summary statistics, with one row per activity and an activity_id column
+
+        '''
+        activities, records, threshold_powers, errors = [], [], [], []
+        for activity in self.activities(activity_id, **kwargs):
+            try:
+                records.append(activity.records('processed', columns=SUMMARY_INPUT_COLUMNS))
+                threshold_powers.append(
+                    threshold_power if threshold_power is not None else activity.threshold_power())
+                activities.append(activity)
+            except Exception as error:
+                errors.append([activity.metadata.activity_id, error])
+
+        summary = summarize_records(records, threshold_powers=threshold_powers)
+        summary.insert(0, 'activity_id', [activity.metadata.activity_id for activity in activities])
+
+        for ind, activity in enumerate(activities):
+            if activity._processed_data is not None:
+                activity._processed_data['summary'] = summary.iloc[[ind]].reset_index(drop=True)
+
+        if len(errors):
+            print('Warning: some errors occured; inspect summary_errors for details')
+        self.summary_errors = errors
+        return summary
+
+
+    def cache_stats(self):
+        '''
+        The size and hit/miss/eviction counts of the cache of data loaded by lazy activities
+        (or None if the activities are not lazy)
+        '''
+        if self._data_cache is not None:
+            return self._data_cache.stats()
+
+
+    def has_activity_id(self, activity_id):
+        '''
+        Whether an activity_id is in the manager's metadata
+        '''
+        return activity_id in self._index
+
+
+
+def _load_batch(conn, activities, kind):
+    '''
+    Load the raw and/or processed data of a batch of activities from a cypy2 database
+    (called by ActivityManager.from_db)
+
+    The data for all of the activities is selected by one query per table, 
+    and the results are then split by activity_id. For proc_records, 
+    only the most recent row for each activity is selected (as in Activity._processed_data_from_db).
+
+    Errors are printed (as in ActivityManager.from_db) and the activity is left without data.
+
+    '''
+    activity_ids = [activity.metadata.activity_id for activity in activities]
+
+    def select(query):
+        query = sql.SQL(query).format(activity_ids=sql.Literal(activity_ids))
+        return pd.read_sql(query.as_string(conn), conn)
+
+    def split(df):
+        return {activity_id: rows for activity_id, rows in df.groupby('activity_id', sort=False)}
+
+    if kind in ['raw', 'all']:
+        events = select('select * from raw_events where activity_id = ANY({activity_ids})')
+        records = select('select * from raw_records where activity_id = ANY({activity_ids})')
+
+        events_by_id, records_by_id = split(events), split(records)
+        for activity in activities:
+            activity_id = activity.metadata.activity_id
+            try:
+                activity._raw_data = Activity._raw_data_from_rows(
+                    events_by_id.get(activity_id, events.iloc[:0]), records_by_id[activity_id])
+            except Exception as error:
+                print('Error loading activity_id %s:\n%s' % (activity_id, repr(error)))
+
+    if kind in ['processed', 'all']:
+        records = select('''
+            select distinct on (activity_id) * from proc_records 
+            where activity_id = ANY({activity_ids}) 
+            order by activity_id, date_created desc''')
+
+        records_by_id = split(records)
+        for activity in activities:
+            activity_id = activity.metadata.activity_id
+            try:
+                activity._processed_data = Activity._processed_data_from_rows(
+                    records_by_id.get(activity_id, records.iloc[:0]))
+            except Exception as error:
+                print('Error loading activity_id %s:\n%s' % (activity_id, repr(error)))
+
+
+
+def _enumerate_raw_data(activities, kinds, processing_keys):
+    '''
+    Generate the arguments of _process_activity for each activity
+    
+    If loading an activity's raw data raises an exception (e.g., for lazy activities), 
+    the exception is generated in place of the raw data
+
+    The threshold power is looked up here, because the activities in the workers 
+    are new Activity instances that only have the raw data, and activities loaded from the database 
+    may not have a raw summary (see Activity.threshold_power)
+
+    The processing key is also calculated here (unless it is in processing_keys, 
+    which maps activity_ids to keys that were already calculated), so that it is the same key 
+    that the activity's processed data is looked up by in the parent process
+    '''
+    for activity in activities:
+        threshold_power, processing_key = None, None
+        try:
+            raw_data = activity._raw_data
+            threshold_power = activity.threshold_power()
+            processing_key = processing_keys.get(activity.metadata.activity_id)
+            if processing_key is None:
+                processing_key = activity.processing_key()
+        except Exception as error:
+            raw_data = error
+        yield activity.metadata, raw_data, threshold_power, processing_key, kinds
+
+
+
+def _process_activity(args):
+    '''
+    Generate an activity's processed data from its raw data
+    (called in worker processes by ActivityManager.process_all)
+
+    Returns
+    -------
+    (processed_data, error) : the processed data (or None) and the exception that was raised (or None)
+
+    '''
+    metadata, raw_data, threshold_power, processing_key, kinds = args
+    if isinstance(raw_data, Exception):
+        return None, raw_data
+
+    try:
+        activity = Activity(metadata, source='local')
+        activity._raw_data = raw_data
+        activity._raw_threshold_power = threshold_power
+        if raw_data is None:
+            raise ValueError('Activity %s has no raw data' % metadata.activity_id)
+
+        processed_data = {'summary': None, 'records': None}
+        if 'records' in kinds:
+            processed_data['records'] = activity.process_records()
+        if 'summary' in kinds:
+            # (the summary is calculated from the processed records, if they were just generated)
+            if processed_data['records'] is not None:
+                processed_data['summary'] = activity._summarize_records(processed_data['records'])
+            else:
+                processed_data['summary'] = activity.summarize()
+        processed_data['processing_key'] = processing_key
+        return processed_data, None
+
+    except Exception as error:
+        return None, error
+
+
+
+def _set_raw_threshold_powers(metadata):
+    '''
+    Assign each activity the threshold power from its row in raw_summary 
+    (which ActivityManager.from_db joins to the metadata; see Activity.threshold_power)
+    '''
+    if 'threshold_power' not in metadata.columns:
+        return
+    # (missing threshold powers are NaN rather than None, so that they are not looked up in the raw data)
+    threshold_powers = pd.to_numeric(metadata.threshold_power, errors='coerce')
+    for activity, threshold_power in zip(metadata.activity, threshold_powers):
+        activity._raw_threshold_power = threshold_power
+
+
+
+def _attach_processed_data(activity, processed_data, kinds):
+    '''
+    Attach some, but not all, kinds of processed data to an activity (see ActivityManager.process_all)
+    '''
+    if 'records' in kinds:
+        activity._processed_data = processed_data
+        activity._processed_by_user = True
+        return
+
+    try:
+        existing_data = activity._processed_data
+    except Exception:
+        existing_data = None
+
+    if existing_data is not None:
+        existing_data['summary'] = processed_data['summary']
+    else:
+        activity._lazy_summary = (activity._raw_data['records'], processed_data['summary'])
+
+
+
+def _enumerate_data(strava_activity_data):
+    '''
+    Generate the items of strava_activity_data, in order
+    
+    If strava_activity_data is a LazyActivityData sequence, accessing an item may raise an exception;
+    in this case, the exception is generated in place of the data (see _construct_local_activity)
+    '''
+    for ind in range(len(strava_activity_data)):
+        try:
+            yield strava_activity_data[ind]
+        except Exception as error:
+            yield error
 
-        metadata = self._metadata.copy()
-        if activity_id:
-            metadata = metadata.loc[metadata.activity_id.apply(lambda s: s.startswith(activity_id))]
 
-        for key, val in kwargs.items():
-            if key in metadata.columns:
-                metadata = metadata.loc[metadata[key]==val]
 
-        return metadata
+def _construct_local_activity(data):
+    '''
+    Instantiate a LocalActivity from parsed FIT-file data
+    (called in worker processes by ActivityManager.from_strava_export)
 
+    Returns
+    -------
+    (activity, error) : the activity (or None) and the exception that was raised (or None)
 
+    '''
+    if isinstance(data, Exception):
+        return None, data
+    try:
+        return LocalActivity(data, strava_metadata=data['strava_metadata']), None
+    except Exception as error:
+        return None, error
@@ -0,0 +1,127 @@
+import numpy as np
+
+from cypy2.predicates import (parse_predicates, predicate_mask)
+
+
+# the metadata columns for which a hash index is built
+# (these are the columns with a small number of distinct values; see the ENUM types in cypy2_schema.sql)
+INDEXED_COLUMNS = [
+    'activity_type', 
+    'cycling_type', 
+    'bike_name', 
+    'device_model', 
+    'device_manufacturer',
+]
+
+
+class MetadataIndex(object):
+    '''
+    Index of activity metadata for fast lookups by activity_id and by categorical columns
+
+    activity_ids are timestamps (e.g., '20190401123000'), so a prefix of an activity_id 
+    (e.g., '201904') selects a range of dates. The metadata is sorted by activity_id, 
+    so that the activities selected by a prefix (or by a range of activity_ids) 
+    are a contiguous slice of the metadata that is found by a binary search 
+    and returned as a view (rather than a copy).
+
+    For each of the INDEXED_COLUMNS, a hash index maps each distinct value 
+    to the (sorted) positions of the rows with that value.
+
+    Note that the metadata is assumed not to change after the index is built.
+
+    Parameters
+    ----------
+    metadata : dataframe of activity metadata with an activity_id column
+    columns : the columns to index
+
+    '''
+
+    def __init__(self, metadata, columns=INDEXED_COLUMNS):
+
+        if 'activity_id' in metadata.columns:
+            metadata = metadata.sort_values('activity_id', kind='stable').reset_index(drop=True)
+            self._activity_ids = metadata.activity_id.values.astype(str)
+        else:
+            self._activity_ids = np.array([], dtype=str)
+        self.metadata = metadata
+
+        self._positions = {}
+        for column in columns:
+            if column in metadata.columns:
+                self._positions[column] = metadata.groupby(column, sort=False, observed=True).indices
+
+
+    def __contains__(self, activity_id):
+        ind = np.searchsorted(self._activity_ids, activity_id)
+        return ind < len(self._activity_ids) and self._activity_ids[ind]==activity_id
+
+
+    def _bounds(self, start=None, stop=None):
+        '''
+        The positions of the first and last-plus-one activity_ids from start through stop
+        (where stop is treated as a prefix, so that, e.g., stop='201903' includes all of March 2019)
+        '''
+        lower = 0
+        if start:
+            lower = np.searchsorted(self._activity_ids, start, side='left')
+
+        upper = len(self._activity_ids)
+        if stop:
+            # the smallest string that is larger than every string that begins with stop
+            upper = np.searchsorted(self._activity_ids, stop[:-1] + chr(ord(stop[-1]) + 1), side='left')
+
+        return lower, max(lower, upper)
+
+
+    def select(self, activity_id=None, start=None, stop=None, **kwargs):
+        '''
+        Select the metadata for the activities that match all of the given criteria
+
+        Parameters
+        ----------
+        activity_id : optional activity_id prefix (e.g., '2019' for all activities from 2019)
+        start, stop : optional range of activity_ids (or activity_id prefixes; stop is inclusive)
+        kwargs : predicates to match, as column=value or column__lookup=value 
+                 (see predicates.parse_predicates); equality predicates on columns
+                 that are not metadata columns are ignored (as they always have been), 
+                 but all other predicates on such columns raise a ValueError
+
+        Returns
+        -------
+        metadata : the matching rows of the metadata, ordered by activity_id;
+                   if only activity_id, start, or stop are given, this is a view
+
+        '''
+        lower, upper = self._bounds(start, stop)
+        if activity_id:
+            prefix_lower, prefix_upper = self._bounds(activity_id, activity_id)
+            lower, upper = max(lower, prefix_lower), max(lower, min(upper, prefix_upper))
+
+        positions = None
+        for column, lookup, value in parse_predicates(kwargs):
+            if column not in self.metadata.columns:
+                if lookup=='eq':
+                    continue
+                raise ValueError('There is no "%s" column in the metadata' % column)
+
+            # equality and set membership on indexed columns use the hash index
+            if column in self._positions and lookup in ['eq', 'in']:
+                values = [value] if lookup=='eq' else list(value)
+                key_positions = np.unique(np.concatenate([np.array([], dtype=int)] + [
+                    self._positions[column].get(value, np.array([], dtype=int)) for value in values]))
+
+            # all other predicates are evaluated on the rows within the activity_id bounds
+            else:
+                mask = predicate_mask(self.metadata.iloc[lower:upper], column, lookup, value)
+                key_positions = lower + np.flatnonzero(mask)
+
+            if positions is None:
+                positions = key_positions
+            else:
+                positions = np.intersect1d(positions, key_positions, assume_unique=True)
+
+        if positions is None:
+            return self.metadata.iloc[lower:upper]
+
+        positions = positions[(positions >= lower) & (positions < upper)]
+        return self.metadata.iloc[positions]
@@ -0,0 +1,142 @@
+import numpy as np
+import pandas as pd
+
+from psycopg2 import sql
+
+
+# the supported lookups, and the corresponding SQL comparison operators
+# (lookups are appended to column names with a double underscore, as in 'total_distance__gt')
+LOOKUPS = {
+    'eq': '=',
+    'ne': '<>',
+    'gt': '>',
+    'gte': '>=',
+    'lt': '<',
+    'lte': '<=',
+    'in': 'IN',
+    'range': 'BETWEEN',
+    'startswith': 'LIKE',
+}
+
+
+def parse_predicates(kwargs):
+    '''
+    Parse keyword arguments of the form column=value or column__lookup=value into predicates
+
+    Examples
+    --------
+    activity_type='ride'                            : equality 
+    total_distance__gt=50000                        : numeric comparison (also gte, lt, lte, ne)
+    bike_name__in=['lynskey-cx', 'giant-defy-advanced'] : set membership
+    strava_timestamp__range=('2018-01-01', '2018-12-31') : inclusive range (of dates or numbers)
+    activity_id__startswith='2018'                  : string prefix
+
+    Returns
+    -------
+    predicates : list of (column, lookup, value) tuples
+
+    '''
+    predicates = []
+    for key, value in kwargs.items():
+        column, lookup = key, 'eq'
+        if '__' in key:
+            column, lookup = key.rsplit('__', 1)
+
+        if lookup not in LOOKUPS:
+            raise ValueError('Invalid lookup "%s"; lookups must be one of %s' % (lookup, list(LOOKUPS.keys())))
+
+        if lookup=='range' and len(value)!=2:
+            raise ValueError('The value of a range lookup must be a (min, max) pair')
+
+        predicates.append((column, lookup, value))
+    return predicates
+
+
+
+def predicate_mask(df, column, lookup, value):
+    '''
+    Evaluate a predicate on a dataframe, as a boolean numpy array
+    
+    Timestamp columns can be compared to strings (e.g., '2018-01-01') 
+    and NaNs never satisfy a predicate (except for 'ne').
+    '''
+    values = df[column]
+    if lookup=='in':
+        mask = values.isin(list(value))
+    elif lookup=='range':
+        mask = values.between(value[0], value[1], inclusive='both')
+    elif lookup=='startswith':
+        mask = values.str.startswith(value, na=False)
+    elif lookup=='eq':
+        mask = values==value
+    elif lookup=='ne':
+        mask = values!=value
+    elif lookup=='gt':
+        mask = values > value
+    elif lookup=='gte':
+        mask = values >= value
+    elif lookup=='lt':
+        mask = values < value
+    elif lookup=='lte':
+        mask = values <= value
+    return mask.values.astype(bool)
+
+
+
+def predicates_to_mask(df, predicates):
+    '''
+    Combine predicates (with AND) into a boolean mask over the rows of a dataframe
+    '''
+    mask = np.ones(df.shape[0], dtype=bool)
+    for column, lookup, value in predicates:
+        mask &= predicate_mask(df, column, lookup, value)
+    return mask
+
+
+
+def predicates_to_sql(predicates):
+    '''
+    Combine predicates (with AND) into a SQL where clause 
+    (or an empty query if there are no predicates)
+    '''
+    if not predicates:
+        return sql.SQL('')
+
+    clauses = []
+    for column, lookup, value in predicates:
+        if lookup=='in':
+            value = tuple(_to_python(v) for v in value)
+
+            # 'IN ()' is a syntax error
+            if not value:
+                clauses.append(sql.SQL('false'))
+                continue
+
+        if lookup=='startswith':
+            value = value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+        if lookup=='range':
+            clause = sql.SQL('{column} BETWEEN {min} AND {max}').format(
+                column=sql.Identifier(column), 
+                min=sql.Literal(_to_python(value[0])), 
+                max=sql.Literal(_to_python(value[1])))
+        else:
+            clause = sql.SQL('{column} {operator} {value}').format(
+                column=sql.Identifier(column), 
+                operator=sql.SQL(LOOKUPS[lookup]), 
+                value=sql.Literal(value if lookup=='in' else _to_python(value)))
+        clauses.append(clause)
+
+    return sql.SQL('where ') + sql.SQL(' and ').join(clauses)
+
+
+
+def _to_python(value):
+    '''
+    Convert numpy scalars and pandas timestamps to python objects (which psycopg2 can adapt)
+    '''
+    if isinstance(value, pd.Timestamp):
+        return value.to_pydatetime()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
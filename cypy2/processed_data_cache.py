@@ -0,0 +1,73 @@
+import os
+import pickle
+
+from cypy2 import utils
+
+
+# the default location of the cache
+DEFAULT_DIRPATH = os.path.join(os.path.expanduser('~'), 'processed-activities')
+
+
+class ProcessedDataCache(object):
+    '''
+    Content-addressed cache of processed activity data, with one pickle file per activity
+
+    Each activity's processed data (the dict returned by Activity.process) is cached
+    under the activity's processing key (see Activity.processing_key), which changes
+    whenever the raw data, the processing code (activity.PROCESSING_VERSION),
+    or the values in cypy2.constants change. This means that an activity is only re-processed
+    when something that its processed data depends on has changed.
+
+    Usage
+    -----
+    cache = ProcessedDataCache()
+    activity.process(cache=cache)
+    manager.process_all(workers=4, cache=cache)
+
+    Parameters
+    ----------
+    dirpath : the directory in which to cache the processed data
+
+    '''
+
+    def __init__(self, dirpath=None):
+        self.dirpath = dirpath or DEFAULT_DIRPATH
+        os.makedirs(self.dirpath, exist_ok=True)
+
+        self.hits = 0
+        self.misses = 0
+
+
+    def __contains__(self, key):
+        return os.path.exists(self._path(key))
+
+
+    def _path(self, key):
+        return os.path.join(self.dirpath, '%s.p' % key)
+
+
+    def get(self, key):
+        '''
+        The cached processed data for a processing key, or None if it is not cached
+        '''
+        try:
+            with open(self._path(key), 'rb') as file:
+                data = pickle.load(file)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return data
+
+
+    def save(self, key, data):
+        '''
+        Cache one activity's processed data
+        (the pickle file is written atomically; see utils.write_atomically)
+        '''
+        utils.write_atomically(self._path(key), lambda file: pickle.dump(data, file))
+
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
@@ -1 +1,3 @@
-from cypy2.strava.strava_export_manager import *
\ No newline at end of file
+from cypy2.strava.strava_export_manager import *
+from cypy2.strava.parsed_data_cache import *
+from cypy2.strava.lazy_activity_data import *
@@ -0,0 +1,85 @@
+import collections.abc
+import pandas as pd
+
+from cypy2 import file_utils
+from cypy2.utils import (LRUCache, sizeof_dataframes)
+
+
+class LazyActivityData(collections.abc.Sequence):
+    '''
+    A lazy equivalent of the list of parsed activity data in StravaExportManager.activity_data
+
+    Each activity's data is loaded when it is accessed, 
+    either from the activity cache or, if it is not cached, by parsing its FIT file
+    (in which case the parsed data is then cached). The loaded data is retained in an LRU cache 
+    with a memory budget, so that only the most recently accessed activities are held in memory.
+
+    Parameters
+    ----------
+    rows : list of the activities' rows from the export's activities.csv
+    filepaths : list of the paths to the activities' FIT files
+    activity_cache : the ParsedDataCache in which the parsed data is cached
+    cache_keys : dict of cache keys, keyed by filename (keys missing from this dict 
+                 are calculated when needed and then added to it)
+    memory_budget : the maximum size, in bytes, of the activity data to retain in memory
+    message_names : optional list of the message types to load
+    field_names : optional dict of lists, keyed by message name, of the columns to load
+
+    '''
+
+    def __init__(self, rows, filepaths, activity_cache, cache_keys, memory_budget, 
+                 message_names=None, field_names=None):
+
+        self.rows = rows
+        self.filepaths = filepaths
+        self.activity_cache = activity_cache
+        self.cache_keys = cache_keys
+        self.message_names = message_names
+        self.field_names = field_names
+
+        self._loaded_data = LRUCache(memory_budget, sizeof_dataframes)
+
+
+    def __len__(self):
+        return len(self.rows)
+
+
+    def __getitem__(self, ind):
+        if isinstance(ind, slice):
+            return [self[ind_] for ind_ in range(*ind.indices(len(self)))]
+
+        if ind < 0:
+            ind += len(self)
+        if ind < 0 or ind >= len(self):
+            raise IndexError('Activity index out of range')
+
+        data = self._loaded_data.get(ind)
+        if data is None:
+            data = self._load(ind)
+            self._loaded_data.put(ind, data)
+        return data
+
+
+    def _load(self, ind):
+        row, filepath = self.rows[ind], self.filepaths[ind]
+
+        key = self.cache_keys.get(row.filename)
+        if key is None:
+            key = self.activity_cache.key(filepath)
+
+        if key not in self.activity_cache:
+            self.activity_cache.save(key, file_utils.parse_fit(filepath))
+
+        # only successfully parsed activities are added to the cache keys
+        self.cache_keys[row.filename] = key
+
+        data = self.activity_cache.load(key, self.message_names, self.field_names)
+        data['strava_metadata'] = pd.DataFrame([row])
+        return data
+
+
+    def cache_stats(self):
+        '''
+        The size and hit/miss/eviction counts of the in-memory LRU cache
+        '''
+        return self._loaded_data.stats()
@@ -0,0 +1,194 @@
+import os
+import json
+import pickle
+import shutil
+import hashlib
+import numpy as np
+import pandas as pd
+
+from urllib.parse import quote
+from cypy2 import (utils, file_utils)
+
+
+# the supported cache formats
+CACHE_FORMATS = ['pickle', 'npy']
+
+
+class ParsedDataCache(object):
+    '''
+    Content-addressed cache of parsed FIT-file data, with one cache entry per activity
+
+    Each activity's parsed data (the dict of dataframes returned by file_utils.parse_fit)
+    is cached under a key that combines a hash of the FIT file's contents with file_utils.PARSER_VERSION.
+    This means that a FIT file is only re-parsed when its contents (or the parser) change,
+    and that the same FIT file appearing in two different Strava exports is only parsed once.
+
+    Two formats are supported:
+
+    'pickle' : each activity is a single pickle file of its dict of dataframes
+    'npy'    : each activity is a directory with one subdirectory per message type
+               and one .npy file per column; columns are read selectively and memory-mapped
+               (so that, e.g., loading only record.power and record.heart_rate 
+               for all activities reads only those columns from disk)
+
+    Parameters
+    ----------
+    dirpath : the directory in which to cache the parsed data
+    format : the cache format (one of CACHE_FORMATS)
+
+    '''
+
+    def __init__(self, dirpath, format='pickle'):
+        if format not in CACHE_FORMATS:
+            raise ValueError('Cache format must be one of %s' % CACHE_FORMATS)
+
+        self.dirpath = dirpath
+        self.format = format
+        os.makedirs(self.dirpath, exist_ok=True)
+
+
+    @staticmethod
+    def key(filepath):
+        '''
+        The cache key for a FIT file: the SHA1 hash of its contents and the parser version
+        '''
+        sha1 = hashlib.sha1()
+        with file_utils.open_file(filepath) as file:
+            for block in iter(lambda: file.read(2**20), b''):
+                sha1.update(block)
+
+        return '%s-v%s' % (sha1.hexdigest(), file_utils.PARSER_VERSION)
+
+
+    def __contains__(self, key):
+        return os.path.exists(self._path(key))
+
+
+    def _path(self, key):
+        if self.format=='pickle':
+            return os.path.join(self.dirpath, '%s.p' % key)
+        return os.path.join(self.dirpath, key)
+
+
+    def load(self, key, message_names=None, field_names=None):
+        '''
+        Load one activity's parsed data
+
+        Parameters
+        ----------
+        key : the activity's cache key
+        message_names : optional list of the message types to load; if None, all are loaded
+        field_names : optional dict of lists, keyed by message name, of the columns to load;
+                      messages that do not appear in field_names are loaded in full
+
+        Returns
+        -------
+        data : dict of dataframes, keyed by message name
+
+        '''
+        if self.format=='npy':
+            return self._load_npy(self._path(key), message_names, field_names)
+
+        with open(self._path(key), 'rb') as file:
+            data = pickle.load(file)
+
+        data = {
+            name: df for name, df in data.items() 
+            if message_names is None or name in message_names
+        }
+        for name, names in (field_names or {}).items():
+            if name in data and names:
+                data[name] = data[name][[n for n in data[name].columns if n in names]]
+        return data
+
+
+    def save(self, key, data):
+        '''
+        Cache one activity's parsed data
+
+        The data is written to a temporary file (see utils.write_atomically) 
+        or directory that is then renamed, so that a partially-written cache entry is never loaded
+        '''
+        path = self._path(key)
+        if self.format!='npy':
+            utils.write_atomically(path, lambda file: pickle.dump(data, file))
+            return
+
+        temp_path = '%s.%s.tmp' % (path, os.getpid())
+        self._save_npy(temp_path, data)
+        try:
+            os.rename(temp_path, path)
+        except OSError:
+            # another process has already cached the same file
+            shutil.rmtree(temp_path)
+
+
+    @staticmethod
+    def _save_npy(dirpath, data):
+        '''
+        Write each column of each dataframe to its own .npy file
+        
+        Each message's subdirectory also contains a manifest of its columns, 
+        in order, that records which columns contain python objects 
+        (these cannot be memory-mapped, so they are pickled by np.save)
+        '''
+        os.makedirs(dirpath)
+        with open(os.path.join(dirpath, 'messages.json'), 'w') as file:
+            json.dump(list(data.keys()), file)
+
+        for message_name, df in data.items():
+            message_dirpath = os.path.join(dirpath, quote(message_name, safe=''))
+            os.makedirs(message_dirpath)
+
+            manifest = []
+            for ind, column in enumerate(df.columns):
+                values = df[column].to_numpy()
+                filename = '%d.npy' % ind
+                np.save(os.path.join(message_dirpath, filename), values, allow_pickle=True)
+                manifest.append({
+                    'name': column, 
+                    'filename': filename, 
+                    'is_object': bool(values.dtype==object),
+                })
+
+            with open(os.path.join(message_dirpath, 'columns.json'), 'w') as file:
+                json.dump({'columns': manifest, 'num_rows': len(df)}, file)
+
+
+    @staticmethod
+    def _load_npy(dirpath, message_names=None, field_names=None):
+
+        with open(os.path.join(dirpath, 'messages.json')) as file:
+            all_message_names = json.load(file)
+
+        data = {}
+        for message_name in all_message_names:
+            if message_names is not None and message_name not in message_names:
+                continue
+
+            message_dirpath = os.path.join(dirpath, quote(message_name, safe=''))
+            with open(os.path.join(message_dirpath, 'columns.json')) as file:
+                manifest = json.load(file)
+
+            names = (field_names or {}).get(message_name)
+            columns = {}
+            for column in manifest['columns']:
+                if names and column['name'] not in names:
+                    continue
+
+                filepath = os.path.join(message_dirpath, column['filename'])
+                if column['is_object']:
+                    columns[column['name']] = np.load(filepath, allow_pickle=True)
+                else:
+                    # copy-on-write, so that the cached file can never be modified
+                    # (the view is still backed by the memory map)
+                    columns[column['name']] = np.load(filepath, mmap_mode='c').view(np.ndarray)
+
+            df = pd.DataFrame(columns, index=pd.RangeIndex(manifest['num_rows']), copy=False)
+
+            # restore the dtypes of the object columns (as in file_utils._MessageColumns)
+            if any(column['is_object'] for column in manifest['columns']):
+                df = df.infer_objects()
+            data[message_name] = df
+
+        return data
@@ -3,12 +3,20 @@ import os
 import re
 import sys
 import glob
+import time
 import pickle
-import datetime
+import zipfile
 import numpy as np
 import pandas as pd
 
-from cypy2 import (file_utils, file_settings)
+from cypy2 import (utils, file_utils, file_settings)
+from cypy2.activity import LocalActivity
+from cypy2.strava.parsed_data_cache import ParsedDataCache
+from cypy2.strava.lazy_activity_data import LazyActivityData
+
+
+# the name of the file (in an export's cache directory) that maps FIT filenames to cache keys
+CACHE_INDEX_FILENAME = 'cache-index.csv'
 
 
 class StravaExportManager(object):
@@ -23,16 +31,32 @@ class StravaExportManager(object):
  
     Parameters
     ----------
-    root_dirpath : path to the strava export directory
+    root_dirpath : path to the strava export directory, or to the (unextracted) export zip file;
+                   in the latter case, activities.csv and the FIT files are read directly from the zip file
     from_cache : whether to load previously-parsed FIT-file data from a cache
                  (created by self.to_cache)
+    filenames : optional list of the filenames (as they appear in activities.csv) 
+                of the activities to load from the cache; if None, all cached activities are loaded
+    cache_format : the format of the activity cache ('pickle' or 'npy'; see ParsedDataCache)
+    message_names : optional list of the message types to load from the cache
+    field_names : optional dict of lists, keyed by message name, of the columns to load from the cache
+                  (with the 'npy' format, only these columns are read from disk)
+    lazy : whether self.activity_data should be a LazyActivityData sequence
+           that loads each activity's data when it is accessed
+           (if from_cache is True, the sequence includes only the cached activities;
+           otherwise, it includes all of the FIT files in the export, which are parsed as needed)
+    memory_budget : the maximum size, in bytes, of the activity data 
+                    that a lazy self.activity_data retains in memory
 
     '''
 
-    def __init__(self, root_dirpath, from_cache=False):
+    def __init__(self, root_dirpath, from_cache=False, filenames=None, cache_format='pickle', 
+                 message_names=None, field_names=None, lazy=False, memory_budget=2**30):
         
         self.root_dirpath = root_dirpath
-        self.root_dirname = root_dirpath.split(os.sep)[-1]
+        self.root_dirname = re.sub(r'\.zip$', '', root_dirpath.rstrip(os.sep).split(os.sep)[-1])
+        if root_dirpath.endswith('.zip'):
+            self.root_dirpath = self._zip_root_dirpath(root_dirpath)
 
         # where to cache the parsed data
         self.cache_dirpath = os.path.join(
@@ -41,20 +65,143 @@ class StravaExportManager(object):
             self.root_dirname)
         os.makedirs(self.cache_dirpath, exist_ok=True)
 
+        # where to cache the parsed data for each activity
+        # (this cache is shared by all exports, because it is keyed by the contents of the FIT files)
+        self.activity_cache = ParsedDataCache(os.path.join(
+            os.getenv('HOME'), 
+            'parsed-strava-exports', 
+            '_activities'), format=cache_format)
+
+        # cache keys of the parsed activities, keyed by filename
+        self.cache_keys = {}
+
         # load the CSV activity metadata
-        self.metadata = pd.read_csv(os.path.join(self.root_dirpath, 'activities.csv'))
+        with file_utils.open_file(os.path.join(self.root_dirpath, 'activities.csv')) as file:
+            self.metadata = pd.read_csv(file)
 
-        if from_cache:
-            self.activity_data = self._load_from_cache(self.cache_dirpath)
+        if lazy:
+            self.activity_data = self._lazy_activity_data(
+                from_cache, filenames, message_names, field_names, memory_budget)
+        elif from_cache:
+            self.activity_data = self._load_from_cache(filenames, message_names, field_names)
         else:
             # for now, we will leave it to the user to call self.parse_all manually
             pass
 
 
     @staticmethod
-    def _load_from_cache(cache_dirpath):
+    def _zip_root_dirpath(zip_filepath):
+        '''
+        The path (see file_utils.split_zip_path) to the directory in an export zip file 
+        that contains activities.csv (this is either the root of the zip file 
+        or, if the export was re-zipped after extraction, a top-level directory)
+        '''
+        with zipfile.ZipFile(zip_filepath) as archive:
+            names = [name for name in archive.namelist() if name.split('/')[-1]=='activities.csv']
+        if not names:
+            raise ValueError('There is no activities.csv in %s' % zip_filepath)
+
+        dirname = min(names, key=len).rsplit('activities.csv', 1)[0].strip('/')
+        return os.path.join(zip_filepath, *dirname.split('/')) if dirname else zip_filepath
+
+
+    def _load_from_cache(self, filenames=None, message_names=None, field_names=None):
+        '''
+        Load cached parsed data for the activities in the export's cache index
+        (only the cache files of the requested activities are read)
+
+        Parameters
+        ----------
+        filenames : optional list of the filenames of the activities to load
+        message_names : optional list of the message types to load
+        field_names : optional dict of lists, keyed by message name, of the columns to load
+
+        '''
+        if not self._read_cache_index():
+            data = self._load_from_pickle(self.cache_dirpath)
+            if filenames is not None:
+                data = [d for d in data if d['strava_metadata'].filename.iloc[0] in filenames]
+            return data
+
+        activity_data = []
+        for ind, row in self.metadata.iterrows():
+            if row.filename not in self.cache_keys:
+                continue
+            if filenames is not None and row.filename not in filenames:
+                continue
+
+            key = self.cache_keys[row.filename]
+            if key not in self.activity_cache:
+                print('Warning: %s is not in the %s cache' % (row.filename, self.activity_cache.format))
+                continue
+
+            data = self.activity_cache.load(key, message_names, field_names)
+            data['strava_metadata'] = pd.DataFrame([row])
+            activity_data.append(data)
+
+        return activity_data
+
+
+    def _lazy_activity_data(self, from_cache, filenames, message_names, field_names, memory_budget):
         '''
-        Unpickle cached parsed data
+        Create a LazyActivityData sequence for the export's FIT files
+        (see the docstring for the `lazy` parameter of __init__)
+        '''
+        rows = self._fit_rows()
+        if from_cache:
+            if not self._read_cache_index():
+                raise ValueError('There is no cache index for %s' % self.root_dirname)
+            rows = [row for row in rows if row.filename in self.cache_keys]
+
+        if filenames is not None:
+            rows = [row for row in rows if row.filename in filenames]
+
+        return LazyActivityData(
+            rows, 
+            [os.path.join(self.root_dirpath, row.filename) for row in rows], 
+            self.activity_cache, 
+            self.cache_keys, 
+            memory_budget, 
+            message_names=message_names, 
+            field_names=field_names)
+
+
+    def _read_cache_index(self):
+        '''
+        Read the export's index of cache keys (written by self.to_cache) into self.cache_keys
+
+        Returns
+        -------
+        whether the index exists
+
+        '''
+        index_filepath = os.path.join(self.cache_dirpath, CACHE_INDEX_FILENAME)
+        if not os.path.isfile(index_filepath):
+            return False
+
+        index = pd.read_csv(index_filepath)
+        self.cache_keys.update(zip(index.filename, index.cache_key))
+        return True
+
+
+    def _fit_rows(self):
+        '''
+        The rows of the activity metadata that correspond to FIT files
+        (this excludes activities without a file and activities in GPX format)
+        '''
+        rows = []
+        for ind, row in self.metadata.iterrows():
+            if pd.isna(row.filename) or 'gpx' in row.filename.split('.'):
+                continue
+            rows.append(row)
+        return rows
+
+
+    @staticmethod
+    def _load_from_pickle(cache_dirpath):
+        '''
+        Unpickle cached parsed data 
+        (from the single pickle file written by earlier versions of self.to_cache)
         '''
         filepaths = glob.glob(os.path.join(cache_dirpath, '*.p'))
         filepath = sorted(filepaths)[-1]
@@ -67,19 +214,21 @@ class StravaExportManager(object):
         return data
 
 
-    def parse_all(self):
+    def scan_all(self):
         '''
-        Parse all of the FIT files that appear in the Strava export's activity metadata
+        Generate activity metadata for all of the FIT files in the Strava export
+        without parsing their records (see LocalActivity.metadata_from_fit_file)
 
-        **Note that this method ignores activities in other formats (e.g., GPX format)**
+        This is much faster than self.parse_all, and can be used to decide
+        which activities to parse (and ingest) before parsing them. 
 
         Returns
         -------
-        self.activity_data : list of dicts of dataframes, keyed by message name
-        self.parsing_errors : list of metadata rows on which file_utils.parse_fit failed
+        self.fit_metadata : dataframe of activity metadata, one row per FIT file
+        self.scanning_errors : list of metadata rows on which the scan failed
 
         '''
-        activity_data = []
+        fit_metadata = []
         errors = []
         for ind, row in self.metadata.iterrows():    
             sys.stdout.write('\r%s: %s' % (row.date, row.filename))
@@ -88,14 +237,97 @@ class StravaExportManager(object):
                 continue
 
             try:
-                data = file_utils.parse_fit(os.path.join(self.root_dirpath, row.filename))
+                metadata = LocalActivity.metadata_from_fit_file(
+                    os.path.join(self.root_dirpath, row.filename), 
+                    strava_metadata=pd.DataFrame([row]))
             except Exception as error:
                 errors.append([row, error])
                 continue
 
-            # use a dataframe here for consistency with message dataframes
-            data['strava_metadata'] = pd.DataFrame([row])
-            activity_data.append(data)
+            fit_metadata.append(metadata)
+
+        if len(errors):
+            print('Warning: some errors occured; inspect scanning_errors for details')
+
+        self.fit_metadata = pd.DataFrame(fit_metadata)
+        self.scanning_errors = errors
+
+
+    def parse_all(self, workers=1, chunksize=4, use_cache=True, callback=None):
+        '''
+        Parse all of the FIT files that appear in the Strava export's activity metadata
+
+        **Note that this method ignores activities in other formats (e.g., GPX format)**
+
+        Parameters
+        ----------
+        workers : the number of processes in which to parse the FIT files;
+                  if greater than one, the files are distributed across a multiprocessing pool
+        chunksize : the number of files sent to a worker process at a time
+        use_cache : whether to load previously-parsed data from the activity cache
+                    (so that only new or changed FIT files are parsed),
+                    and to cache the data from the FIT files that are parsed
+        callback : optional function that is called with the dict of parse stats for each file
+                   (see below) as soon as the file has been parsed (or loaded from the cache)
+
+        Returns
+        -------
+        self.activity_data : list of dicts of dataframes, keyed by message name
+                             (in the same order as the rows of the activity metadata)
+        self.parsing_errors : list of metadata rows on which file_utils.parse_fit failed
+        self.parse_stats : dataframe of parse stats, one row per file, with the columns
+                           filename, cached (whether the data was loaded from the cache), 
+                           wall_time (in seconds), num_bytes (the size of the file), 
+                           num_records, and num_<message_name> for each message type,
+                           and an error column (the exception message, if parsing failed)
+        self.parse_throughput : one-row dataframe of the aggregate number of files, records, and bytes,
+                                total wall time, and files/sec, records/sec, and bytes/sec
+
+        '''
+        start_time = time.time()
+
+        rows = self._fit_rows()
+        filepaths = [os.path.join(self.root_dirpath, row.filename) for row in rows]
+
+        # the files are hashed (to find their cache keys) in the worker processes,
+        # and only if the cache is used
+        activity_cache = self.activity_cache if use_cache else None
+        jobs = [(filepath, activity_cache) for filepath in filepaths]
+
+        activity_data = []
+        errors = []
+        parse_stats = []
+        with utils.imap_in_pool(_parse_fit_file, jobs, workers, chunksize) as results:
+            # imap returns the results in the same order as the filepaths
+            for row, filepath, (key, result) in zip(rows, filepaths, results):
+                sys.stdout.write('\r%s: %s' % (row.date, row.filename))
+
+                # files that are already in the cache are loaded here rather than in the workers
+                # (so that npy-cached data is memory-mapped rather than copied between processes)
+                flag = result is None
+                if flag:
+                    data, error, stats = _load_cached_file(self.activity_cache, key, filepath)
+                else:
+                    data, error, stats = result
+
+                stats['filename'] = row.filename
+                stats['cached'] = flag
+                parse_stats.append(stats)
+                if callback is not None:
+                    callback(stats)
+
+                if error is not None:
+                    errors.append([row, error])
+                    continue
+                if not flag and key is not None:
+                    self.activity_cache.save(key, data)
+
+                if key is not None:
+                    self.cache_keys[row.filename] = key
+
+                # use a dataframe here for consistency with message dataframes
+                data['strava_metadata'] = pd.DataFrame([row])
+                activity_data.append(data)
 
         if len(errors):
             print('Warning: some errors occured; inspect parsing_errors for details')
@@ -103,18 +335,151 @@ class StravaExportManager(object):
         self.activity_data = activity_data
         self.parsing_errors = errors
 
+        columns = ['filename', 'cached', 'wall_time', 'num_bytes', 'num_records']
+        parse_stats = pd.DataFrame(parse_stats)
+        message_columns = sorted(set(parse_stats.columns) - set(columns + ['error']))
+        parse_stats = parse_stats.reindex(columns=columns + message_columns + ['error'])
+
+        # messages that do not appear in a file have a count of zero
+        parse_stats[message_columns] = parse_stats[message_columns].fillna(0).astype(int)
+        self.parse_stats = parse_stats
+
+        wall_time = time.time() - start_time
+        self.parse_throughput = pd.DataFrame([{
+            'num_files': parse_stats.shape[0],
+            'num_records': parse_stats.num_records.sum(),
+            'num_bytes': parse_stats.num_bytes.sum(),
+            'wall_time': wall_time,
+            'files_per_sec': parse_stats.shape[0]/wall_time,
+            'records_per_sec': parse_stats.num_records.sum()/wall_time,
+            'bytes_per_sec': parse_stats.num_bytes.sum()/wall_time,
+        }])
 
-    def to_cache(self):
+
+    def to_cache(self, cache_format=None):
         '''
-        Pickle and cache the parsed data
+        Cache the parsed data of each activity (see ParsedDataCache)
+        and write the export's index of cache keys
+
+        Parameters
+        ----------
+        cache_format : optional cache format ('pickle' or 'npy'); 
+                       if None, the format of self.activity_cache is used
+
         '''
-        timestamp = datetime.datetime.now().strftime('%Y-%m-%d')
-        filepath = os.path.join(self.cache_dirpath, '%s_all-parsed-fit-files.p' % timestamp)
+        cache = self.activity_cache
+        if cache_format is not None and cache_format!=cache.format:
+            cache = ParsedDataCache(cache.dirpath, format=cache_format)
+
+        # (lazily-loaded activities are cached when they are first loaded)
+        activity_data = self.activity_data
+        if isinstance(activity_data, LazyActivityData):
+            activity_data = []
+
+        for data in activity_data:
+            filename = data['strava_metadata'].filename.iloc[0]
+
+            key = self.cache_keys.get(filename)
+            if key is None:
+                key = self.activity_cache.key(os.path.join(self.root_dirpath, filename))
+                self.cache_keys[filename] = key
+
+            if key not in cache:
+                cache.save(
+                    key, {name: df for name, df in data.items() if name!='strava_metadata'})
+
+        index = pd.DataFrame(
+            data=list(self.cache_keys.items()), columns=['filename', 'cache_key'])
+        index.to_csv(os.path.join(self.cache_dirpath, CACHE_INDEX_FILENAME), index=False)
 
-        if os.path.isfile(filepath):
-            print('Warning: cached data already exists')
-            return
 
-        with open(filepath, 'wb') as file:
-            pickle.dump(self.activity_data, file)
 
+def _cache_key(activity_cache, filepath):
+    '''
+    The cache key of a FIT file, or None if the file cannot be read
+    (in which case the error is raised again, and recorded, when the file is parsed)
+    '''
+    try:
+        return activity_cache.key(filepath)
+    except Exception:
+        return None
+
+
+
+def _parse_fit_file(job):
+    '''
+    Parse one FIT file (called in worker processes by StravaExportManager.parse_all)
+
+    Exceptions are returned rather than raised, so that one bad file does not abort the batch
+
+    Parameters
+    ----------
+    job : (filepath, activity_cache), where activity_cache is None if the cache is not used
+
+    Returns
+    -------
+    (key, result) : the file's cache key (None if the cache is not used or the file cannot be hashed),
+                    and either None (if the file is already in the cache) or 
+                    (data, error, stats): the parsed data (or None), the exception raised while parsing 
+                    (or None), and a dict of parse stats (see StravaExportManager.parse_all)
+
+    '''
+    filepath, activity_cache = job
+
+    # a file that cannot be hashed (e.g., because it is missing) is parsed anyway,
+    # so that the error is recorded in parsing_errors along with all of the other parsing errors
+    key = _cache_key(activity_cache, filepath) if activity_cache is not None else None
+    if key is not None and key in activity_cache:
+        return key, None
+
+    start_time = time.time()
+    num_bytes = np.nan
+    try:
+        num_bytes = file_utils.get_file_size(filepath)
+        data, error = file_utils.parse_fit(filepath), None
+    except Exception as err:
+        data, error = None, err
+
+    stats = _parse_stats(data, time.time() - start_time)
+    stats['num_bytes'] = num_bytes
+    if error is not None:
+        stats['error'] = str(error)
+
+    return key, (data, error, stats)
+
+
+
+def _load_cached_file(activity_cache, key, filepath):
+    '''
+    Load the cached data of one FIT file (called by StravaExportManager.parse_all)
+
+    As in _parse_fit_file, exceptions are returned rather than raised
+    '''
+    start_time = time.time()
+    num_bytes = np.nan
+    try:
+        num_bytes = file_utils.get_file_size(filepath)
+        data, error = activity_cache.load(key), None
+    except Exception as err:
+        data, error = None, err
+
+    stats = _parse_stats(data, time.time() - start_time)
+    stats['num_bytes'] = num_bytes
+    if error is not None:
+        stats['error'] = str(error)
+
+    return data, error, stats
+
+
+
+def _parse_stats(data, wall_time):
+    '''
+    The wall time and the number of messages of each type for one parsed file
+    '''
+    stats = {'wall_time': wall_time, 'num_records': 0}
+    for message_name, df in (data or {}).items():
+        if message_name=='record':
+            stats['num_records'] = df.shape[0]
+        else:
+            stats['num_%s' % message_name] = df.shape[0]
+    return stats
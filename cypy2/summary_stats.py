@@ -0,0 +1,156 @@
+import numpy as np
+import pandas as pd
+
+from cypy2 import constants
+
+
+# the processed records columns from which the summary statistics are calculated
+SUMMARY_INPUT_COLUMNS = ['distance', 'altitude', 'power', 'power_ma', 'heart_rate', 'pause_mask']
+
+# the summary statistics, in order
+# (the names match the corresponding columns of raw_summary, but the units are those
+# of the processed records: times in seconds, distance in miles, and ascent/descent in feet)
+SUMMARY_COLUMNS = [
+    'total_elapsed_time',
+    'moving_time',
+    'total_distance',
+    'total_ascent',
+    'total_descent',
+    'avg_power',
+    'max_power',
+    'normalized_power',
+    'threshold_power',
+    'intensity_factor',
+    'training_stress_score',
+    'avg_heart_rate',
+    'max_heart_rate',
+]
+
+
+def summarize_records(records, threshold_powers=None, timestep=None):
+    '''
+    Summary statistics of the processed records of one or more activities
+
+    All of the activities are summarized at once: each column of the records is concatenated
+    across activities, and each statistic is a segmented reduction (np.add.reduceat, etc)
+    over the concatenated column, so that the time is dominated by a few passes over the data
+    rather than by a python loop over activities.
+
+    The moving time, averages, and normalized power exclude the paused timepoints
+    (the 30-second moving average of power is already NaN whenever its window overlaps a pause).
+    The normalized power is the fourth root of the mean of the fourth power of power_ma;
+    the intensity factor is the normalized power divided by the threshold power, and the TSS is
+    100 times the moving time (in hours) times the square of the intensity factor.
+
+    Statistics whose columns are missing (e.g., power for activities without a power meter)
+    are NaN, as are the intensity factor and TSS for activities without a threshold power.
+
+    Parameters
+    ----------
+    records : dataframe of processed records, or a list of them (one per activity)
+    threshold_powers : optional threshold power (FTP) in watts, or a list of them (one per activity)
+    timestep : the sampling interval of the records in seconds
+               (if None, constants.interpolation_timestep)
+
+    Returns
+    -------
+    summary : dataframe of the SUMMARY_COLUMNS, with one row per activity
+
+    '''
+
+    if isinstance(records, pd.DataFrame):
+        records = [records]
+
+    if timestep is None:
+        timestep = constants.interpolation_timestep
+
+    num_activities = len(records)
+    lengths = np.array([len(df) for df in records], dtype=int)
+    offsets = np.concatenate(([0], np.cumsum(lengths)[:-1])).astype(int)
+
+    # the segmented reductions are over the nonempty activities
+    # (np.ufunc.reduceat does not support empty segments)
+    nonempty = lengths > 0
+    starts = offsets[nonempty]
+
+    def concatenated(column):
+        return np.concatenate([
+            df[column].values if column in df.columns else np.full(len(df), np.nan)
+            for df in records] + [np.array([])]).astype(float, copy=False)
+
+    def reduce(values, func, dtype=None):
+        # (any NaNs must already have been replaced by the identity of func)
+        result = np.full(num_activities, np.nan)
+        if len(starts):
+            result[nonempty] = func.reduceat(values, starts, dtype=dtype)
+        return result
+
+    def segment_sum(values):
+        return reduce(np.where(np.isnan(values), 0, values), np.add)
+
+    def segment_mean(values):
+        valid = ~np.isnan(values)
+        counts = reduce(valid, np.add, dtype=np.int64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return reduce(np.where(valid, values, 0), np.add)/counts
+
+    def segment_max(values):
+        result = reduce(np.where(np.isnan(values), -np.inf, values), np.maximum)
+        result[np.isinf(result)] = np.nan
+        return result
+
+    def segment_min(values):
+        result = reduce(np.where(np.isnan(values), np.inf, values), np.minimum)
+        result[np.isinf(result)] = np.nan
+        return result
+
+    # the moving timepoints
+    # (activities without a pause mask are assumed never to be paused)
+    pause_mask = concatenated('pause_mask')
+    moving = ~(pause_mask==1)
+
+    def moving_values(column):
+        values = concatenated(column)
+        values[~moving] = np.nan
+        return values
+
+    summary = pd.DataFrame(index=np.arange(num_activities), columns=SUMMARY_COLUMNS, dtype=float)
+
+    # times
+    summary['total_elapsed_time'] = lengths*timestep
+    summary['moving_time'] = reduce(moving, np.add, dtype=np.int64)*timestep
+
+    # the distance is cumulative
+    distance = concatenated('distance')
+    summary['total_distance'] = segment_max(distance) - segment_min(distance)
+
+    # the elevation gain and loss are the sums of the positive and negative altitude differences
+    # (the difference at the last timepoint of each activity would cross into the next activity)
+    altitude = concatenated('altitude')
+    altitude_diffs = np.append(np.diff(altitude), np.nan)
+    altitude_diffs[(offsets + lengths - 1)[nonempty]] = np.nan
+    summary['total_ascent'] = segment_sum(np.where(altitude_diffs > 0, altitude_diffs, 0))
+    summary['total_descent'] = -segment_sum(np.where(altitude_diffs < 0, altitude_diffs, 0))
+    summary.loc[~(reduce(~np.isnan(altitude), np.add, dtype=np.int64) >= 2), 
+        ['total_ascent', 'total_descent']] = np.nan
+
+    # power
+    summary['avg_power'] = segment_mean(moving_values('power'))
+    summary['max_power'] = segment_max(concatenated('power'))
+    summary['normalized_power'] = segment_mean(moving_values('power_ma')**4)**.25
+
+    if threshold_powers is None:
+        threshold_powers = np.nan
+    threshold_powers = np.broadcast_to(np.asarray(threshold_powers, dtype=float), (num_activities,))
+    threshold_powers = np.where(threshold_powers > 0, threshold_powers, np.nan)
+
+    summary['threshold_power'] = threshold_powers
+    summary['intensity_factor'] = summary.normalized_power/threshold_powers
+    summary['training_stress_score'] = \
+        100*summary.moving_time/constants.seconds_per_hour*summary.intensity_factor**2
+
+    # heart rate
+    summary['avg_heart_rate'] = segment_mean(moving_values('heart_rate'))
+    summary['max_heart_rate'] = segment_max(concatenated('heart_rate'))
+
+    return summary
@@ -1 +1,5 @@
 from cypy2.utils.utils import *
+from cypy2.utils.lru_cache import *
+from cypy2.utils.rolling import *
+from cypy2.utils.pauses import *
+from cypy2.utils.parallel import *
@@ -0,0 +1,122 @@
+import threading
+import collections
+import numpy as np
+import pandas as pd
+
+
+class LRUCache(object):
+    '''
+    A least-recently-used cache with a memory budget
+
+    Values are evicted, least-recently-used first, whenever the total size of the cached values
+    exceeds the budget (the most recently cached value is never evicted, 
+    even if it alone exceeds the budget).
+
+    The cache is thread-safe (e.g., it can be shared by the request threads of the Flask app):
+    every method holds the cache's lock while it reads or reorders the cached values.
+
+    Parameters
+    ----------
+    max_bytes : the memory budget, in bytes
+    sizeof : function that returns the size, in bytes, of a cached value
+
+    '''
+
+    def __init__(self, max_bytes, sizeof):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+
+        self._values = collections.OrderedDict()
+        self._sizes = {}
+        self.num_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        # (reentrant, because put calls pop)
+        self._lock = threading.RLock()
+
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._values
+
+
+    def __len__(self):
+        with self._lock:
+            return len(self._values)
+
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._values:
+                self.misses += 1
+                return default
+
+            self.hits += 1
+            self._values.move_to_end(key)
+            return self._values[key]
+
+
+    def put(self, key, value):
+        # the size is calculated before the lock is acquired, since it may be slow
+        size = self.sizeof(value)
+        with self._lock:
+            if key in self._values:
+                self.pop(key)
+
+            self._values[key] = value
+            self._sizes[key] = size
+            self.num_bytes += size
+
+            while self.num_bytes > self.max_bytes and len(self._values) > 1:
+                oldest_key = next(iter(self._values))
+                self.pop(oldest_key)
+                self.evictions += 1
+
+
+    def pop(self, key):
+        with self._lock:
+            value = self._values.pop(key)
+            self.num_bytes -= self._sizes.pop(key)
+            return value
+
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+            self._sizes.clear()
+            self.num_bytes = 0
+
+
+    def stats(self):
+        '''
+        The cache's size and hit/miss/eviction counts, as a dict
+        '''
+        with self._lock:
+            return {
+                'num_values': len(self._values),
+                'num_bytes': self.num_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+
+def sizeof_dataframes(data):
+    '''
+    The size in bytes of a dict of dataframes and numpy arrays, including those in nested dicts
+    (e.g., the processed columns in an activity's processing state; other values are ignored)
+    '''
+    size = 0
+    for value in data.values():
+        if isinstance(value, pd.DataFrame):
+            size += value.memory_usage(index=True, deep=True).sum()
+        elif isinstance(value, np.ndarray):
+            size += value.nbytes
+        elif isinstance(value, dict):
+            size += sizeof_dataframes(value)
+    return int(size)
@@ -0,0 +1,42 @@
+import contextlib
+import multiprocessing
+
+
+@contextlib.contextmanager
+def imap_in_pool(func, items, workers=1, chunksize=1):
+    '''
+    Map a function over items, in a multiprocessing pool if there is more than one worker
+
+    The results are yielded lazily and in the same order as the items (as by pool.imap).
+    When the block exits normally, the pool is closed and joined; 
+    if it exits with an error (including a KeyboardInterrupt), the pool is terminated 
+    so that the error is raised without waiting for the remaining items to be processed.
+
+    Usage
+    -----
+    with imap_in_pool(_process_activity, jobs, workers=4, chunksize=4) as results:
+        for processed_data, error in results:
+            ...
+
+    Parameters
+    ----------
+    func : the function to map (this must be picklable if workers is greater than one)
+    items : iterable of the arguments to func
+    workers : the number of processes; if one, func is mapped in the current process
+    chunksize : the number of items sent to a worker process at a time
+
+    '''
+    if workers <= 1:
+        yield map(func, items)
+        return
+
+    pool = multiprocessing.Pool(workers)
+    try:
+        yield pool.imap(func, items, chunksize=chunksize)
+    except BaseException:
+        pool.terminate()
+        raise
+    else:
+        pool.close()
+    finally:
+        pool.join()
@@ -0,0 +1,176 @@
+import numpy as np
+import pandas as pd
+
+
+class PauseIntervals(object):
+    '''
+    The pauses in an activity, as a sorted list of non-overlapping open intervals of elapsed time
+
+    A timepoint is paused if it lies strictly between the start and the stop of a pause
+    (this matches the mask originally calculated by Activity._calculate_pause_mask).
+    Overlapping pauses are merged, and empty pauses (whose stop is not after their start) are dropped.
+
+    The mask and the window masks are calculated in O(n + p log n) time,
+    for n timepoints and p pauses, by locating the pause boundaries in the timepoints
+    with np.searchsorted and taking a cumulative sum of the +1/-1 changes at the boundaries.
+
+    Usage
+    -----
+    pauses = PauseIntervals.from_events(activity.events('raw'), t0)
+    pause_mask = pauses.mask(records.elapsed_time.values)
+    paused_windows = pauses.window_mask(records.elapsed_time.values, window_size=30)
+
+    '''
+
+    def __init__(self, starts, stops):
+        '''
+        Parameters
+        ----------
+        starts, stops : the elapsed times, in seconds, at which each pause starts and stops
+
+        '''
+        starts = np.asarray(starts, dtype=float).flatten()
+        stops = np.asarray(stops, dtype=float).flatten()
+        if starts.shape != stops.shape:
+            raise ValueError('There must be the same number of pause starts and stops')
+
+        # drop the empty pauses and sort the rest by start time
+        nonempty = stops > starts
+        starts, stops = starts[nonempty], stops[nonempty]
+        order = np.argsort(starts, kind='stable')
+        starts, stops = starts[order], stops[order]
+
+        # merge the overlapping pauses: a pause begins a new interval
+        # if it does not start before the latest stop of the pauses before it
+        # (the intervals are open, so pauses that only touch are not merged)
+        latest_stops = np.maximum.accumulate(stops)
+        new_interval = np.ones(len(starts), dtype=bool)
+        new_interval[1:] = starts[1:] >= latest_stops[:-1]
+        first_inds = np.flatnonzero(new_interval)
+        last_inds = np.append(first_inds[1:] - 1, len(starts) - 1).astype(int)
+
+        self.starts = starts[first_inds]
+        self.stops = latest_stops[last_inds] if len(starts) else stops
+
+
+    @classmethod
+    def from_events(cls, events, t0):
+        '''
+        Pauses from the in-activity stop and start events
+        (that is, all of the events except the initial start and the final stop)
+
+        The pauses are from each stop event to the following start event,
+        and the elapsed times are rounded down to whole seconds
+
+        Parameters
+        ----------
+        events : raw events dataframe (with event_type and event_time columns)
+        t0 : the timestamp corresponding to an elapsed time of zero
+
+        '''
+        events = events.iloc[1:-1]
+        stops = events.loc[events.event_type=='stop'].event_time
+        starts = events.loc[events.event_type=='start'].event_time
+
+        def elapsed_seconds(timestamps):
+            timestamps = pd.to_datetime(timestamps).values.astype('datetime64[ns]').astype(np.int64)
+            t0_ns = pd.Timestamp(t0).to_datetime64().astype('datetime64[ns]').astype(np.int64)
+            return (timestamps - t0_ns) // 10**9
+
+        # each stop is paired with the next start (unpaired events are ignored)
+        num_pauses = min(len(stops), len(starts))
+        return cls(elapsed_seconds(stops)[:num_pauses], elapsed_seconds(starts)[:num_pauses])
+
+
+    @classmethod
+    def from_mask(cls, elapsed_time, pause_mask):
+        '''
+        Pauses from a pause mask (e.g., the pause_mask column of the processed records)
+
+        Each run of paused timepoints becomes a pause from the timepoint before the run
+        to the timepoint after it (at the edges, one second before or after the run),
+        so that mask(elapsed_time) reproduces pause_mask
+
+        '''
+        elapsed_time = np.asarray(elapsed_time, dtype=float)
+        pause_mask = np.asarray(pause_mask, dtype=bool)
+
+        changes = np.diff(np.concatenate(([0], pause_mask.astype(int), [0])))
+        first_inds = np.flatnonzero(changes==1)
+        last_inds = np.flatnonzero(changes==-1) - 1
+
+        padded_time = np.concatenate(([elapsed_time[0] - 1], elapsed_time, [elapsed_time[-1] + 1])) \
+            if len(elapsed_time) else elapsed_time
+        return cls(padded_time[first_inds], padded_time[last_inds + 2])
+
+
+    def __len__(self):
+        return len(self.starts)
+
+
+    def __repr__(self):
+        return '%s(%d pauses, %s seconds)' % (self.__class__.__name__, len(self), self.duration)
+
+
+    @property
+    def durations(self):
+        return self.stops - self.starts
+
+
+    @property
+    def duration(self):
+        '''
+        The total duration of the pauses in seconds
+        '''
+        return self.durations.sum()
+
+
+    def mask(self, elapsed_time):
+        '''
+        Boolean mask that is true at the paused timepoints
+
+        Parameters
+        ----------
+        elapsed_time : sorted array of elapsed times in seconds
+
+        '''
+        elapsed_time = np.asarray(elapsed_time)
+        num_timepoints = len(elapsed_time)
+
+        # the index of the first timepoint after each start
+        # and of the first timepoint at or after each stop
+        first_inds = np.searchsorted(elapsed_time, self.starts, side='right')
+        stop_inds = np.searchsorted(elapsed_time, self.stops, side='left')
+
+        # the number of pauses containing each timepoint
+        # (which, because the pauses do not overlap, is zero or one)
+        changes = (
+            np.bincount(first_inds, minlength=num_timepoints + 1)
+            - np.bincount(stop_inds, minlength=num_timepoints + 1))
+        return np.cumsum(changes[:num_timepoints]) > 0
+
+
+    def window_mask(self, elapsed_time, window_size):
+        '''
+        Boolean mask that is true at the timepoints whose trailing window overlaps a pause
+
+        The trailing window of the timepoint at index i is the timepoints from index i - window_size + 1
+        to index i (or from index 0, for the first window_size - 1 timepoints)
+
+        '''
+        counts = np.concatenate(([0], np.cumsum(self.mask(elapsed_time))))
+        inds = np.arange(1, len(counts))
+        return (counts[inds] - counts[np.clip(inds - window_size, 0, None)]) > 0
+
+
+    def paused_time(self, elapsed_time):
+        '''
+        The total paused time within the range of the elapsed times, in seconds
+        (the moving time is the duration of the activity minus this)
+
+        '''
+        if not len(elapsed_time):
+            return 0
+        starts = np.clip(self.starts, elapsed_time[0], elapsed_time[-1])
+        stops = np.clip(self.stops, elapsed_time[0], elapsed_time[-1])
+        return (stops - starts).sum()
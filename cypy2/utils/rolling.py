@@ -0,0 +1,128 @@
+import numpy as np
+
+
+# the statistics calculated by rolling_stats
+ROLLING_STATS = ['sum', 'mean', 'std', 'min', 'max']
+
+
+def rolling_stats(values, window_sizes, stats=None, pause_mask=None):
+    '''
+    Rolling statistics of a one-dimensional array over one or more window sizes
+
+    The windows are trailing windows (that is, the value at index i is calculated 
+    from values[i - window_size + 1:i + 1]) and the values for the first window_size - 1 indices are NaN.
+    A window's value is also NaN whenever the window contains a NaN or overlaps a pause
+    (this matches the moving average originally calculated by Activity._calculate_moving_average).
+
+    Memory and time are O(n) for each window size and statistic, independent of the window size:
+    all of the statistics are calculated from blockwise cumulative sums, minima, or maxima
+    (the van Herk/Gil-Werman algorithm; see _window_reduce). For sums, this is more precise 
+    than the difference of a cumulative sum over the whole array, 
+    because the magnitude of the partial sums is limited by the window size.
+
+    Parameters
+    ----------
+    values : one-dimensional array of values (assumed to be sampled at a constant rate)
+    window_sizes : a window size, or a list of window sizes, in samples
+    stats : optional list of the statistics to calculate (from ROLLING_STATS); if None, all are calculated
+    pause_mask : optional boolean array (of the same length as values) that is true during pauses
+
+    Returns
+    -------
+    dict of arrays (each of the same length as values), keyed by (stat, window_size)
+
+    '''
+
+    values = np.asarray(values, dtype=float)
+    window_sizes = [int(window_size) for window_size in np.atleast_1d(window_sizes)]
+
+    stats = stats or ROLLING_STATS
+    for stat in stats:
+        if stat not in ROLLING_STATS:
+            raise ValueError('%s is not a valid rolling statistic' % stat)
+
+    invalid = np.isnan(values)
+    if pause_mask is not None:
+        invalid |= np.asarray(pause_mask, dtype=bool)
+
+    # the invalid values are replaced by zero, because every window that contains them is NaN anyway
+    # (for the standard deviation, which does not depend on the center, the values are also centered
+    # to limit the loss of precision in the difference of the mean square and the squared mean)
+    center = values[~invalid].mean() if np.any(~invalid) else 0
+    values = np.where(invalid, 0, values)
+    centered_values = np.where(invalid, 0, values - center)
+
+    results = {}
+    for window_size in window_sizes:
+        if window_size < 1:
+            raise ValueError('Window sizes must be positive')
+
+        window_invalid = _window_reduce(invalid.astype(int), window_size, np.add, 0) > 0
+
+        for stat in stats:
+            if stat=='sum':
+                result = _window_reduce(values, window_size, np.add, 0)
+            elif stat=='mean':
+                result = _window_reduce(values, window_size, np.add, 0)/window_size
+            elif stat=='std':
+                mean = _window_reduce(centered_values, window_size, np.add, 0)/window_size
+                mean_sq = _window_reduce(centered_values**2, window_size, np.add, 0)/window_size
+                result = np.sqrt(np.clip(mean_sq - mean**2, 0, None))
+            elif stat=='min':
+                result = _window_reduce(values, window_size, np.minimum, np.inf)
+            elif stat=='max':
+                result = _window_reduce(values, window_size, np.maximum, -np.inf)
+
+            result[window_invalid] = np.nan
+            results[(stat, window_size)] = result
+
+    return results
+
+
+
+def rolling_mean(values, window_size, pause_mask=None):
+    '''
+    Rolling mean of a one-dimensional array (see rolling_stats)
+    '''
+    return rolling_stats(values, window_size, stats=['mean'], pause_mask=pause_mask)[('mean', window_size)]
+
+
+
+def _window_reduce(values, window_size, func, identity):
+    '''
+    Reduce the values over trailing windows using the van Herk/Gil-Werman algorithm
+
+    The values are divided into blocks of length window_size, and the reduction over each window 
+    combines the suffix reduction of the block in which the window starts 
+    with the prefix reduction of the block in which the window ends 
+    (or, if the window is exactly one block, only the suffix reduction of that block).
+
+    Parameters
+    ----------
+    func : a numpy ufunc (np.add, np.minimum, or np.maximum)
+    identity : the identity of func (0, np.inf, or -np.inf), used to pad the last block
+
+    Returns
+    -------
+    reduced : array of the same length as values; the values for the first window_size - 1 indices are NaN
+
+    '''
+    n = len(values)
+    reduced = np.full(n, np.nan)
+    if window_size > n:
+        return reduced
+
+    num_blocks = int(np.ceil(n/window_size))
+    blocks = np.full(num_blocks*window_size, identity, dtype=float)
+    blocks[:n] = values
+    blocks = blocks.reshape(num_blocks, window_size)
+
+    prefix = func.accumulate(blocks, axis=1).flatten()
+    suffix = func.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].flatten()
+
+    # windows that start at the beginning of a block lie entirely within that block
+    starts = np.arange(n - window_size + 1)
+    prefix = np.where(starts % window_size==0, identity, prefix[(window_size - 1):n])
+
+    reduced[(window_size - 1):] = func(suffix[:(n - window_size + 1)], prefix)
+    return reduced
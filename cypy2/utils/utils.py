@@ -1,26 +1,79 @@
 
+import os
 import numpy as np
 import pandas as pd
 
 
 def mask_internal_nans(values):
     '''
+    Mask the NaNs in an array that are not part of a run of leading or trailing NaNs
+
+    Parameters
+    ----------
+    values : a one-dimensional array, or a two-dimensional array 
+             (in which case each column is masked separately)
+
+    Returns
+    -------
+    mask : boolean array of the same shape as values
 
     '''
 
     mask = pd.isna(values)
+    valid = ~mask
+
+    # the positions of the first and last non-NaN values
+    positions = np.arange(mask.shape[0]).reshape((-1,) + (1,)*(mask.ndim - 1))
+    first = np.where(valid.any(axis=0), valid.argmax(axis=0), mask.shape[0])
+    last = mask.shape[0] - 1 - valid[::-1].argmax(axis=0)
+
+    return mask & (positions > first) & (positions < last)
 
-    def _drop_leading(mask):
-        ind = 0
-        while mask[ind]:
-            mask[ind] = False
-            ind += 1
-        return mask
 
-    mask = _drop_leading(mask)
-    mask = _drop_leading(mask[::-1])[::-1]
+def interpolate_columns(x, y, new_x):
+    '''
+    Linearly interpolate each column of a two-dimensional array at once
+
+    This is equivalent to calling np.interp(new_x, x, column) for each column 
+    (including the way in which np.interp handles NaNs and new x values equal to x values),
+    but without the overhead of interpolating each column separately
+
+    Parameters
+    ----------
+    x : one-dimensional array of increasing x values
+    y : array of y values, of shape (len(x), num_columns)
+    new_x : the x values at which to interpolate
+
+    '''
+
+    # the index of the interval that contains each new x value
+    ind = np.clip(np.searchsorted(x, new_x, side='right') - 1, 0, len(x) - 2)
 
-    return mask
+    x_lo, x_hi = x[ind][:, None], x[ind + 1][:, None]
+    y_lo, y_hi = y[ind], y[ind + 1]
+    new_x = np.asarray(new_x)[:, None]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = (y_hi - y_lo) / (x_hi - x_lo)
+        new_y = slope*(new_x - x_lo) + y_lo
+
+        # as in np.interp, if the interpolation is NaN in one direction, try the other
+        nans = np.isnan(new_y)
+        new_y[nans] = (slope*(new_x - x_hi) + y_hi)[nans]
+        nans = np.isnan(new_y) & (y_lo==y_hi)
+        new_y[nans] = y_lo[nans]
+
+    # new x values that are equal to x values are not interpolated
+    exact = np.broadcast_to(new_x==x_lo, new_y.shape)
+    new_y[exact] = y_lo[exact]
+
+    # new x values outside of the range of x take the first or last y values
+    first = np.broadcast_to(new_x <= x[0], new_y.shape)
+    new_y[first] = np.broadcast_to(y[0], new_y.shape)[first]
+    last = np.broadcast_to(new_x >= x[-1], new_y.shape)
+    new_y[last] = np.broadcast_to(y[-1], new_y.shape)[last]
+
+    return new_y
 
 
 def sliding_window(data, size, stepsize=1, padded=False, axis=-1, copy=True):
@@ -140,4 +193,30 @@ def weighted_linregress(x, y, w):
 
     offset, slope = beta.flatten()
     res = np.mean((y - (x * slope + offset))**2)**.5
-    return slope, offset, res
\ No newline at end of file
+    return slope, offset, res
+
+
+
+def write_atomically(path, write):
+    '''
+    Write a file by writing a temporary file that is then renamed to path
+
+    This is how all of the on-disk caches are written, so that other processes
+    (e.g., parallel workers) never see a partially-written file.
+    The temporary file is removed if writing it fails.
+
+    Parameters
+    ----------
+    path : the path to the file
+    write : function that takes an open binary file object and writes the contents to it
+
+    '''
+    temp_path = '%s.%s.tmp' % (path, os.getpid())
+    try:
+        with open(temp_path, 'wb') as file:
+            write(file)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
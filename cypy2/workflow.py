@@ -1,5 +1,6 @@
 
 
+import os
 import cypy2
 import psycopg2
 
@@ -28,12 +29,13 @@ def main():
     manager = cypy2.ActivityManager.from_strava_export(
         strava_export.activity_data, raise_errors=True)
 
+    # process the raw data of all of the activities in parallel
+    # (activities whose raw data and processing are unchanged are loaded from the cache)
+    manager.process_all(workers=os.cpu_count(), cache=cypy2.ProcessedDataCache())
+
     conn = connect_to_db('cypy2v2')
     for activity in manager.activities():
         
-        # process the raw data
-        activity.process()
-        
         # insert the raw data (metadata, records, and events)
         activity.to_db(conn, kind='raw', verbose=verbose)
         
@@ -0,0 +1,18 @@
+import os
+import sys
+import types
+
+
+# the tests import cypy2 from the repository, without installing it
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+# importing cypy2 imports dbutils, which is only needed for database access
+# (none of these tests use a database, so an empty module stands in for it if it is not installed)
+try:
+    import dbutils
+except ModuleNotFoundError:
+    sys.modules['dbutils'] = types.ModuleType('dbutils')
+
+
+# test_workflow.py is a script that requires a local database and Strava export
+collect_ignore = ['test_workflow.py']
@@ -0,0 +1,203 @@
+import gzip
+import struct
+import calendar
+import datetime
+
+from fitparse.records import Crc
+
+
+# FIT date_time values are seconds since UTC 00:00 Dec 31 1989
+FIT_EPOCH = 631065600
+
+# struct formats and invalid values of the FIT base types, keyed by base type number
+BASE_TYPES = {
+    0x00: ('B', 0xFF),          # enum
+    0x01: ('b', 0x7F),          # sint8
+    0x02: ('B', 0xFF),          # uint8
+    0x83: ('h', 0x7FFF),        # sint16
+    0x84: ('H', 0xFFFF),        # uint16
+    0x85: ('i', 0x7FFFFFFF),    # sint32
+    0x86: ('I', 0xFFFFFFFF),    # uint32
+    0x07: ('s', b''),           # string
+    0x0A: ('B', 0x00),          # uint8z
+    0x8C: ('I', 0x00000000),    # uint32z
+}
+
+ENUM, UINT8, UINT16, SINT32, UINT32, STRING, UINT32Z = 0x00, 0x02, 0x84, 0x85, 0x86, 0x07, 0x8C
+
+# the start time of the rides written by write_ride
+START_TIME = datetime.datetime(2018, 12, 8, 22, 35, 29)
+
+
+class FitWriter(object):
+    '''
+    Minimal FIT file encoder, for writing test files
+
+    Definitions are (def_num, base_type) or (def_num, base_type, size) tuples,
+    and data messages are lists of values in the order of their definition's fields
+    (None is written as the base type's invalid value)
+
+    '''
+
+    def __init__(self):
+        self._data = bytearray()
+        self._defs = {}
+
+
+    def define(self, local_mesg_num, global_mesg_num, fields, dev_fields=()):
+        '''
+        Write a definition message
+
+        dev_fields : optional list of (field_number, size, developer_data_index) tuples
+        '''
+        fields = [field if len(field)==3 else (field[0], field[1], None) for field in fields]
+        fields = [
+            (def_num, base_type, size or struct.calcsize('<' + BASE_TYPES[base_type][0]))
+            for def_num, base_type, size in fields]
+
+        header = 0x40 | local_mesg_num | (0x20 if dev_fields else 0)
+        self._data += struct.pack('<BBBHB', header, 0, 0, global_mesg_num, len(fields))
+        for def_num, base_type, size in fields:
+            self._data += struct.pack('<BBB', def_num, size, base_type)
+
+        if dev_fields:
+            self._data += struct.pack('<B', len(dev_fields))
+            for field in dev_fields:
+                self._data += struct.pack('<BBB', *field)
+
+        self._defs[local_mesg_num] = (fields, list(dev_fields))
+
+
+    def write(self, local_mesg_num, values, dev_values=(), time_offset=None):
+        '''
+        Write a data message (with a compressed timestamp header if time_offset is given)
+        '''
+        if time_offset is None:
+            self._data += struct.pack('<B', local_mesg_num)
+        else:
+            self._data += struct.pack('<B', 0x80 | (local_mesg_num << 5) | (time_offset & 0x1F))
+
+        fields, dev_fields = self._defs[local_mesg_num]
+        for (def_num, base_type, size), value in zip(fields, values):
+            fmt, invalid = BASE_TYPES[base_type]
+            if fmt=='s':
+                self._data += struct.pack('<%ds' % size, (value or '').encode())
+            else:
+                self._data += struct.pack('<' + fmt, invalid if value is None else value)
+
+        for (field_number, size, index), value in zip(dev_fields, dev_values):
+            self._data += struct.pack('<H', value)
+
+
+    def to_bytes(self):
+        header = struct.pack('<BBHI4s', 14, 0x10, 2093, len(self._data), b'.FIT')
+        header += struct.pack('<H', Crc.calculate(header))
+        contents = header + bytes(self._data)
+        return contents + struct.pack('<H', Crc.calculate(contents))
+
+
+
+def fit_timestamp(elapsed_time=0, start_time=START_TIME):
+    return calendar.timegm(start_time.timetuple()) - FIT_EPOCH + elapsed_time
+
+
+
+def write_ride(filepath, num_records=600, pauses=((100, 130), (400, 410)), start_time=START_TIME):
+    '''
+    Write a FIT file (gzipped, if filepath ends with .gz) of a ride with one record per second
+    (except during the pauses) that exercises the parts of the format that cypy2 handles specially:
+    compressed timestamps (every other record, and one of the start events),
+    local message numbers that are redefined, scaled fields with components
+    (speed and altitude), subfields (file_id.product and device_info.device_type),
+    an unknown field (record field 88), an unknown message type, and a developer field
+
+    '''
+    writer = FitWriter()
+
+    def timestamp(elapsed_time=0):
+        return fit_timestamp(elapsed_time, start_time)
+
+    # file_id (local 0, which is later redefined for the compressed records)
+    writer.define(0, 0, [(0, ENUM), (1, UINT16), (2, UINT16), (3, UINT32Z), (4, UINT32)])
+    writer.write(0, [4, 1, 2067, 1234, timestamp()])
+
+    # developer data (one uint16 developer field in the records)
+    writer.define(12, 207, [(3, UINT8)])
+    writer.write(12, [0])
+    writer.define(12, 206, [(0, UINT8), (1, UINT8), (2, UINT8), (3, STRING, 16), (8, STRING, 8)])
+    writer.write(12, [0, 0, 0x84, 'core_temp', 'C'])
+
+    # device_info (heart rate monitor and power meter)
+    writer.define(1, 23, [(253, UINT32), (0, UINT8), (1, UINT8), (25, ENUM), (2, UINT16)])
+    writer.write(1, [timestamp(), 1, 120, 1, 1])
+    writer.write(1, [timestamp(), 2, 11, 1, 1])
+
+    # an unknown message type
+    writer.define(15, 0xFF01, [(0, UINT8)])
+
+    # events with timestamps (local 2), and without them (local 1, for compressed timestamps)
+    writer.define(2, 21, [(253, UINT32), (0, ENUM), (1, ENUM)])
+    writer.define(1, 21, [(0, ENUM), (1, ENUM)])
+    writer.write(2, [timestamp(), 0, 0])
+
+    # records with timestamps (local 3), and without them (local 0)
+    record_fields = [(0, SINT32), (1, SINT32), (2, UINT16), (3, UINT8), (4, UINT8),
+                     (5, UINT32), (6, UINT16), (7, UINT16), (88, UINT8)]
+    writer.define(3, 20, [(253, UINT32)] + record_fields, dev_fields=[(0, 2, 0)])
+    writer.define(0, 20, record_fields, dev_fields=[(0, 2, 0)])
+
+    distance = 0
+    for elapsed_time in range(num_records):
+        for start, stop in pauses:
+            if elapsed_time==start:
+                writer.write(2, [timestamp(elapsed_time), 0, 4])
+            if elapsed_time==stop:
+                writer.write(1, [0, 0], time_offset=timestamp(elapsed_time))
+
+        if any(start < elapsed_time < stop for start, stop in pauses):
+            continue
+
+        if elapsed_time % 50==0:
+            writer.write(15, [elapsed_time % 200])
+
+        distance += 7 + (elapsed_time % 3)
+        values = [
+            int((37.7 + elapsed_time*1e-5)*2**31/180) if elapsed_time > 5 else None,
+            int((-122.4 + elapsed_time*1e-5)*2**31/180) if elapsed_time > 5 else None,
+            int((100 + (elapsed_time % 40) + 500)*5),
+            120 + (elapsed_time % 30),
+            85,
+            distance*100,
+            7000 + (elapsed_time % 7)*100,
+            200 + (elapsed_time % 50) if elapsed_time % 97 else None,
+            elapsed_time % 200,
+        ]
+        dev_values = [3700 + elapsed_time % 10]
+
+        if elapsed_time % 2:
+            writer.write(0, values, dev_values, time_offset=timestamp(elapsed_time))
+        else:
+            writer.write(3, [timestamp(elapsed_time)] + values, dev_values)
+
+    last_time = num_records - 1
+    writer.write(2, [timestamp(last_time), 0, 4])
+
+    # session and sport
+    writer.define(14, 18, [
+        (253, UINT32), (2, UINT32), (5, ENUM), (6, ENUM), (7, UINT32), (8, UINT32),
+        (9, UINT32), (20, UINT16), (21, UINT16)])
+    writer.write(14, [
+        timestamp(last_time), timestamp(), 2, 7, last_time*1000,
+        (last_time - sum(stop - start for start, stop in pauses))*1000, distance*100, 220, 249])
+
+    writer.define(13, 12, [(0, ENUM), (1, ENUM)])
+    writer.write(13, [2, 7])
+
+    contents = writer.to_bytes()
+    if filepath.endswith('.gz'):
+        with gzip.open(filepath, 'wb') as file:
+            file.write(contents)
+    else:
+        with open(filepath, 'wb') as file:
+            file.write(contents)
+    return filepath
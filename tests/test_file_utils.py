@@ -0,0 +1,208 @@
+import os
+import zipfile
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+import fitparse
+
+from cypy2 import file_utils
+from cypy2.activity import LocalActivity
+
+import fit_writer
+
+
+def _fitparse_reference(filepath, exclude_unknowns=True):
+    '''
+    The dataframes of each message type constructed from plain fitparse messages
+    '''
+    rows = {}
+    for message in fitparse.FitFile(filepath).get_messages():
+        if exclude_unknowns and message.name.startswith('unknown_'):
+            continue
+        rows.setdefault(message.name, []).append({
+            field.name: field.value for field in message
+            if not (exclude_unknowns and field.name.startswith('unknown_'))})
+    return {name: pd.DataFrame(rows[name]) for name in rows}
+
+
+def _assert_data_equal(data, reference):
+    assert sorted(data)==sorted(reference)
+    for name in reference:
+        pd.testing.assert_frame_equal(data[name], reference[name], check_like=True)
+
+
+@pytest.fixture(scope='module')
+def ride(tmp_path_factory):
+    return fit_writer.write_ride(str(tmp_path_factory.mktemp('fit') / 'ride.fit'))
+
+
+@pytest.mark.parametrize('exclude_unknowns', [True, False])
+@pytest.mark.parametrize('columnar', [True, False])
+def test_parse_fit_matches_fitparse(ride, columnar, exclude_unknowns):
+    data = file_utils.parse_fit(ride, columnar=columnar, exclude_unknowns=exclude_unknowns)
+    _assert_data_equal(data, _fitparse_reference(ride, exclude_unknowns))
+
+
+def test_columnar_dtypes(ride):
+    records = file_utils.parse_fit(ride, message_names=['record'])['record']
+
+    # integer fields without missing values stay integers, and are floats otherwise
+    assert records.heart_rate.dtype==np.int64
+    assert records.power.dtype==np.float64
+    assert records.timestamp.dtype==file_utils.DATETIME_DTYPE
+    assert np.isnan(records.position_lat.iloc[0])
+
+
+def test_compressed_timestamps(ride):
+    data = file_utils.parse_fit(ride, message_names=['record', 'event'])
+
+    # every other record, and the start events after pauses, have compressed timestamps
+    elapsed_time = (data['record'].timestamp - fit_writer.START_TIME).dt.total_seconds()
+    expected = [t for t in range(600) if not (100 < t < 130 or 400 < t < 410)]
+    np.testing.assert_array_equal(elapsed_time, expected)
+
+    events = data['event']
+    assert list(events.event_type)==['start', 'stop_all', 'start', 'stop_all', 'start', 'stop_all']
+    assert list(events.timestamp)==[
+        fit_writer.START_TIME + datetime.timedelta(seconds=t) for t in (0, 100, 130, 400, 410, 599)]
+
+
+@pytest.mark.parametrize('columnar', [True, False])
+def test_parse_fit_message_names(ride, columnar):
+    data = file_utils.parse_fit(ride, message_names=['event', 'record', 'lap'], columnar=columnar)
+    reference = _fitparse_reference(ride)
+
+    # requested message types that are not in the file correspond to empty dataframes
+    assert sorted(data)==['event', 'lap', 'record']
+    assert data['lap'].empty
+    for name in ['event', 'record']:
+        pd.testing.assert_frame_equal(data[name], reference[name], check_like=True)
+
+
+@pytest.mark.parametrize('columnar', [True, False])
+def test_iter_fit_messages_chunks(ride, columnar):
+    chunks = {}
+    for message_name, chunk in file_utils.iter_fit_messages(ride, chunk_size=100, columnar=columnar):
+        assert len(chunk) <= 100
+        chunks.setdefault(message_name, []).append(chunk)
+
+    # the chunk indexes continue from one chunk to the next
+    data = {name: pd.concat(dfs) for name, dfs in chunks.items()}
+    _assert_data_equal(data, file_utils.parse_fit(ride, columnar=columnar))
+
+
+def test_iter_fit_records(ride):
+    records = file_utils.parse_fit(ride, message_names=['record'])['record']
+
+    chunks = list(file_utils.iter_fit_records(ride, chunk_size=128, field_names=['timestamp', 'power']))
+    assert [len(chunk) for chunk in chunks]==[128, 128, 128, 128, 50]
+    pd.testing.assert_frame_equal(pd.concat(chunks), records[['timestamp', 'power']])
+
+    chunks = list(file_utils.iter_fit_records(ride, chunk_size=128, as_arrays=True))
+    for column in records.columns:
+        np.testing.assert_array_equal(
+            np.concatenate([chunk[column] for chunk in chunks]), records[column].values)
+
+
+def test_max_messages(ride):
+    data = file_utils.parse_fit(ride, message_names=['record', 'event'], max_messages={'record': 3})
+    assert len(data['record'])==3
+    assert len(data['event'])==6
+
+
+def test_metadata_from_fit_file(ride):
+    metadata = LocalActivity._generate_metadata(file_utils.parse_fit(ride))
+    assert metadata.power_flag and metadata.heart_rate_flag
+    pd.testing.assert_series_equal(LocalActivity.metadata_from_fit_file(ride), metadata)
+    assert LocalActivity.id_from_fit(ride)==metadata.activity_id
+
+
+@pytest.mark.parametrize('columnar', [True, False])
+def test_parse_fit_field_names(ride, columnar):
+
+    # enhanced_speed and enhanced_altitude are components of speed and altitude,
+    # garmin_product and antplus_device_type are subfields, and core_temp is a developer field
+    field_names = {
+        'record': ['timestamp', 'enhanced_speed', 'enhanced_altitude', 'core_temp'],
+        'file_id': ['garmin_product'],
+        'device_info': ['device_index', 'antplus_device_type'],
+        'event': ['event_type'],
+    }
+    data = file_utils.parse_fit(
+        ride, message_names=list(field_names), field_names=field_names, columnar=columnar)
+
+    reference = _fitparse_reference(ride)
+    for name, names in field_names.items():
+        pd.testing.assert_frame_equal(data[name], reference[name][names])
+
+    # requested fields that are not in the file are all-None columns
+    data = file_utils.parse_fit(
+        ride, message_names=['record'], field_names={'record': ['power', 'left_power_phase']}, 
+        columnar=columnar)
+    assert data['record'].left_power_phase.isnull().all()
+    pd.testing.assert_series_equal(data['record'].power, reference['record'].power)
+
+
+@pytest.mark.parametrize('stream', [True, False])
+def test_parse_gzipped_fit(ride, tmp_path, stream):
+    gzipped_ride = fit_writer.write_ride(str(tmp_path / 'ride.fit.gz'))
+    _assert_data_equal(file_utils.parse_fit(gzipped_ride, stream=stream), file_utils.parse_fit(ride))
+
+    fitfile = file_utils.open_fit(gzipped_ride, retain_messages=False, stream=stream)
+    assert len(list(fitfile.get_messages('record')))==562
+
+
+def test_decompressed_cache(ride, tmp_path):
+    cache_dirpath = str(tmp_path / 'cache')
+    gzipped_ride = fit_writer.write_ride(str(tmp_path / 'ride.fit.gz'))
+
+    data = file_utils.parse_fit(gzipped_ride, cache_dirpath=cache_dirpath)
+    _assert_data_equal(data, file_utils.parse_fit(ride))
+    cached_filenames = os.listdir(cache_dirpath)
+    assert len(cached_filenames)==1
+
+    # the cached copy is used when the file is parsed again
+    cached_filepath = os.path.join(cache_dirpath, cached_filenames[0])
+    cached_mtime = os.stat(cached_filepath).st_mtime_ns
+    _assert_data_equal(file_utils.parse_fit(gzipped_ride, cache_dirpath=cache_dirpath), data)
+    assert os.stat(cached_filepath).st_mtime_ns==cached_mtime
+
+    # a different file with the same name is decompressed again
+    fit_writer.write_ride(gzipped_ride, num_records=300, pauses=[])
+    records = file_utils.parse_fit(gzipped_ride, message_names=['record'], cache_dirpath=cache_dirpath)
+    assert len(records['record'])==300
+    assert len(os.listdir(cache_dirpath))==2
+
+
+def test_split_zip_path(tmp_path):
+    zip_filepath = str(tmp_path / 'export.zip')
+    with zipfile.ZipFile(zip_filepath, 'w') as archive:
+        archive.writestr('activities/1234.fit', b'')
+
+    member_path = os.path.join(zip_filepath, 'activities', '1234.fit')
+    assert file_utils.split_zip_path(member_path)==(zip_filepath, 'activities/1234.fit')
+
+    # paths that are not in an existing zip file are not split
+    filepath = os.path.join(str(tmp_path), 'activities', '1234.fit')
+    assert file_utils.split_zip_path(filepath)==(None, filepath)
+    filepath = os.path.join(str(tmp_path), 'other.zip', '1234.fit')
+    assert file_utils.split_zip_path(filepath)==(None, filepath)
+
+
+@pytest.mark.parametrize('stream', [True, False])
+def test_parse_fit_in_zip(ride, tmp_path, stream):
+    filepaths = {'ride.fit': ride, 'ride.fit.gz': fit_writer.write_ride(str(tmp_path / 'ride.fit.gz'))}
+    zip_filepath = str(tmp_path / 'export.zip')
+    with zipfile.ZipFile(zip_filepath, 'w') as archive:
+        for filename, filepath in filepaths.items():
+            archive.write(filepath, 'activities/%s' % filename)
+
+    data = file_utils.parse_fit(ride)
+    for filename, filepath in filepaths.items():
+        member_path = os.path.join(zip_filepath, 'activities', filename)
+        _assert_data_equal(file_utils.parse_fit(member_path, stream=stream), data)
+
+        with file_utils.open_file(member_path) as member, open(filepath, 'rb') as file:
+            assert member.read()==file.read()
@@ -0,0 +1,88 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+from cypy2 import utils
+
+
+def test_eviction_order():
+    cache = utils.LRUCache(30, len)
+    cache.put('a', 'x'*10)
+    cache.put('b', 'x'*10)
+    cache.put('c', 'x'*10)
+
+    # getting 'a' makes 'b' the least recently used value
+    assert cache.get('a')=='x'*10
+    cache.put('d', 'x'*10)
+    assert 'b' not in cache
+    assert [key in cache for key in 'acd']==[True, True, True]
+    assert cache.num_bytes==30
+
+
+def test_most_recent_value_is_never_evicted():
+    cache = utils.LRUCache(10, len)
+    cache.put('a', 'x'*5)
+    cache.put('b', 'x'*50)
+    assert 'a' not in cache
+    assert cache.get('b')=='x'*50
+    assert cache.num_bytes==50
+
+
+def test_replace_and_pop():
+    cache = utils.LRUCache(100, len)
+    cache.put('a', 'x'*10)
+    cache.put('a', 'x'*20)
+    assert len(cache)==1
+    assert cache.num_bytes==20
+
+    assert cache.pop('a')=='x'*20
+    assert cache.num_bytes==0
+
+    cache.put('b', 'x')
+    cache.clear()
+    assert len(cache)==0
+    assert cache.num_bytes==0
+
+
+def test_stats():
+    cache = utils.LRUCache(20, len)
+    cache.put('a', 'x'*10)
+    cache.put('b', 'x'*10)
+    cache.put('c', 'x'*10)
+    cache.get('c')
+    cache.get('a')
+    assert cache.get('a', default='missing')=='missing'
+
+    assert cache.stats()=={
+        'num_values': 2,
+        'num_bytes': 20,
+        'max_bytes': 20,
+        'hits': 1,
+        'misses': 2,
+        'evictions': 1,
+    }
+
+
+def test_concurrent_puts():
+    cache = utils.LRUCache(1000, len)
+
+    def put_many(thread_ind):
+        for ind in range(2000):
+            cache.put((thread_ind, ind % 50), 'x'*(ind % 20 + 1))
+            cache.get((thread_ind, (ind + 1) % 50))
+
+    threads = [threading.Thread(target=put_many, args=(ind,)) for ind in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert cache.num_bytes==sum(len(value) for value in cache._values.values())
+    assert cache.num_bytes <= 1000
+
+
+def test_sizeof_dataframes():
+    df = pd.DataFrame({'a': np.arange(100, dtype=np.int64)})
+    assert utils.sizeof_dataframes({'records': df, 'summary': None}) \
+        == df.memory_usage(index=True, deep=True).sum()
@@ -0,0 +1,140 @@
+import datetime
+
+import pandas as pd
+import pytest
+
+from cypy2 import file_utils
+from cypy2.activity import (Activity, LocalActivity)
+from cypy2.managers import ActivityManager
+from cypy2.processed_data_cache import ProcessedDataCache
+
+import fit_writer
+
+
+def _strava_activity_data(dirpath, num_activities=3):
+    '''
+    Parsed FIT-file data, as in StravaExportManager.activity_data, for rides on consecutive days
+    '''
+    activity_data = []
+    for ind in range(num_activities):
+        start_time = fit_writer.START_TIME + datetime.timedelta(days=ind)
+        filepath = fit_writer.write_ride(
+            str(dirpath / ('%d.fit' % ind)), num_records=300 + 100*ind, start_time=start_time)
+
+        data = file_utils.parse_fit(filepath)
+        data['strava_metadata'] = pd.DataFrame([{
+            'id': ind,
+            'date': start_time.strftime('%b %d, %Y, %I:%M:%S %p'),
+            'name': 'Ride %d' % ind,
+            'type': 'Ride',
+            'gear': 'Bike',
+            'filename': 'activities/%d.fit' % ind,
+        }])
+        activity_data.append(data)
+    return activity_data
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_from_strava_export(tmp_path, workers):
+    activity_data = _strava_activity_data(tmp_path)
+
+    # data that cannot be constructed is skipped, and the error is recorded with its index
+    manager = ActivityManager.from_strava_export(
+        activity_data[:1] + [{}] + activity_data[1:], workers=workers, chunksize=1)
+    assert [ind for ind, error in manager.construction_errors]==[1]
+
+    expected = [LocalActivity(data, strava_metadata=data['strava_metadata']) for data in activity_data]
+    pd.testing.assert_frame_equal(
+        manager.metadata().drop(columns='activity').reset_index(drop=True),
+        pd.DataFrame([activity.metadata for activity in expected]))
+
+    for activity, expected_activity in zip(manager.activities(), expected):
+        assert isinstance(activity, LocalActivity)
+        for kind in ['records', 'events', 'summary']:
+            pd.testing.assert_frame_equal(activity._raw_data[kind], expected_activity._raw_data[kind])
+
+    with pytest.raises(Exception):
+        ActivityManager.from_strava_export([{}], raise_errors=True, workers=workers)
+
+
+def _assert_processed_data_equal(activity, expected_activity):
+    processed_data, expected = activity._processed_data, expected_activity._processed_data
+    pd.testing.assert_frame_equal(processed_data['records'], expected['records'])
+    pd.testing.assert_frame_equal(processed_data['summary'], expected['summary'])
+    assert processed_data['processing_key']==expected['processing_key']
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_process_all_matches_process(tmp_path, workers):
+    activity_data = _strava_activity_data(tmp_path)
+    manager = ActivityManager.from_strava_export(activity_data)
+    manager.process_all(workers=workers)
+    assert not manager.processing_errors
+
+    for activity, data in zip(manager.activities(), activity_data):
+        expected_activity = LocalActivity(data, strava_metadata=data['strava_metadata'])
+        expected_activity.process()
+        _assert_processed_data_equal(activity, expected_activity)
+
+
+def _db_activity(local_activity, threshold_power):
+    '''
+    An activity as loaded by ActivityManager.from_db, whose raw data has no summary
+    (so its threshold power comes only from its raw_summary row)
+    '''
+    activity = Activity(local_activity.metadata, source='db')
+    activity._raw_data = dict(local_activity._raw_data, summary=None)
+    activity._raw_threshold_power = threshold_power
+    return activity
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_process_all_uses_raw_summary_threshold_power(tmp_path, workers):
+    local_activities = [
+        LocalActivity(data, strava_metadata=data['strava_metadata']) 
+        for data in _strava_activity_data(tmp_path, num_activities=2)]
+
+    activities = [_db_activity(activity, 250.) for activity in local_activities]
+    metadata = pd.DataFrame([activity.metadata for activity in activities])
+    metadata['activity'] = activities
+
+    manager = ActivityManager(metadata)
+    manager.process_all(workers=workers)
+    assert not manager.processing_errors
+
+    for activity, local_activity in zip(manager.activities(), local_activities):
+        expected_activity = _db_activity(local_activity, 250.)
+        expected_activity.process()
+        _assert_processed_data_equal(activity, expected_activity)
+
+        summary = activity._processed_data['summary'].iloc[0]
+        assert summary.threshold_power==250. and summary.training_stress_score > 0
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_process_all_cache(tmp_path, capsys, workers):
+    local_activities = [
+        LocalActivity(data, strava_metadata=data['strava_metadata']) 
+        for data in _strava_activity_data(tmp_path, num_activities=2)]
+    cache = ProcessedDataCache(str(tmp_path / 'cache'))
+
+    def process_all():
+        activities = [_db_activity(activity, 250.) for activity in local_activities]
+        metadata = pd.DataFrame([activity.metadata for activity in activities])
+        metadata['activity'] = activities
+        manager = ActivityManager(metadata)
+        manager.process_all(workers=workers, cache=cache)
+        assert not manager.processing_errors
+        return manager
+
+    manager = process_all()
+    assert 'Loaded processed data for 0 of 2 activities' in capsys.readouterr().out
+    for activity in manager.activities():
+        assert activity._processed_data['processing_key']==activity.processing_key()
+        assert activity.processing_key() in cache
+
+    # the processed data is cached under the key that it is looked up by, so a rerun only loads it
+    cached_manager = process_all()
+    assert 'Loaded processed data for 2 of 2 activities' in capsys.readouterr().out
+    for activity, expected_activity in zip(cached_manager.activities(), manager.activities()):
+        _assert_processed_data_equal(activity, expected_activity)
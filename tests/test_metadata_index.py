@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from cypy2.metadata_index import MetadataIndex
+from cypy2.predicates import (parse_predicates, predicates_to_mask)
+
+
+@pytest.fixture
+def metadata():
+    rng = np.random.default_rng(0)
+    num_activities = 1000
+
+    timestamps = pd.Timestamp('2017-01-01') + pd.to_timedelta(
+        rng.integers(0, 3*365*24*3600, num_activities), unit='s')
+    return pd.DataFrame({
+        'activity_id': timestamps.strftime('%Y%m%d%H%M%S'),
+        'activity_type': rng.choice(['ride', 'run', 'walk'], num_activities),
+        'bike_name': rng.choice(['lynskey-cx', 'giant-defy-advanced', None], num_activities),
+        'total_distance': rng.integers(1000, 100000, num_activities),
+    })
+
+
+def _naive_select(metadata, activity_id=None, start=None, stop=None, **kwargs):
+    '''
+    The rows selected by MetadataIndex.select, found by filtering every row
+    '''
+    metadata = metadata.sort_values('activity_id', kind='stable').reset_index(drop=True)
+    mask = predicates_to_mask(metadata, parse_predicates(kwargs))
+    if activity_id:
+        mask &= metadata.activity_id.str.startswith(activity_id).values
+    if start:
+        mask &= (metadata.activity_id >= start).values
+    if stop:
+        mask &= (metadata.activity_id.str[:len(stop)] <= stop).values
+    return metadata.loc[mask]
+
+
+@pytest.mark.parametrize('criteria', [
+    {},
+    {'activity_id': '2018'},
+    {'activity_id': '201803'},
+    {'activity_id': '2016'},
+    {'start': '20180315', 'stop': '201806'},
+    {'start': '2019', 'activity_id': '2018'},
+    {'activity_type': 'ride'},
+    {'activity_type': 'swim'},
+    {'bike_name__in': ['lynskey-cx', 'giant-defy-advanced']},
+    {'activity_type': 'ride', 'bike_name': 'lynskey-cx', 'activity_id': '2019'},
+    {'total_distance__gt': 50000, 'activity_type__in': ['ride', 'run']},
+    {'total_distance__range': (20000, 30000), 'start': '2018', 'stop': '2018'},
+    {'activity_type__ne': 'walk', 'bike_name__startswith': 'giant'},
+])
+def test_select_matches_naive_filter(metadata, criteria):
+    index = MetadataIndex(metadata)
+    pd.testing.assert_frame_equal(index.select(**criteria), _naive_select(metadata, **criteria))
+
+
+def test_select_by_activity_id_is_a_view(metadata):
+    index = MetadataIndex(metadata)
+    selected = index.select(activity_id='2018')
+    assert np.shares_memory(selected.total_distance.values, index.metadata.total_distance.values)
+
+
+def test_select_unknown_columns(metadata):
+    index = MetadataIndex(metadata)
+
+    # equality predicates on other columns are ignored, but other predicates raise
+    pd.testing.assert_frame_equal(index.select(device_model='edge-520'), index.select())
+    with pytest.raises(ValueError):
+        index.select(device_model__in=['edge-520'])
+    with pytest.raises(ValueError):
+        index.select(total_ascent__gt=1000)
+
+
+def test_contains(metadata):
+    index = MetadataIndex(metadata)
+    assert metadata.activity_id.iloc[0] in index
+    assert '20160101000000' not in index
+    assert '99999999999999' not in index
@@ -0,0 +1,78 @@
+import os
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from cypy2 import file_utils
+from cypy2.strava.parsed_data_cache import ParsedDataCache
+
+import fit_writer
+
+
+def _memmap_base(values):
+    '''
+    The np.memmap that backs an array, or None
+    '''
+    while values is not None and not isinstance(values, np.memmap):
+        values = getattr(values, 'base', None)
+    return values
+
+
+@pytest.fixture(scope='module')
+def ride(tmp_path_factory):
+    return fit_writer.write_ride(str(tmp_path_factory.mktemp('fit') / 'ride.fit.gz'))
+
+
+@pytest.mark.parametrize('format', ['pickle', 'npy'])
+def test_round_trip(ride, tmp_path, format):
+    cache = ParsedDataCache(str(tmp_path), format=format)
+    data = file_utils.parse_fit(ride)
+
+    key = cache.key(ride)
+    assert key.endswith('-v%s' % file_utils.PARSER_VERSION)
+    assert key not in cache
+
+    cache.save(key, data)
+    assert key in cache
+    assert not [name for name in os.listdir(str(tmp_path)) if name.endswith('.tmp')]
+
+    loaded_data = cache.load(key)
+    assert list(loaded_data)==list(data)
+    for name in data:
+        pd.testing.assert_frame_equal(loaded_data[name], data[name])
+
+
+@pytest.mark.parametrize('format', ['pickle', 'npy'])
+def test_selective_load(ride, tmp_path, format):
+    cache = ParsedDataCache(str(tmp_path), format=format)
+    data = file_utils.parse_fit(ride)
+    key = cache.key(ride)
+    cache.save(key, data)
+
+    loaded_data = cache.load(key, ['record', 'event'], {'record': ['power', 'heart_rate']})
+    assert sorted(loaded_data)==['event', 'record']
+    pd.testing.assert_frame_equal(loaded_data['record'], data['record'][['heart_rate', 'power']])
+    pd.testing.assert_frame_equal(loaded_data['event'], data['event'])
+
+
+def test_npy_columns_are_memory_mapped(ride, tmp_path):
+    cache = ParsedDataCache(str(tmp_path), format='npy')
+    data = file_utils.parse_fit(ride)
+    key = cache.key(ride)
+    cache.save(key, data)
+
+    # only the requested columns are read (so the other columns' files are not needed)
+    record_dirpath = os.path.join(str(tmp_path), key, 'record')
+    with open(os.path.join(record_dirpath, 'columns.json')) as file:
+        manifest = json.load(file)
+    for column in manifest['columns']:
+        if column['name']!='power':
+            os.remove(os.path.join(record_dirpath, column['filename']))
+
+    records = cache.load(key, ['record'], {'record': ['power']})['record']
+    pd.testing.assert_series_equal(records.power, data['record'].power)
+
+    # numeric columns are backed by memory maps of the cached files
+    assert _memmap_base(records.power.to_numpy()) is not None
@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from cypy2 import utils
+from cypy2.utils import PauseIntervals
+
+
+def _loop_mask(elapsed_time, starts, stops):
+    '''
+    The pause mask as it was originally calculated by Activity._calculate_pause_mask
+    '''
+    mask = np.zeros(len(elapsed_time))
+    for start, stop in zip(starts, stops):
+        mask += (elapsed_time > start) & (elapsed_time < stop)
+    return mask.astype(bool)
+
+
+@pytest.fixture
+def elapsed_time():
+    return np.arange(0, 3600)
+
+
+def test_mask_matches_loop(elapsed_time):
+    rng = np.random.default_rng(0)
+    starts = np.sort(rng.choice(3600, 40, replace=False)).astype(float)
+    stops = starts + rng.integers(0, 120, 40)
+
+    # (including pauses that overlap, are empty, or extend past the ends of the activity)
+    starts = np.concatenate((starts, [-10, 3590, 100]))
+    stops = np.concatenate((stops, [5, 4000, 100]))
+
+    pauses = PauseIntervals(starts, stops)
+    np.testing.assert_array_equal(pauses.mask(elapsed_time), _loop_mask(elapsed_time, starts, stops))
+
+
+def test_overlapping_pauses_are_merged():
+    pauses = PauseIntervals([30, 10, 15, 50, 60], [40, 20, 25, 60, 70])
+    np.testing.assert_array_equal(pauses.starts, [10, 30, 50, 60])
+    np.testing.assert_array_equal(pauses.stops, [25, 40, 60, 70])
+    assert pauses.duration==45
+
+
+def test_empty_pauses():
+    pauses = PauseIntervals([], [])
+    assert len(pauses)==0
+    assert not pauses.mask(np.arange(10)).any()
+    with pytest.raises(ValueError):
+        PauseIntervals([1, 2], [3])
+
+
+@pytest.mark.parametrize('window_size', [1, 21, 30])
+def test_window_mask_matches_sliding_windows(elapsed_time, window_size):
+    pauses = PauseIntervals([100, 1000, 1010], [120, 1005, 1011])
+    mask = pauses.mask(elapsed_time)
+
+    expected = utils.sliding_window(mask, window_size, 1).any(axis=1)
+    window_mask = pauses.window_mask(elapsed_time, window_size)
+    np.testing.assert_array_equal(window_mask[(window_size - 1):], expected)
+    np.testing.assert_array_equal(
+        window_mask[:(window_size - 1)], np.cumsum(mask[:(window_size - 1)]) > 0)
+
+
+def test_from_mask_reproduces_mask(elapsed_time):
+    rng = np.random.default_rng(1)
+    mask = rng.random(len(elapsed_time)) < .05
+    mask[:3] = True
+    mask[-2:] = True
+
+    pauses = PauseIntervals.from_mask(elapsed_time, mask)
+    np.testing.assert_array_equal(pauses.mask(elapsed_time), mask)
+    assert len(PauseIntervals.from_mask([], []))==0
+
+
+def test_from_events():
+    t0 = pd.Timestamp('2019-04-01 12:00:00')
+    events = pd.DataFrame({
+        'event_type': ['start', 'stop', 'start', 'stop', 'start', 'stop'],
+        'event_time': t0 + pd.to_timedelta([0, 100.5, 130, 600, 601.9, 3600], unit='s'),
+    })
+
+    pauses = PauseIntervals.from_events(events, t0)
+    np.testing.assert_array_equal(pauses.starts, [100, 600])
+    np.testing.assert_array_equal(pauses.stops, [130, 601])
+
+
+def test_paused_time(elapsed_time):
+    pauses = PauseIntervals([-100, 1000], [10, 1100])
+    assert pauses.paused_time(elapsed_time)==110
+    assert pauses.paused_time(np.array([]))==0
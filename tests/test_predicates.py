@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from psycopg2 import sql
+
+from cypy2.predicates import (
+    parse_predicates, predicate_mask, predicates_to_mask, predicates_to_sql)
+
+
+@pytest.fixture
+def metadata():
+    return pd.DataFrame({
+        'activity_id': ['20180101120000', '20180601120000', '20190101120000', '20190401120000'],
+        'bike_name': ['lynskey-cx', 'giant-defy-advanced', 'lynskey-cx', None],
+        'total_distance': [50000, 20000, np.nan, 80000],
+        'strava_timestamp': pd.to_datetime(['2018-01-01', '2018-06-01', '2019-01-01', '2019-04-01']),
+    })
+
+
+def test_parse_predicates():
+    predicates = parse_predicates({
+        'activity_type': 'ride',
+        'total_distance__gt': 50000,
+        'device__model__in': ['a', 'b'],
+    })
+    assert predicates==[
+        ('activity_type', 'eq', 'ride'),
+        ('total_distance', 'gt', 50000),
+        ('device__model', 'in', ['a', 'b']),
+    ]
+
+
+def test_parse_predicates_errors():
+    with pytest.raises(ValueError):
+        parse_predicates({'total_distance__between': (1, 2)})
+    with pytest.raises(ValueError):
+        parse_predicates({'total_distance__range': (1, 2, 3)})
+
+
+@pytest.mark.parametrize('column, lookup, value, expected', [
+    ('bike_name', 'eq', 'lynskey-cx', [True, False, True, False]),
+    ('bike_name', 'ne', 'lynskey-cx', [False, True, False, True]),
+    ('bike_name', 'in', ['lynskey-cx', 'giant-defy-advanced'], [True, True, True, False]),
+    ('total_distance', 'gt', 50000, [False, False, False, True]),
+    ('total_distance', 'gte', 50000, [True, False, False, True]),
+    ('total_distance', 'lt', 50000, [False, True, False, False]),
+    ('total_distance', 'lte', 50000, [True, True, False, False]),
+    ('total_distance', 'range', (20000, 50000), [True, True, False, False]),
+    ('strava_timestamp', 'range', ('2018-03-01', '2019-01-01'), [False, True, True, False]),
+    ('strava_timestamp', 'gte', '2019-01-01', [False, False, True, True]),
+    ('activity_id', 'startswith', '2019', [False, False, True, True]),
+    ('bike_name', 'startswith', 'lyn', [True, False, True, False]),
+])
+def test_predicate_mask(metadata, column, lookup, value, expected):
+    np.testing.assert_array_equal(predicate_mask(metadata, column, lookup, value), expected)
+
+
+def test_predicates_to_mask(metadata):
+    predicates = parse_predicates({'bike_name': 'lynskey-cx', 'total_distance__gt': 0})
+    np.testing.assert_array_equal(predicates_to_mask(metadata, predicates), [True, False, False, False])
+    assert predicates_to_mask(metadata, []).all()
+
+
+def test_predicates_to_sql():
+    assert predicates_to_sql([])==sql.SQL('')
+
+    query = predicates_to_sql(parse_predicates({'bike_name__in': [], 'total_distance__gt': 0}))
+    assert isinstance(query, sql.Composed)
+    assert repr(sql.SQL('false')) in repr(query)
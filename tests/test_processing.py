@@ -0,0 +1,124 @@
+import pandas as pd
+import pytest
+
+from cypy2 import (utils, file_utils)
+from cypy2.activity import (Activity, LazyActivity, LocalActivity, PROCESSING_STAGES)
+
+import fit_writer
+
+
+@pytest.fixture(scope='module')
+def fit_data(tmp_path_factory):
+    filepath = fit_writer.write_ride(str(tmp_path_factory.mktemp('fit') / 'ride.fit'), num_records=1200)
+    return file_utils.parse_fit(filepath)
+
+
+@pytest.fixture
+def stage_calls(monkeypatch):
+    '''
+    The names of the processing stages that are run, in order
+    '''
+    calls = []
+    for method, _, _ in PROCESSING_STAGES:
+        def stage(self, records, state, method=method, original=getattr(Activity, method)):
+            calls.append(method)
+            return original(self, records, state)
+        monkeypatch.setattr(Activity, method, stage)
+    return calls
+
+
+def _lazy_activity(activity, cache):
+    '''
+    A LazyActivity with the raw data of an activity (and no processed data) already in the cache
+    '''
+    lazy_activity = LazyActivity(activity.metadata, None, cache)
+    cache.put((activity.metadata.activity_id, 'raw'), activity._raw_data)
+    cache.put((activity.metadata.activity_id, 'processed'), {})
+    return lazy_activity
+
+
+def test_stages_are_in_dependency_order():
+    outputs = set(['elapsed_time', 'distance', 'altitude', 'power'])
+    for method, inputs, stage_outputs in PROCESSING_STAGES:
+        assert set(inputs).issubset(outputs), method
+        outputs.update(stage_outputs)
+
+
+@pytest.mark.parametrize('columns', [
+    ['power'],
+    ['power_ma'],
+    ['grade', 'heart_rate'],
+    ['vam', 'pause_mask', 'speed', 'distance'],
+    ['elapsed_time', 'power_ma', 'vam'],
+    ['unknown_column', 'cadence'],
+])
+def test_records_columns_match_process_records(fit_data, columns):
+    processed_records = LocalActivity(fit_data).process_records()
+    records = LocalActivity(fit_data).records('processed', columns=columns)
+
+    # the columns are in the same order as in the processed records, and columns that do not exist are omitted
+    expected_columns = [column for column in processed_records.columns if column in columns]
+    pd.testing.assert_frame_equal(records, processed_records[expected_columns])
+
+
+@pytest.mark.parametrize('columns, expected_stages', [
+    (['power', 'heart_rate'], []),
+    (['pause_mask'], ['_pause_mask_stage']),
+    (['power_ma'], ['_pause_mask_stage', '_power_ma_stage']),
+    (['grade'], ['_pause_mask_stage', '_slopes_stage']),
+    (None, ['_pause_mask_stage', '_slopes_stage', '_power_ma_stage']),
+])
+def test_only_needed_stages_are_run(fit_data, stage_calls, columns, expected_stages):
+    LocalActivity(fit_data).records('processed', columns=columns)
+    assert stage_calls==expected_stages
+
+
+def test_activity_does_not_keep_columns(fit_data, stage_calls):
+    activity = LocalActivity(fit_data)
+    activity.records('processed', columns=['power_ma'])
+    activity.records('processed', columns=['power_ma'])
+    assert stage_calls==['_pause_mask_stage', '_power_ma_stage']*2
+    assert not hasattr(activity, '_lazy_processing_state')
+
+
+def test_lazy_activity_keeps_columns_in_cache(fit_data, stage_calls):
+    activity = LocalActivity(fit_data)
+    processed_records = activity.process_records()
+    stage_calls.clear()
+
+    cache = utils.LRUCache(2**30, utils.sizeof_dataframes)
+    lazy_activity = _lazy_activity(activity, cache)
+    key = (activity.metadata.activity_id, 'processing')
+
+    # the pause mask is calculated once, and the cached state grows with the calculated columns
+    power_ma = lazy_activity.records('processed', columns=['power_ma'])
+    size = cache._sizes[key]
+    grade = lazy_activity.records('processed', columns=['grade', 'power_ma'])
+    assert stage_calls==['_pause_mask_stage', '_power_ma_stage', '_slopes_stage']
+    assert cache._sizes[key] > size
+
+    pd.testing.assert_frame_equal(power_ma, processed_records[['power_ma']])
+    pd.testing.assert_frame_equal(grade, processed_records[['grade', 'power_ma']])
+    pd.testing.assert_frame_equal(lazy_activity.process_records(), processed_records)
+    assert stage_calls==['_pause_mask_stage', '_power_ma_stage', '_slopes_stage']
+
+    # the state is dropped once the activity has been processed
+    lazy_activity.process()
+    assert key not in cache
+
+
+def test_lazy_activity_recalculates_evicted_columns(fit_data, stage_calls):
+    activity = LocalActivity(fit_data)
+    cache = utils.LRUCache(2**30, utils.sizeof_dataframes)
+    lazy_activity = _lazy_activity(activity, cache)
+    lazy_activity.records('processed', columns=['pause_mask'])
+
+    cache.pop((activity.metadata.activity_id, 'processing'))
+    lazy_activity.records('processed', columns=['pause_mask'])
+    assert stage_calls==['_pause_mask_stage']*2
+
+
+def test_sizeof_dataframes_counts_arrays():
+    df = pd.DataFrame({'a': range(100)})
+    state = {'records': df, 'columns': {'a': df.a.values.astype(float), 'b': df.a.values}, 'pauses': None}
+    assert utils.sizeof_dataframes(state)==df.memory_usage(index=True, deep=True).sum() + 800 + 800
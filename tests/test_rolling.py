@@ -0,0 +1,82 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from cypy2 import utils
+
+
+def _pandas_rolling(values, window_size, stat, pause_mask=None):
+    '''
+    The same rolling statistic calculated by pandas
+    (the paused values are replaced by NaNs, so that the windows that overlap a pause are NaN)
+    '''
+    values = pd.Series(values, dtype=float)
+    if pause_mask is not None:
+        values[pause_mask] = np.nan
+
+    rolling = values.rolling(window_size, min_periods=window_size)
+    if stat=='std':
+        return rolling.std(ddof=0).values
+    return getattr(rolling, stat)().values
+
+
+def _sliding_window_mean(values, window_size, pause_mask):
+    '''
+    The moving average as it was originally calculated by Activity._calculate_moving_average
+    '''
+    windows = utils.sliding_window(values, window_size, 1)
+    windows[utils.sliding_window(pause_mask, window_size, 1)] = np.nan
+    return np.concatenate(([np.nan]*(window_size - 1), np.mean(windows, axis=1)))
+
+
+@pytest.fixture
+def power():
+    rng = np.random.default_rng(0)
+    values = rng.gamma(4, 50, 5000)
+    values[[10, 11, 2000, 4999]] = np.nan
+    return values
+
+
+@pytest.fixture
+def pause_mask():
+    mask = np.zeros(5000, dtype=bool)
+    mask[500:530] = True
+    mask[3000:3001] = True
+    return mask
+
+
+@pytest.mark.parametrize('stat', utils.ROLLING_STATS)
+@pytest.mark.parametrize('window_size', [1, 2, 30, 31, 4999, 5000, 6000])
+def test_rolling_stats_matches_pandas(power, pause_mask, stat, window_size):
+    result = utils.rolling_stats(power, window_size, stats=[stat], pause_mask=pause_mask)
+    expected = _pandas_rolling(power, window_size, stat, pause_mask)
+    np.testing.assert_allclose(result[(stat, window_size)], expected, rtol=1e-9, atol=1e-6)
+
+
+def test_rolling_stats_without_pauses(power):
+    results = utils.rolling_stats(power, [5, 60])
+    assert set(results.keys())=={(stat, size) for stat in utils.ROLLING_STATS for size in [5, 60]}
+    for (stat, window_size), result in results.items():
+        np.testing.assert_allclose(
+            result, _pandas_rolling(power, window_size, stat), rtol=1e-9, atol=1e-6)
+
+
+def test_rolling_mean_matches_original_moving_average(power, pause_mask):
+    power = np.where(np.isnan(power), 0, power)
+    np.testing.assert_allclose(
+        utils.rolling_mean(power, 30, pause_mask=pause_mask),
+        _sliding_window_mean(power, 30, pause_mask),
+        rtol=1e-9)
+
+
+def test_rolling_sum_is_precise_for_large_offsets():
+    values = 1e9 + np.arange(100000) % 7
+    result = utils.rolling_stats(values, 3, stats=['sum'])[('sum', 3)]
+    np.testing.assert_array_equal(result[2:], values[:-2] + values[1:-1] + values[2:])
+
+
+def test_rolling_stats_invalid_arguments():
+    with pytest.raises(ValueError):
+        utils.rolling_stats(np.arange(10.), 3, stats=['median'])
+    with pytest.raises(ValueError):
+        utils.rolling_stats(np.arange(10.), 0)
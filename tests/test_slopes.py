@@ -0,0 +1,113 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from cypy2 import utils, constants
+from cypy2.activity import Activity
+
+
+def _loop_slopes(records):
+    '''
+    The VAM and grade as they were originally calculated by Activity._calculate_slopes,
+    with a weighted linear regression (utils.weighted_linregress) in each window
+    '''
+    halflife = 7
+    window_sz = 3*halflife
+    alpha = (1 - np.exp(np.log(.5)/halflife))
+
+    weights = (1 - alpha)**(np.arange(0, window_sz, 1))
+    weights /= weights.sum()
+    weights = weights[::-1]
+
+    time_window = np.arange(window_sz)
+    pause_windows = utils.sliding_window(records.pause_mask.values, window_sz, 1)
+    distance_windows = utils.sliding_window(records.distance.values, window_sz, 1)
+    altitude_windows = utils.sliding_window(records.altitude.values, window_sz, 1)
+
+    vam, grade = [], []
+    for dist_window, alt_window, pause_window in zip(distance_windows, altitude_windows, pause_windows):
+        if np.any(pause_window):
+            vam.append(np.nan)
+            grade.append(np.nan)
+            continue
+
+        slope, offset, residual = utils.weighted_linregress(time_window, alt_window, weights)
+        vam.append(slope)
+
+        try:
+            slope, offset, residual = utils.weighted_linregress(dist_window, alt_window, weights)
+        except np.linalg.LinAlgError:
+            slope = np.nan
+
+        if np.abs(slope) > .3:
+            slope = np.nan
+        grade.append(slope)
+
+    vam = np.concatenate(([np.nan]*(window_sz - 1), vam))*constants.seconds_per_hour
+    grade = np.concatenate(([np.nan]*(window_sz - 1), grade))
+    return vam, grade
+
+
+@pytest.fixture
+def records():
+    rng = np.random.default_rng(0)
+    num_timepoints = 5000
+
+    # a ride with two stops (during which the distance is constant) and a paused stretch
+    speed = np.clip(rng.normal(8, 2, num_timepoints), 1, None)
+    speed[1000:1100] = 0
+    speed[3000:3030] = 0
+    pause_mask = np.zeros(num_timepoints, dtype=bool)
+    pause_mask[2000:2050] = True
+
+    distance = np.cumsum(speed)
+    altitude = 300 + np.cumsum(rng.normal(0, .2, num_timepoints)) + .03*distance
+    altitude[4000] = np.nan
+
+    return pd.DataFrame({
+        'elapsed_time': np.arange(num_timepoints),
+        'distance': distance,
+        'altitude': altitude,
+        'pause_mask': pause_mask,
+    })
+
+
+def test_slopes_match_loop(records):
+    vam, grade = Activity._calculate_slopes(records)
+    expected_vam, expected_grade = _loop_slopes(records)
+
+    np.testing.assert_array_equal(np.isnan(vam), np.isnan(expected_vam))
+    np.testing.assert_allclose(vam, expected_vam, rtol=1e-6, atol=1e-6)
+
+    # the grade is undefined in windows in which the distance is constant; 
+    # the loop's regression is singular there, but np.linalg.inv only sometimes raises a LinAlgError
+    distance_windows = utils.sliding_window(records.distance.values, 21, 1)
+    stationary = np.concatenate(([False]*20, distance_windows.max(axis=1)==distance_windows.min(axis=1)))
+    assert np.isnan(grade[stationary]).all()
+
+    grade, expected_grade = grade[~stationary], expected_grade[~stationary]
+    np.testing.assert_array_equal(np.isnan(grade), np.isnan(expected_grade))
+    np.testing.assert_allclose(grade, expected_grade, rtol=1e-6, atol=1e-9)
+
+
+def test_slopes_with_pause_intervals(records):
+    pauses = utils.PauseIntervals.from_mask(records.elapsed_time.values, records.pause_mask.values)
+    for result, expected in zip(
+        Activity._calculate_slopes(records, pauses=pauses), Activity._calculate_slopes(records)):
+        np.testing.assert_array_equal(result, expected)
+
+
+def test_vam_is_defined_when_stationary(records):
+    vam, grade = Activity._calculate_slopes(records)
+    assert np.isnan(grade[1020:1100]).all()
+    assert not np.isnan(vam[1020:1100]).any()
+
+
+def test_moving_average_with_pause_intervals(records):
+    records['power'] = np.random.default_rng(1).gamma(4, 50, len(records))
+    pauses = utils.PauseIntervals.from_mask(records.elapsed_time.values, records.pause_mask.values)
+
+    power_ma = Activity._calculate_moving_average(records, 'power', 30, pauses=pauses)
+    np.testing.assert_array_equal(power_ma, Activity._calculate_moving_average(records, 'power', 30))
+    assert np.isnan(power_ma[2000:2079]).all()
+    assert not np.isnan(power_ma[2079:2100]).any()
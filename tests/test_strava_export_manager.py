@@ -0,0 +1,173 @@
+import os
+import zipfile
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from cypy2 import file_utils
+from cypy2.strava.strava_export_manager import StravaExportManager
+
+import fit_writer
+
+
+def _write_export(dirpath, num_activities=3):
+    '''
+    Write a minimal Strava export: activities.csv and one .fit.gz file per activity
+    (with different numbers of records, so that the files have different contents)
+    '''
+    os.makedirs(os.path.join(dirpath, 'activities'))
+
+    rows = []
+    for ind in range(num_activities):
+        filename = 'activities/%d.fit.gz' % (1000 + ind)
+        fit_writer.write_ride(os.path.join(dirpath, filename), num_records=200 + 100*ind, pauses=[])
+        rows.append({
+            'id': 1000 + ind,
+            'date': 'Dec %d, 2018, 10:35:29 PM' % (8 + ind),
+            'name': 'Ride %d' % ind,
+            'type': 'Ride',
+            'gear': 'Bike',
+            'filename': filename,
+        })
+
+    pd.DataFrame(rows).to_csv(os.path.join(dirpath, 'activities.csv'), index=False)
+    return dirpath
+
+
+def _assert_activity_data_equal(activity_data, reference):
+    assert len(activity_data)==len(reference)
+    for data, reference_data in zip(activity_data, reference):
+        assert sorted(data)==sorted(reference_data)
+        for name in reference_data:
+            pd.testing.assert_frame_equal(data[name], reference_data[name])
+
+
+@pytest.fixture
+def export_dirpath(tmp_path, monkeypatch):
+    # the parsed data is cached in $HOME/parsed-strava-exports
+    monkeypatch.setenv('HOME', str(tmp_path / 'home'))
+    return _write_export(str(tmp_path / 'export'))
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_parse_all_cache(export_dirpath, workers):
+    manager = StravaExportManager(export_dirpath)
+    manager.parse_all(workers=workers)
+    assert not manager.parse_stats.cached.any()
+    assert len(manager.cache_keys)==3
+
+    filepaths = [os.path.join(export_dirpath, filename) for filename in manager.metadata.filename]
+    for data, filepath in zip(manager.activity_data, filepaths):
+        expected = file_utils.parse_fit(filepath)
+        for name in expected:
+            pd.testing.assert_frame_equal(data[name], expected[name])
+        assert manager.cache_keys[data['strava_metadata'].filename.iloc[0]]==\
+            manager.activity_cache.key(filepath)
+
+    # the second time, all of the files are loaded from the cache
+    cached_manager = StravaExportManager(export_dirpath)
+    cached_manager.parse_all(workers=workers)
+    assert cached_manager.parse_stats.cached.all()
+    assert cached_manager.cache_keys==manager.cache_keys
+    _assert_activity_data_equal(cached_manager.activity_data, manager.activity_data)
+
+    # the files are not hashed if the cache is not used
+    uncached_manager = StravaExportManager(export_dirpath)
+    uncached_manager.parse_all(workers=workers, use_cache=False)
+    assert not uncached_manager.parse_stats.cached.any()
+    assert not uncached_manager.cache_keys
+    _assert_activity_data_equal(uncached_manager.activity_data, manager.activity_data)
+
+
+def test_lazy_activity_data(export_dirpath):
+    manager = StravaExportManager(export_dirpath)
+    manager.parse_all(use_cache=False)
+
+    # the memory budget only fits one activity at a time
+    lazy_manager = StravaExportManager(export_dirpath, lazy=True, memory_budget=50000)
+    activity_data = lazy_manager.activity_data
+    assert len(activity_data)==3
+    _assert_activity_data_equal(activity_data[:], manager.activity_data)
+    _assert_activity_data_equal([activity_data[-1]], manager.activity_data[-1:])
+    with pytest.raises(IndexError):
+        activity_data[3]
+
+    stats = activity_data.cache_stats()
+    assert stats['num_values']==1 and stats['evictions']==2
+    assert stats['num_bytes'] <= stats['max_bytes']
+
+    # the parsed files were cached when they were first loaded
+    lazy_manager.to_cache()
+    cached_manager = StravaExportManager(
+        export_dirpath, from_cache=True, lazy=True, 
+        message_names=['record'], field_names={'record': ['timestamp', 'power']})
+    assert sorted(cached_manager.cache_keys)==sorted(manager.metadata.filename)
+    for data, reference_data in zip(cached_manager.activity_data, manager.activity_data):
+        assert sorted(data)==['record', 'strava_metadata']
+        pd.testing.assert_frame_equal(data['record'], reference_data['record'][['timestamp', 'power']])
+
+
+@pytest.mark.parametrize('dirname', ['', 'export'])
+def test_parse_zipped_export(export_dirpath, tmp_path, dirname):
+    manager = StravaExportManager(export_dirpath)
+    manager.parse_all(use_cache=False)
+
+    # the export is zipped either at its root or (if it was re-zipped after extraction) in a directory
+    zip_filepath = str(tmp_path / 'export.zip')
+    with zipfile.ZipFile(zip_filepath, 'w') as archive:
+        for filename in ['activities.csv'] + list(manager.metadata.filename):
+            archive.write(
+                os.path.join(export_dirpath, filename), '/'.join(filter(None, [dirname, filename])))
+
+    zipped_manager = StravaExportManager(zip_filepath)
+    assert zipped_manager.root_dirname=='export'
+    zipped_manager.parse_all(workers=2)
+    assert not zipped_manager.parsing_errors
+    _assert_activity_data_equal(zipped_manager.activity_data, manager.activity_data)
+
+    # the cache keys are the hashes of the zipped files' contents
+    assert sorted(zipped_manager.cache_keys.values())==sorted(
+        zipped_manager.activity_cache.key(os.path.join(export_dirpath, filename)) 
+        for filename in manager.metadata.filename)
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_parse_all_errors_and_stats(export_dirpath, workers):
+
+    # add a truncated FIT file, a missing file, and a GPX activity (which is ignored)
+    with open(os.path.join(export_dirpath, 'activities', '1000.fit.gz'), 'rb') as file:
+        contents = file.read()
+    with open(os.path.join(export_dirpath, 'activities', 'truncated.fit.gz'), 'wb') as file:
+        file.write(contents[:len(contents)//2])
+
+    metadata = pd.read_csv(os.path.join(export_dirpath, 'activities.csv'))
+    extra_rows = pd.DataFrame({
+        'id': [2000, 2001, 2002],
+        'filename': ['activities/truncated.fit.gz', 'activities/missing.fit.gz', 'activities/2002.gpx'],
+    })
+    metadata = pd.concat([metadata, extra_rows], ignore_index=True)
+    metadata.to_csv(os.path.join(export_dirpath, 'activities.csv'), index=False)
+
+    manager = StravaExportManager(export_dirpath)
+    callback_stats = []
+    manager.parse_all(workers=workers, callback=callback_stats.append)
+
+    assert len(manager.activity_data)==3
+    assert [row.filename for row, error in manager.parsing_errors]==[
+        'activities/truncated.fit.gz', 'activities/missing.fit.gz']
+
+    stats = manager.parse_stats
+    assert list(stats.filename)==list(metadata.filename[:5])
+    assert [s['filename'] for s in callback_stats]==list(stats.filename)
+    assert list(stats.columns[:5])==['filename', 'cached', 'wall_time', 'num_bytes', 'num_records']
+    assert stats.columns[-1]=='error'
+
+    assert list(stats.num_records)==[200, 300, 400, 0, 0]
+    assert list(stats.num_event)==[2, 2, 2, 0, 0]
+    assert stats.error[:3].isnull().all() and stats.error[3:].notnull().all()
+    assert stats.num_bytes[3]==len(contents)//2 and np.isnan(stats.num_bytes[4])
+
+    throughput = manager.parse_throughput.iloc[0]
+    assert throughput.num_files==5 and throughput.num_records==900
+    assert throughput.records_per_sec > 0
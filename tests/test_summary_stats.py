@@ -0,0 +1,91 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from cypy2.summary_stats import (SUMMARY_COLUMNS, summarize_records)
+
+
+@pytest.fixture
+def records():
+    return pd.DataFrame({
+        'distance': [0, 1, 2, 3.],
+        'altitude': [0, 10, 5, 8.],
+        'power': [100, 200, 300, 400.],
+        'power_ma': [np.nan, np.nan, 200, 300.],
+        'heart_rate': [120, 130, 170, 140.],
+        'pause_mask': [False, False, True, False],
+    })
+
+
+def _random_records(rng, num_timepoints):
+    pause_mask = np.zeros(num_timepoints, dtype=bool)
+    pause_mask[(num_timepoints//3):(num_timepoints//2)] = True
+    power = rng.gamma(4, 50, num_timepoints)
+    power[rng.random(num_timepoints) < .01] = np.nan
+    return pd.DataFrame({
+        'distance': np.cumsum(rng.random(num_timepoints)*.005),
+        'altitude': 1000 + np.cumsum(rng.normal(0, 1, num_timepoints)),
+        'power': power,
+        'power_ma': pd.Series(power).rolling(30).mean().values,
+        'heart_rate': rng.normal(140, 10, num_timepoints),
+        'pause_mask': pause_mask,
+    })
+
+
+def test_summary_values(records):
+    summary = summarize_records(records, threshold_powers=250).iloc[0]
+
+    assert list(summary.index)==SUMMARY_COLUMNS
+    assert summary.total_elapsed_time==4
+    assert summary.moving_time==3
+    assert summary.total_distance==3
+    assert summary.total_ascent==13
+    assert summary.total_descent==5
+
+    # the averages exclude the paused timepoint, but the maxima do not
+    assert summary.avg_power==pytest.approx(700/3)
+    assert summary.max_power==400
+    assert summary.normalized_power==pytest.approx(300)
+    assert summary.avg_heart_rate==pytest.approx(130)
+    assert summary.max_heart_rate==170
+
+    assert summary.threshold_power==250
+    assert summary.intensity_factor==pytest.approx(1.2)
+    assert summary.training_stress_score==pytest.approx(100*3/3600*1.2**2)
+
+
+def test_missing_columns_and_threshold_power(records):
+    summary = summarize_records(records[['distance', 'altitude']]).iloc[0]
+    assert summary.moving_time==4
+    assert np.isnan(summary[['avg_power', 'normalized_power', 'avg_heart_rate']]).all()
+    assert np.isnan(summary[['threshold_power', 'intensity_factor', 'training_stress_score']]).all()
+
+    summary = summarize_records(records, threshold_powers=0).iloc[0]
+    assert np.isnan(summary.intensity_factor)
+
+
+def test_batch_matches_single_activities(records):
+    rng = np.random.default_rng(0)
+    many_records = [_random_records(rng, num_timepoints) for num_timepoints in [3600, 1, 7200, 500]]
+    many_records += [records, records.iloc[:0], records[['power']]]
+    threshold_powers = [250, 300, None, 0, 250, 250, 250]
+
+    summary = summarize_records(many_records, threshold_powers=np.array(threshold_powers, dtype=float))
+    assert summary.shape==(len(many_records), len(SUMMARY_COLUMNS))
+
+    for ind, (records, threshold_power) in enumerate(zip(many_records, threshold_powers)):
+        pd.testing.assert_frame_equal(
+            summary.iloc[[ind]].reset_index(drop=True),
+            summarize_records(records, threshold_powers=threshold_power))
+
+
+def test_empty_activity(records):
+    summary = summarize_records([records.iloc[:0]]).iloc[0]
+    assert summary.total_elapsed_time==0
+    assert np.isnan(summary[['total_distance', 'total_ascent', 'avg_power', 'max_power']]).all()
+
+
+def test_timestep(records):
+    summary = summarize_records(records, timestep=2).iloc[0]
+    assert summary.total_elapsed_time==8
+    assert summary.moving_time==6
@@ -0,0 +1,84 @@
+import os
+import time
+import pickle
+
+import numpy as np
+import pytest
+
+from cypy2 import utils
+
+
+def _interp_each_column(x, y, new_x):
+    return np.stack([np.interp(new_x, x, y[:, ind]) for ind in range(y.shape[1])], axis=1)
+
+
+def test_interpolate_columns_matches_np_interp():
+    rng = np.random.default_rng(0)
+    x = np.cumsum(rng.integers(1, 5, 1000)).astype(float)
+    y = rng.normal(size=(1000, 4))
+    new_x = np.arange(-3, x[-1] + 3, .5)
+
+    np.testing.assert_allclose(
+        utils.interpolate_columns(x, y, new_x), _interp_each_column(x, y, new_x), rtol=1e-12)
+
+
+def test_interpolate_columns_with_nans():
+    x = np.arange(10.)
+    y = np.tile(np.arange(10.)[:, None], (1, 3))
+    y[0, 0] = np.nan
+    y[4, 1] = np.nan
+    y[9, 2] = np.nan
+    new_x = np.array([0, .5, 3.5, 4, 4.5, 8.5, 9, 12])
+
+    result = utils.interpolate_columns(x, y, new_x)
+    np.testing.assert_array_equal(np.isnan(result), np.isnan(_interp_each_column(x, y, new_x)))
+    np.testing.assert_allclose(result, _interp_each_column(x, y, new_x))
+
+
+def test_interpolate_columns_at_existing_x_values():
+    x = np.array([0., 1, 2, 5])
+    y = np.array([[1., np.inf], [2, 3], [4, 5], [6, 7]])
+    result = utils.interpolate_columns(x, y, x)
+    np.testing.assert_array_equal(result, y)
+
+
+def test_mask_internal_nans():
+    values = np.array([np.nan, 1, np.nan, np.nan, 2, np.nan])
+    np.testing.assert_array_equal(
+        utils.mask_internal_nans(values), [False, False, True, True, False, False])
+
+    values = np.stack((values, np.full(6, np.nan)), axis=1)
+    assert not utils.mask_internal_nans(values)[:, 1].any()
+
+
+def test_write_atomically(tmp_path):
+    path = str(tmp_path / 'data.p')
+    utils.write_atomically(path, lambda file: pickle.dump({'a': 1}, file))
+    with open(path, 'rb') as file:
+        assert pickle.load(file)=={'a': 1}
+
+    # a failed write leaves neither the file nor the temporary file
+    def write(file):
+        file.write(b'partial')
+        raise RuntimeError('failed')
+
+    with pytest.raises(RuntimeError):
+        utils.write_atomically(str(tmp_path / 'failed.p'), write)
+    assert os.listdir(str(tmp_path))==['data.p']
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_imap_in_pool(workers):
+    with utils.imap_in_pool(abs, range(-10, 0), workers=workers, chunksize=3) as results:
+        assert list(results)==list(range(10, 0, -1))
+
+
+def test_imap_in_pool_terminates_on_error():
+
+    # the pool is terminated instead of waiting for the remaining (slow) items
+    start_time = time.time()
+    with pytest.raises(RuntimeError):
+        with utils.imap_in_pool(time.sleep, [0, 2, 2, 2, 2], workers=2) as results:
+            next(results)
+            raise RuntimeError('failed')
+    assert time.time() - start_time < 1.5